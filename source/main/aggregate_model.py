@@ -0,0 +1,198 @@
+#曜日の対称性を持たない集約モデル
+#api_pyomo_model4 の x[d, r] は7日分が入れ替え可能なため、同じ解が 7! 通りできてしまう。
+#ここでは「週に何回そのレシピを使うか」と「献立の型ごとの日数」だけを決め、曜日への割り当ては解いた後に行う。
+import numpy as np
+import pyomo.environ as pyo
+from pyomo.core.expr.numeric_expr import LinearExpression
+
+from .matrix_model import (
+    build_matrices, nutrition_bounds, PFC_KEYS, OTHER_KEYS, STAPLE_SPECIAL_KIND2,
+    WEIGHT_ITEM, WEIGHT_REGIST, PENALTY_NOT_USE, WEIGHT_MULTIPLE, big_m_values,
+)
+
+MEAL_KINDS = ('staple', 'main', 'side', 'soup')
+
+def _count_expr(model, recipes, coefs=None):
+    if coefs is None:
+        coefs = [1] * len(recipes)
+    return LinearExpression(constant=0, linear_coefs=[float(c) for c in coefs], linear_vars=[model.n[r] for r in recipes])
+
+
+def build_model(
+    days,
+    recipe_dict,
+    recipe_ids,
+    recipeitem_dict,
+    filtered_recipe_nutritions,
+    nutritionaltarget_dict,
+    itemweight_dict,
+    itemequal_dict,
+    menstruation,
+    regist_item,
+    use_pfc=True,
+    matrices=None,
+    tight_big_m=False
+):
+    if matrices is None:
+        matrices = build_matrices(recipe_ids, recipeitem_dict, filtered_recipe_nutritions)
+    recipe_ids = matrices.recipe_ids
+    days = list(days)
+    n_days = len(days)
+    big_m_regist, big_m_link, _ = big_m_values(matrices, recipe_dict, n_days, tight_big_m)
+
+    model = pyo.ConcreteModel()
+    model.Days = pyo.Set(initialize=days)
+    model.Recipes = pyo.Set(initialize=recipe_ids)
+
+    kind1 = {r: recipe_dict[r]['data']['kind1'] for r in recipe_ids}
+    kind2 = {r: recipe_dict[r]['data']['kind2'] for r in recipe_ids}
+    model.kind1_map = pyo.Param(model.Recipes, initialize=kind1, within=pyo.Any)
+    model.kind2_map = pyo.Param(model.Recipes, initialize=kind2, within=pyo.Any)
+
+    special = [r for r in recipe_ids if kind1[r] == 'staple' and kind2[r] in STAPLE_SPECIAL_KIND2]
+    special_set = set(special)
+    model.StapleSpecialRecipes = pyo.Set(initialize=special)
+
+    # 週の使用回数の上限（model4の RecipeUsage と LimitGohan/LimitNonGohan を両方満たす値）
+    def usage_cap(r):
+        cap = n_days if r in special_set else 1
+        return min(cap, n_days if kind2[r] == 'ご飯' else 1)
+
+    # --- 変数：レシピごとの週の使用回数と、献立の型ごとの日数 ---
+    model.n = pyo.Var(model.Recipes, domain=pyo.NonNegativeIntegers, bounds=lambda m, r: (0, usage_cap(r)))
+    # full: 主食+主菜+副菜+汁物の日 / special: ご飯もの等の主食+副菜+汁物の日
+    model.full_days = pyo.Var(domain=pyo.NonNegativeIntegers, bounds=(0, n_days))
+    model.special_days = pyo.Var(domain=pyo.NonNegativeIntegers, bounds=(0, n_days))
+
+    by_kind = {k: [r for r in recipe_ids if kind1[r] == k] for k in MEAL_KINDS}
+    normal_staple = [r for r in by_kind['staple'] if r not in special_set]
+    others = [r for r in recipe_ids if kind1[r] not in MEAL_KINDS]
+
+    # --- 献立の構成 ---
+    model.DayTypes = pyo.Constraint(expr=model.full_days + model.special_days == n_days)
+    model.NormalStapleCount = pyo.Constraint(expr=_count_expr(model, normal_staple) == model.full_days)
+    model.SpecialStapleCount = pyo.Constraint(expr=_count_expr(model, special) == model.special_days)
+    model.MainCount = pyo.Constraint(expr=_count_expr(model, by_kind['main']) == model.full_days)
+    model.SideCount = pyo.Constraint(expr=_count_expr(model, by_kind['side']) == n_days)
+    model.SoupCount = pyo.Constraint(expr=_count_expr(model, by_kind['soup']) == n_days)
+    # 1日4品まで：分類外のレシピは3品の日にだけ追加できる
+    if others:
+        model.OtherCount = pyo.Constraint(expr=_count_expr(model, others) <= model.special_days)
+
+    # --- 栄養素 ---
+    nutritionals = next(iter(nutritionaltarget_dict.values()))['nutritionals']
+    nut_keys = PFC_KEYS + OTHER_KEYS if use_pfc else OTHER_KEYS
+
+    def nutrition_rule(m, nut):
+        bounds = nutrition_bounds(nut, nutritionals, menstruation)
+        if bounds is None:
+            return pyo.Constraint.Skip
+        rows, coefs = matrices.nutrient_column(nut)
+        return pyo.inequality(bounds[0], _count_expr(m, [recipe_ids[k] for k in rows], coefs), bounds[1])
+    model.NutritionConstraints = pyo.Constraint(nut_keys, rule=nutrition_rule)
+
+    # --- 食材 ---
+    positive = np.asarray((matrices.A > 0).sum(axis=0)).ravel() > 0
+    ingredients = [i for j, i in enumerate(matrices.items) if positive[j]]
+    model.Ingredients = pyo.Set(initialize=ingredients)
+
+    usage = {}
+    for i in set(ingredients) | set(regist_item.keys()) | set(itemweight_dict.keys()):
+        rows, coefs = matrices.item_column(i)
+        usage[i] = _count_expr(model, [recipe_ids[k] for k in rows], coefs)
+
+    model.item_used = pyo.Var(itemweight_dict.keys(), domain=pyo.Binary)
+    model.y_item = pyo.Var(model.Ingredients, domain=pyo.Binary)
+
+    model.Unused = pyo.Var(regist_item.keys(), domain=pyo.NonNegativeReals)
+    model.RegistItemBalance = pyo.Constraint(
+        regist_item.keys(), rule=lambda m, i: usage[i] + m.Unused[i] == regist_item[i])
+
+    model.RegistIngredients = pyo.Set(initialize=[i for i in ingredients if i in regist_item])
+    model.y_regist = pyo.Var(model.RegistIngredients, domain=pyo.Binary)
+    model.YRegistConstraint = pyo.Constraint(
+        model.RegistIngredients, rule=lambda m, i: usage[i] <= big_m_regist[i] * m.y_regist[i])
+
+    model.ItemUsedCalc = pyo.Constraint(itemweight_dict.keys(), rule=lambda m, i: m.item_used[i] >= usage[i])
+    model.IngredientLink = pyo.Constraint(model.Ingredients, rule=lambda m, i: usage[i] <= big_m_link[i] * m.y_item[i])
+
+    # --- 倍数ルールの誤差 ---
+    # model4 の e[d,r,i] は最適解で |x[d,r]*量 - 重さの倍数| になるので、7日分の合計は
+    # (7 - n[r]) * 倍数 + n[r] * |量 - 倍数| と使用回数の一次式で書ける
+    multiple_const = 0.0
+    multiple_coef = {}
+    for i in ingredients:
+        if i not in itemweight_dict or not itemweight_dict[i].get("weights"):
+            continue
+        weight = itemweight_dict[i]["weights"][0]
+        rows, coefs = matrices.item_column(i)
+        for k, a in zip(rows, coefs):
+            if a <= 0:
+                continue
+            nearest = weight * round(a / weight)
+            multiple_const += n_days * nearest
+            r = recipe_ids[k]
+            multiple_coef[r] = multiple_coef.get(r, 0) + abs(a - nearest) - nearest
+    model.multiple_error = pyo.Expression(
+        expr=multiple_const + _count_expr(model, list(multiple_coef), list(multiple_coef.values())))
+
+    # --- 目的関数（model4と同じ項） ---
+    model.obj = pyo.Objective(
+        expr = sum(WEIGHT_ITEM * model.y_item[i] for i in model.Ingredients)
+            - sum(WEIGHT_REGIST * model.y_regist[i] for i in model.RegistIngredients)
+            + PENALTY_NOT_USE * sum(1 - model.y_regist[i] for i in model.RegistIngredients)
+            + WEIGHT_MULTIPLE * model.multiple_error,
+        sense = pyo.minimize
+    )
+
+    return model
+
+
+#解いた後に献立を曜日へ割り当てる（同じ入力なら必ず同じ割り当てになる）
+def extract_day_menus(model):
+    days = list(model.Days)
+    n_days = len(days)
+    counts = {}
+    for r in model.Recipes:
+        val = pyo.value(model.n[r], exception=False)
+        if val is not None and round(val) > 0:
+            counts[r] = int(round(val))
+
+    def expand(recipes):
+        return [r for r in sorted(recipes) for _ in range(counts.get(r, 0))]
+
+    special_set = set(model.StapleSpecialRecipes)
+    kinds = {r: model.kind1_map[r] for r in counts}
+    special = expand(r for r in counts if r in special_set)
+    normal = expand(r for r in counts if kinds[r] == 'staple' and r not in special_set)
+    mains = expand(r for r in counts if kinds[r] == 'main')
+    sides = expand(r for r in counts if kinds[r] == 'side')
+    soups = expand(r for r in counts if kinds[r] == 'soup')
+    others = expand(r for r in counts if kinds[r] not in MEAL_KINDS)
+
+    # 3品の日（ご飯もの等）は週の中でなるべく均等に散らす
+    n_special = len(special)
+    special_day = [
+        (k + 1) * n_special // n_days > k * n_special // n_days
+        for k in range(n_days)
+    ]
+
+    day_menus = {}
+    for k, d in enumerate(days):
+        menu = {}
+        if special_day[k]:
+            menu['staple'] = special.pop(0)
+            if others:
+                other = others.pop(0)
+                menu[kinds[other]] = other
+        else:
+            if normal:
+                menu['staple'] = normal.pop(0)
+            if mains:
+                menu['main'] = mains.pop(0)
+        if sides:
+            menu['side'] = sides.pop(0)
+        if soups:
+            menu['soup'] = soups.pop(0)
+        day_menus[f"menu{d}"] = menu
+    return day_menus
@@ -181,8 +181,9 @@ def build_model(
 
     model.RegistItemBalance = pyo.Constraint(regist_item.keys(), rule=used_amount_rule)
 
-    # 登録食材を使ったかどうか（0/1）
-    model.y_regist = pyo.Var(model.Ingredients, domain=pyo.Binary)
+    # 登録食材を使ったかどうか（0/1）※登録された食材のみ
+    model.RegistIngredients = pyo.Set(initialize=[i for i in model.Ingredients if i in regist_item])
+    model.y_regist = pyo.Var(model.RegistIngredients, domain=pyo.Binary)
     def y_regist_rule(m, i):
         # 1週間のどこかで i が使われていたら 1
         total_used = sum(
@@ -194,28 +195,23 @@ def build_model(
         return total_used <= BIG_M * m.y_regist[i]
 
     BIG_M = 1000
-    model.YRegistConstraint = pyo.Constraint(model.Ingredients, rule=y_regist_rule)
+    model.YRegistConstraint = pyo.Constraint(model.RegistIngredients, rule=y_regist_rule)
 
     # 指定の食材の使用量を指定の値の倍数にするための制約
-    model.e = pyo.Var(model.Days, model.Recipes, model.Ingredients, within=pyo.NonNegativeReals)
+    # 誤差変数は「レシピがその食材を使い、かつ食材の重さが登録されている」組だけに作る
+    weight_pairs = [
+        (r, i) for r in recipe_ids for i, v in recipeitem_dict[r].items()
+        if v > 0 and i in itemweight_dict and itemweight_dict[i].get("weights")
+    ]
+    model.WeightIndex = pyo.Set(dimen=3, initialize=[(d, r, i) for d in days for (r, i) in weight_pairs])
+    model.e = pyo.Var(model.WeightIndex, within=pyo.NonNegativeReals)
     def multiple_soft_rule(m, d, r, i):
-        # 倍数ルールの対象外の食材はスキップ
-        if i not in itemweight_dict:
-            return pyo.Constraint.Skip
-
         # 一つ目の重さ（基準重量）
-        weight_list = itemweight_dict[i].get("weights", [])
-        if not weight_list:
-            return pyo.Constraint.Skip
-        weight = weight_list[0]
+        weight = itemweight_dict[i]["weights"][0]
 
         # レシピで使う食材量（g） ※ここは整数
         amount = recipeitem_dict[r].get(i, 0)
 
-        # x[d,r] = 0 → 使わない → 誤差も 0
-        if amount == 0:
-            return m.e[d, r, i] >= 0
-
         # 最も近い weight の倍数
         mult = round(amount / weight)
 
@@ -223,16 +219,13 @@ def build_model(
         return m.e[d, r, i] >= m.x[d, r] * amount - (weight * mult)
 
     def multiple_soft_rule2(m, d, r, i):
-        if i not in itemweight_dict:
-            return pyo.Constraint.Skip
-
         weight = itemweight_dict[i]["weights"][0]
         amount = recipeitem_dict[r].get(i, 0)
 
         return m.e[d,r,i] >= weight * round(amount / weight) - m.x[d,r] * amount
 
-    model.MultipleSoft1 = pyo.Constraint(model.Days, model.Recipes, model.Ingredients, rule=multiple_soft_rule)
-    model.MultipleSoft2 = pyo.Constraint(model.Days, model.Recipes, model.Ingredients, rule=multiple_soft_rule2)
+    model.MultipleSoft1 = pyo.Constraint(model.WeightIndex, rule=multiple_soft_rule)
+    model.MultipleSoft2 = pyo.Constraint(model.WeightIndex, rule=multiple_soft_rule2)
 
     # 同一食材の紐付け対策
     target_items = set(itemweight_dict.keys()) | set(itemequal_dict.keys())
@@ -326,9 +319,9 @@ def build_model(
 
     model.obj = pyo.Objective(
         expr = sum(weight_item * model.y_item[i] for i in model.Ingredients)
-            - sum(weight_regist * model.y_regist[i] for i in model.Ingredients)
-            + penalty_not_use * sum(1 - model.y_regist[i] for i in model.Ingredients)
-            + weight_multiple * sum(model.e[d,r,i] for d in model.Days for r in model.Recipes for i in model.Ingredients),
+            - sum(weight_regist * model.y_regist[i] for i in model.RegistIngredients)
+            + penalty_not_use * sum(1 - model.y_regist[i] for i in model.RegistIngredients)
+            + weight_multiple * sum(model.e[d,r,i] for (d,r,i) in model.WeightIndex),
         sense = pyo.minimize
     )
     # 修正部分（作成した献立を返す）
@@ -0,0 +1,443 @@
+#モデル作成・求解のベンチマーク（Flask・DBを使わず data/*.json を直接読む）
+#python -m source.main.benchmark build --scale 1 10 をリポジトリ直下で実行
+#python -m source.main.benchmark solve --out before.csv → 変更後に --out after.csv → compare before.csv after.csv
+#python -m source.main.benchmark backends --profiles 3 でPyomo経由とMPS直接書き出しを比べる（CBCが必要）
+import argparse,time,csv,json,statistics
+from pyomo.repn import generate_standard_repn
+import pyomo.environ as pyo
+
+from .catalog import Catalog, load_json_catalog, load_json_targets
+from .optimize import (
+    CBC_PATH, SOLVER_TIME_LIMIT, SOLVER_RATIO_GAP, SOLVER_LIMIT_OPTIONS,
+    make_build_args, make_solver, wrap_nutritional_target, timed_solve, set_warm_start,
+)
+from .presolve import USE_PRESOLVE, presolve, add_objective_offset
+from . import formulations, direct_cbc
+from .metrics import timed
+
+BUILDERS = {
+    'model4': lambda: formulations.get('model4').build,
+    'matrix': lambda: formulations.get('matrix').build,
+    'aggregate': lambda: formulations.get('aggregate').build,
+}
+
+#レシピを factor 倍に複製したカタログ（IDは元のID*100+連番）
+def scale_catalog(catalog, factor):
+    if factor == 1:
+        return catalog
+    recipe_dict, recipeitem_dict, recipe_nutritions = {}, {}, {}
+    for k in range(factor):
+        for rid, rec in catalog.recipe_dict.items():
+            new_id = rid if k == 0 else rid * 100 + k
+            recipe_dict[new_id] = {'recipeId': new_id, 'data': rec['data']}
+            recipeitem_dict[new_id] = catalog.recipeitem_dict[rid]
+            recipe_nutritions[new_id] = catalog.recipe_nutritions[rid]
+    return Catalog(
+        version=f"{catalog.version}x{factor}",
+        recipe_dict=recipe_dict,
+        recipeitem_dict=recipeitem_dict,
+        recipe_nutritions=recipe_nutritions,
+        itemweight_dict=catalog.itemweight_dict,
+        itemequal_dict=catalog.itemequal_dict,
+    )
+
+def sample_build_args(catalog, target, menstruation='なし', regist_item=None):
+    nutritionaltarget_dict = wrap_nutritional_target(dict(target))
+    return make_build_args(catalog, nutritionaltarget_dict, target['userInfo'], menstruation, regist_item or {})
+
+def model_size(model):
+    n_vars = sum(len(v) for v in model.component_objects(pyo.Var, active=True))
+    n_cons = sum(1 for _ in model.component_data_objects(pyo.Constraint, active=True))
+    return n_vars, n_cons
+
+#制約行列の非ゼロ要素数
+def model_nnz(model):
+    return sum(
+        len(generate_standard_repn(c.body, compute_values=True).linear_vars)
+        for c in model.component_data_objects(pyo.Constraint, active=True)
+    )
+
+#制約ごとに (下限, 上限, {変数名: 係数}) を作り、2つのモデルが同じか確認する
+def _linear_form(expr):
+    repn = generate_standard_repn(expr, compute_values=True)
+    coefs = {}
+    for v, c in zip(repn.linear_vars, repn.linear_coefs):
+        coefs[v.name] = coefs.get(v.name, 0) + c
+    return {k: round(c, 9) for k, c in coefs.items() if c != 0}, repn.constant
+
+def model_signature(model):
+    cons = {}
+    for c in model.component_data_objects(pyo.Constraint, active=True):
+        coefs, const = _linear_form(c.body)
+        lb = None if c.lower is None else round(pyo.value(c.lower) - const, 9)
+        ub = None if c.upper is None else round(pyo.value(c.upper) - const, 9)
+        cons[c.name] = (lb, ub, coefs)
+    variables = {v.name: (str(v.domain), v.lb, v.ub) for v in model.component_data_objects(pyo.Var)}
+    obj = next(model.component_data_objects(pyo.Objective, active=True))
+    return variables, cons, _linear_form(obj.expr)
+
+def compare_models(m1, m2):
+    v1, c1, o1 = model_signature(m1)
+    v2, c2, o2 = model_signature(m2)
+    diffs = []
+    if v1 != v2:
+        diffs.append(f"変数が異なる: {len(set(v1) ^ set(v2))}件")
+    for name in sorted(set(c1) | set(c2)):
+        if c1.get(name) != c2.get(name):
+            diffs.append(f"制約 {name} が異なる")
+    if o1[0] != o2[0] or round(o1[1], 9) != round(o2[1], 9):
+        diffs.append("目的関数が異なる")
+    return diffs
+
+def bench_build(scales, builders, repeat, check):
+    base = load_json_catalog()
+    target = load_json_targets()[0]
+    regist_item = {'卵': 100, 'ご飯': 300}
+    for factor in scales:
+        catalog = scale_catalog(base, factor)
+        build_args = sample_build_args(catalog, target, regist_item=regist_item)
+        models = {}
+        for name in builders:
+            build_model = BUILDERS[name]()
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                model = build_model(**build_args)
+                times.append(time.perf_counter() - start)
+            models[name] = model
+            n_vars, n_cons = model_size(model)
+            print(f"recipes={len(catalog.recipe_ids):5d} builder={name:7s} build={min(times):8.3f}s vars={n_vars} cons={n_cons}")
+        if check and len(models) > 1:
+            names = list(models)
+            diffs = compare_models(models[names[0]], models[names[1]])
+            print(f"  {names[0]} vs {names[1]}: " + ("同じモデル" if not diffs else f"差分あり {diffs[:5]}"))
+
+# 全プロファイルで試す登録食材
+SAMPLE_REGIST_ITEMS = [
+    {},
+    {'にんじん': 200, '玉ねぎ': 200},
+    {'鶏もも肉': 300, 'キャベツ': 200, 'ご飯': 600},
+    {'卵': 100, '豚こま切れ肉': 200, '大根': 300},
+]
+MENSTRUATIONS = ['なし', 'あり']
+
+REPORT_FIELDS = [
+    'formulation', 'profile', 'menstruation', 'regist', 'use_pfc', 'recipes',
+    'build_s', 'vars', 'cons', 'nnz', 'solve_s', 'status', 'objective', 'gap',
+    'nodes', 'root_bound', 'root_gap',
+]
+
+def profile_label(target):
+    info = target['userInfo']
+    return f"{info['年齢']}/{info['性別']}/{info['運動レベル']}"
+
+#ソルバーが返した上下界から相対ギャップを計算する（分からなければ None）
+def result_gap(results):
+    try:
+        upper = results.problem.upper_bound
+        lower = results.problem.lower_bound
+    except AttributeError:
+        return None
+    if upper is None or lower is None or abs(upper) == float('inf') or abs(lower) == float('inf'):
+        return None
+    return abs(upper - lower) / max(abs(upper), 1e-9)
+
+#分枝限定法のノード数（ソルバーが返さなければ None）
+def result_nodes(results, solver):
+    try:
+        nodes = results.solver.statistics.branch_and_bound.number_of_created_subproblems
+        if nodes is not None and not isinstance(nodes, str):
+            return int(nodes)
+    except (AttributeError, TypeError, ValueError):
+        pass
+    # appsi_highs は highspy のオブジェクトから読む
+    highs = getattr(solver, '_solver_model', None)
+    if highs is not None and hasattr(highs, 'getInfo'):
+        return int(highs.getInfo().mip_node_count)
+    return None
+
+#整数条件を外したLP緩和（根ノード）の目的関数値
+def root_bound(model, solver_config):
+    relaxed = model.clone()
+    pyo.TransformationFactory('core.relax_integer_vars').apply_to(relaxed)
+    results = make_solver(solver_config).solve(relaxed, load_solutions=False)
+    if len(results.solution) == 0:
+        return None
+    relaxed.solutions.load_from(results)
+    return pyo.value(next(relaxed.component_data_objects(pyo.Objective, active=True)))
+
+#objective_offset: 候補レシピを絞り込んだ場合の presolve の objective_offset（目的関数を絞り込みなしと比べられるようにする）
+def run_once(formulation, build_args, solver_config, objective_offset=None):
+    row = {}
+    start = time.perf_counter()
+    model = formulation.build(**build_args)
+    if objective_offset is not None:
+        add_objective_offset(model, objective_offset)
+    row['build_s'] = time.perf_counter() - start
+    row['vars'], row['cons'] = model_size(model)
+    row['nnz'] = model_nnz(model)
+
+    try:
+        row['root_bound'] = root_bound(model, solver_config)
+    except Exception as e:
+        print(f"LP緩和を解けませんでした: {e}")
+        row['root_bound'] = None
+
+    start = time.perf_counter()
+    solver = make_solver(solver_config)
+    try:
+        results = solver.solve(model, load_solutions=False)
+    except Exception as e:
+        row.update(solve_s=time.perf_counter() - start, status=f"error: {e}", objective=None, gap=None, nodes=None, root_gap=None)
+        return row
+    row['solve_s'] = time.perf_counter() - start
+    row['status'] = str(results.solver.termination_condition)
+    row['objective'] = None
+    row['gap'] = result_gap(results)
+    row['nodes'] = result_nodes(results, solver)
+    row['root_gap'] = None
+    if len(results.solution) > 0:
+        model.solutions.load_from(results)
+        obj = next(model.component_data_objects(pyo.Objective, active=True))
+        row['objective'] = pyo.value(obj)
+        if row['root_bound'] is not None:
+            row['root_gap'] = abs(row['objective'] - row['root_bound']) / max(abs(row['objective']), 1e-9)
+    return row
+
+#solve の既定の定式化: 登録できた api_pyomo_model*.py の定式化すべてと matrix・aggregate
+#（作れないことが分かっている formulations.EXCLUDED のものは含めない）
+def default_solve_formulations():
+    generated = sorted(name for name, f in formulations.get_registry().items() if f.source.startswith('api_pyomo_model'))
+    return generated + ['matrix', 'aggregate']
+
+#全プロファイル × 月経の有無 × 登録食材のサンプル を定式化ごとに解き、1行ずつCSVに書き出す
+def bench_solve(names, n_profiles, regist_indices, solver_config, out, use_presolve=USE_PRESOLVE):
+    catalog = load_json_catalog()
+    targets = load_json_targets()[:n_profiles]
+    rows = []
+    with open(out, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+        writer.writeheader()
+        for name in names:
+            formulation = formulations.get(name)
+            for target in targets:
+                for menstruation in MENSTRUATIONS:
+                    for k in regist_indices:
+                        regist_item = SAMPLE_REGIST_ITEMS[k]
+                        build_args = sample_build_args(catalog, target, menstruation, regist_item)
+                        objective_offset = None
+                        if use_presolve and formulation.templatable:
+                            build_args, report = presolve(build_args)
+                            objective_offset = report['objective_offset']
+                        row = {
+                            'formulation': name,
+                            'profile': profile_label(target),
+                            'menstruation': menstruation,
+                            'regist': json.dumps(regist_item, ensure_ascii=False),
+                            'use_pfc': build_args['use_pfc'],
+                            'recipes': len(build_args['recipe_ids']),
+                        }
+                        row.update(run_once(formulation, build_args, solver_config, objective_offset))
+                        writer.writerow(row)
+                        f.flush()
+                        rows.append(row)
+                        print(f"{name:9s} {row['profile']:24s} 月経{menstruation} 食材{k} "
+                              f"build={row['build_s']:.2f}s solve={row['solve_s']:.2f}s {row['status']} obj={row['objective']}")
+    print_summary(rows)
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+#定式化ごとの集計（時間は秒）
+def print_summary(rows):
+    by_name = {}
+    for row in rows:
+        by_name.setdefault(row['formulation'], []).append(row)
+    print(f"{'formulation':15s} {'runs':>5s} {'optimal':>7s} {'timeout':>7s} {'build_med':>9s} "
+          f"{'solve_med':>9s} {'solve_p95':>9s} {'solve_max':>9s} {'gap_max':>8s} {'nodes_med':>9s} {'rootgap_med':>11s}")
+    for name, group in by_name.items():
+        build = [float(r['build_s']) for r in group]
+        solve = [float(r['solve_s']) for r in group]
+        gaps = _floats(group, 'gap')
+        nodes = _floats(group, 'nodes')
+        root_gaps = _floats(group, 'root_gap')
+        optimal = sum(1 for r in group if r['status'] == 'optimal')
+        timeout = sum(1 for r in group if r['status'] == 'maxTimeLimit')
+        print(f"{name:15s} {len(group):5d} {optimal:7d} {timeout:7d} {statistics.median(build):9.3f} "
+              f"{statistics.median(solve):9.2f} {_percentile(solve, 0.95):9.2f} {max(solve):9.2f} "
+              f"{(max(gaps) if gaps else float('nan')):8.4f} "
+              f"{(statistics.median(nodes) if nodes else float('nan')):9.0f} "
+              f"{(statistics.median(root_gaps) if root_gaps else float('nan')):11.6f}")
+
+def _floats(rows, field):
+    return [float(r[field]) for r in rows if r.get(field) not in (None, '')]
+
+def load_report(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        return list(csv.DictReader(f))
+
+#2つのCSVを同じ条件どうしで比べる
+def compare_reports(before_path, after_path):
+    def key(r):
+        return (r['formulation'], r['profile'], r['menstruation'], r['regist'])
+    before = {key(r): r for r in load_report(before_path)}
+    after = {key(r): r for r in load_report(after_path)}
+    common = [k for k in before if k in after]
+    print(f"共通の条件: {len(common)}件")
+    for name in sorted({k[0] for k in common}):
+        keys = [k for k in common if k[0] == name]
+        b = [float(before[k]['solve_s']) for k in keys]
+        a = [float(after[k]['solve_s']) for k in keys]
+        changed = sum(
+            1 for k in keys
+            if before[k]['objective'] and after[k]['objective']
+            and abs(float(before[k]['objective']) - float(after[k]['objective'])) > 1e-6
+        )
+        print(f"{name:15s} solve_med {statistics.median(b):8.2f}s → {statistics.median(a):8.2f}s  "
+              f"solve_max {max(b):8.2f}s → {max(a):8.2f}s  目的関数が変わった条件 {changed}件")
+        for field in ('nodes', 'root_gap'):
+            b = _floats([before[k] for k in keys], field)
+            a = _floats([after[k] for k in keys], field)
+            if b and a:
+                print(f"{'':15s} {field}_med {statistics.median(b):.6g} → {statistics.median(a):.6g}")
+
+BACKEND_FIELDS = [
+    'backend', 'profile', 'menstruation', 'regist', 'build_s', 'write_s', 'solve_s', 'read_s', 'total_s',
+    'status', 'objective', 'violations',
+]
+
+def _backend_row(backend, timings, status, objective, violations=None):
+    row = {'backend': backend, 'status': status, 'objective': objective, 'violations': violations}
+    for phase, field in (('model_build', 'build_s'), ('solver_write', 'write_s'), ('solver_solve', 'solve_s'), ('solver_read', 'read_s')):
+        row[field] = timings.get(phase, 0.0)
+    row['total_s'] = sum(timings.values())
+    return row
+
+#Pyomo経由（CBC）と MPSを直接書き出す経路（direct_cbc.py）で同じ条件を解き、時間と目的関数を比べる
+#MPS側の献立は Pyomo のモデルに入れて、満たさない制約の数（violations）を数える
+def bench_backends(name, n_profiles, regist_indices, time_limit, out):
+    catalog = load_json_catalog()
+    targets = load_json_targets()[:n_profiles]
+    formulation = formulations.get(name)
+    rows = []
+    with open(out, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=BACKEND_FIELDS)
+        writer.writeheader()
+        for target in targets:
+            for menstruation in MENSTRUATIONS:
+                for k in regist_indices:
+                    regist_item = SAMPLE_REGIST_ITEMS[k]
+                    build_args, report = presolve(sample_build_args(catalog, target, menstruation, regist_item))
+                    case = {'profile': profile_label(target), 'menstruation': menstruation,
+                            'regist': json.dumps(regist_item, ensure_ascii=False)}
+
+                    timings = {}
+                    with timed(timings, 'model_build'):
+                        model = formulation.build(**build_args)
+                        add_objective_offset(model, report['objective_offset'])
+                    solver = make_solver({'solver': 'cbc', 'options': {'sec': time_limit}})
+                    results = timed_solve(solver, model, timings, load_solutions=False)
+                    objective = None
+                    if len(results.solution) > 0:
+                        model.solutions.load_from(results)
+                        objective = pyo.value(next(model.component_data_objects(pyo.Objective, active=True)))
+                    pyomo_row = dict(case, **_backend_row('pyomo', timings, str(results.solver.termination_condition), objective))
+
+                    timings = {}
+                    with timed(timings, 'model_build'):
+                        direct = direct_cbc.build_direct_model(build_args, tight_big_m=name.endswith('_tight'))
+                        direct.objective_constant += report['objective_offset']
+                    status, objective, values = direct_cbc.solve(direct, CBC_PATH, time_limit, SOLVER_RATIO_GAP, timings=timings)
+                    violations = None if values is None else set_warm_start(model, direct.day_menus(values))
+                    mps_row = dict(case, **_backend_row('mps', timings, status, objective, violations))
+
+                    for row in (pyomo_row, mps_row):
+                        writer.writerow(row)
+                        rows.append(row)
+                    f.flush()
+                    print(f"{case['profile']:24s} 月経{menstruation} 食材{k} "
+                          f"pyomo={pyomo_row['total_s']:.2f}s obj={pyomo_row['objective']}  "
+                          f"mps={mps_row['total_s']:.2f}s obj={mps_row['objective']} 違反={violations}")
+
+    for backend in ('pyomo', 'mps'):
+        group = [r for r in rows if r['backend'] == backend]
+        if not group:
+            continue
+        medians = {field: statistics.median(float(r[field]) for r in group)
+                   for field in ('build_s', 'write_s', 'solve_s', 'read_s', 'total_s')}
+        print(f"{backend:6s} " + " ".join(f"{field}_med={v:.3f}" for field, v in medians.items()))
+    pairs = list(zip(rows[0::2], rows[1::2]))
+    worse = sum(
+        1 for p, m in pairs
+        if p['objective'] is not None and m['objective'] is not None
+        and m['objective'] - p['objective'] > SOLVER_RATIO_GAP * max(abs(p['objective']), 1.0)
+    )
+    invalid = sum(1 for _, m in pairs if m['violations'])
+    print(f"条件 {len(pairs)}件: MPS側の目的関数がギャップより悪い {worse}件 / 制約を満たさない献立 {invalid}件")
+
+#登録済みの定式化と、登録できなかったものの理由を表示し、サンプルデータでモデルを作ってみる
+def check_formulations():
+    build_args = sample_build_args(load_json_catalog(), load_json_targets()[0], regist_item={'卵': 100, 'ご飯': 300})
+    for name, formulation in sorted(formulations.get_registry().items()):
+        start = time.perf_counter()
+        try:
+            model = formulation.build(**build_args)
+            formulation.extract(model)
+            n_vars, n_cons = model_size(model)
+            print(f"{name:10s} OK   build={time.perf_counter() - start:6.3f}s vars={n_vars} cons={n_cons} ({formulation.source})")
+        except Exception as e:
+            print(f"{name:10s} NG   {type(e).__name__}: {e}")
+    for name, message in sorted(formulations.registry_errors().items()):
+        print(f"{name:10s} 未登録 {message}")
+
+def main():
+    parser = argparse.ArgumentParser(description="献立モデルのベンチマーク")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_build = sub.add_parser('build', help="モデル作成時間の比較")
+    p_build.add_argument('--scale', type=int, nargs='+', default=[1, 10], help="レシピ数の倍率")
+    p_build.add_argument('--builders', nargs='+', default=list(BUILDERS), choices=list(BUILDERS))
+    p_build.add_argument('--repeat', type=int, default=1)
+    p_build.add_argument('--check', action='store_true', help="モデルが同じか確認する")
+    sub.add_parser('formulations', help="定式化の登録状況の確認")
+    p_solve = sub.add_parser('solve', help="全プロファイルでのモデル作成・求解時間の計測")
+    p_solve.add_argument('--formulations', nargs='+', default=None,
+                         help="省略時は登録できた api_pyomo_model*.py の定式化すべてと matrix・aggregate"
+                              f"（{'・'.join(sorted(formulations.EXCLUDED))} はモデルを作れないため除外）"),
+    p_solve.add_argument('--profiles', type=int, default=None, help="先頭から何件のプロファイルを使うか（省略時は全件）")
+    p_solve.add_argument('--regist', type=int, nargs='+', default=list(range(len(SAMPLE_REGIST_ITEMS))),
+                         help="SAMPLE_REGIST_ITEMS の番号")
+    p_solve.add_argument('--solver', default='cbc', choices=list(SOLVER_LIMIT_OPTIONS))
+    p_solve.add_argument('--time-limit', type=float, default=SOLVER_TIME_LIMIT)
+    p_solve.add_argument('--out', default='benchmark_solve.csv')
+    p_solve.add_argument('--no-presolve', action='store_true', help="候補レシピを絞り込まずに解く")
+    p_backends = sub.add_parser('backends', help="Pyomo経由とMPS直接書き出し（CBC）の比較")
+    p_backends.add_argument('--formulation', default='matrix', help="model4 と同じ構造の定式化")
+    p_backends.add_argument('--profiles', type=int, default=None, help="先頭から何件のプロファイルを使うか（省略時は全件）")
+    p_backends.add_argument('--regist', type=int, nargs='+', default=list(range(len(SAMPLE_REGIST_ITEMS))),
+                            help="SAMPLE_REGIST_ITEMS の番号")
+    p_backends.add_argument('--time-limit', type=float, default=SOLVER_TIME_LIMIT)
+    p_backends.add_argument('--out', default='benchmark_backends.csv')
+    p_compare = sub.add_parser('compare', help="solve の結果CSVを比較")
+    p_compare.add_argument('before')
+    p_compare.add_argument('after')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        bench_build(args.scale, args.builders, args.repeat, args.check)
+    elif args.command == 'formulations':
+        check_formulations()
+    elif args.command == 'solve':
+        time_key = SOLVER_LIMIT_OPTIONS[args.solver][0]
+        solver_config = {'solver': args.solver, 'options': {time_key: args.time_limit}}
+        names = args.formulations or default_solve_formulations()
+        for name, reason in sorted(formulations.EXCLUDED.items()):
+            print(f"{name} は除外: {reason}")
+        bench_solve(names, args.profiles, args.regist, solver_config, args.out, not args.no_presolve)
+    elif args.command == 'backends':
+        bench_backends(args.formulation, args.profiles, args.regist, args.time_limit, args.out)
+    elif args.command == 'compare':
+        compare_reports(args.before, args.after)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+#レシピカタログのスナップショット
+#create_menuのたびにDBから全件読み直さないよう、ワーカーごとに1つだけ保持して使い回す
+import os,json
+from dataclasses import dataclass, field
+import numpy as np
+from scipy import sparse
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+
+@dataclass(frozen=True)
+class Catalog:
+    version: str
+    recipe_dict: dict            # {recipeId: {'recipeId':..., 'data': {kind1, kind2, ...}}}
+    recipeitem_dict: dict        # {recipeId: {食材名: 使用量(g)}}  None→0 済み
+    recipe_nutritions: dict      # {recipeId: {栄養素名: 含有量}}  None→0 済み
+    itemweight_dict: dict        # {食材名: {'itemName':..., 'weights': [...], 'kind1': ''}}
+    itemequal_dict: dict         # {食材名: {'itemName':..., 'equals': [...]}}
+    # 栄養素キーの組み合わせごとの絞り込み結果（読み取り専用として扱う）
+    _filtered: dict = field(default_factory=dict, compare=False, repr=False)
+    # 買い物リスト用の食材ベクトル（shopping_vectors の結果）
+    _shopping: dict = field(default_factory=dict, compare=False, repr=False)
+
+    @property
+    def recipe_ids(self):
+        return list(self.recipe_dict.keys())
+
+    def filtered_recipe_nutritions(self, nutri_keys):
+        """指定した栄養素だけに絞ったレシピ栄養辞書を返す"""
+        cache_key = tuple(sorted(nutri_keys))
+        filtered = self._filtered.get(cache_key)
+        if filtered is None:
+            keys = set(cache_key)
+            filtered = {
+                rid: {k: v for k, v in nutritions.items() if k in keys}
+                for rid, nutritions in self.recipe_nutritions.items()
+            }
+            self._filtered[cache_key] = filtered
+        return filtered
+
+    def shopping_vectors(self):
+        """(食材の代表名のリスト, {recipeId: 行番号}, レシピ×食材の使用量の疎行列) を返す（同一食材は代表名にまとめ済み）"""
+        if not self._shopping:
+            canonical = canonical_item_names(self.itemequal_dict)
+            names, index = [], {}
+            rows, cols, data = [], [], []
+            for row, (rid, items) in enumerate(self.recipeitem_dict.items()):
+                for name, qty in items.items():
+                    if not qty:
+                        continue
+                    name = canonical.get(name, name)
+                    if name not in index:
+                        index[name] = len(names)
+                        names.append(name)
+                    rows.append(row)
+                    cols.append(index[name])
+                    data.append(float(qty))
+            recipe_rows = {rid: row for row, rid in enumerate(self.recipeitem_dict)}
+            matrix = sparse.csr_matrix((data, (rows, cols)), shape=(len(recipe_rows), len(names)))
+            self._shopping.update(names=names, recipe_rows=recipe_rows, matrix=matrix)
+        return self._shopping['names'], self._shopping['recipe_rows'], self._shopping['matrix']
+
+    def shopping_list(self, recipe_ids):
+        """レシピの食材を代表名ごとに合計した {食材名: 使用量(g)}（使用量0の食材は含めない）"""
+        names, recipe_rows, matrix = self.shopping_vectors()
+        rows = [recipe_rows[r] for r in recipe_ids if r in recipe_rows]
+        if not rows:
+            return {}
+        total = np.asarray(matrix[rows].sum(axis=0)).ravel()
+        return {names[j]: _quantity(total[j]) for j in np.flatnonzero(total)}
+
+
+def _zero_if_none(values):
+    return {k: (v if v is not None else 0) for k, v in (values or {}).items()}
+
+
+#同一食材名 → 代表名（itemEquals の itemName）。後の行の指定が優先
+def canonical_item_names(itemequal_dict):
+    canonical = {}
+    for name, eq in itemequal_dict.items():
+        for k in eq['equals']:
+            canonical[k] = name
+        canonical[name] = name
+    return canonical
+
+#合計した使用量の表示用の値（整数になるものは整数で返す）
+def _quantity(value):
+    value = round(float(value), 2)
+    return int(value) if value.is_integer() else value
+
+
+def _as_list(value, sep=None):
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return value
+    if sep is not None and isinstance(value, str):
+        return [v for v in value.split(sep) if v]
+    return [value]
+
+
+#DBの行(as_dictの結果)からカタログを組み立てる
+def build_catalog(version, recipes, recipe_items, recipe_nutritions, item_weights, item_equals):
+    recipe_dict = {r['recipeId']: r for r in recipes}
+
+    recipeitem_dict = {ri['recipeId']: _zero_if_none(ri.get('items')) for ri in recipe_items}
+    nutrition_dict = {rn['recipeId']: _zero_if_none(rn.get('nutritions')) for rn in recipe_nutritions}
+
+    itemweight_dict = {}
+    for iw in item_weights:
+        d = dict(iw)
+        # "weights"を必ずリスト化
+        d['weights'] = _as_list(d.get('weights'))
+        d['kind1'] = ''
+        itemweight_dict[d['itemName']] = d
+
+    itemequal_dict = {}
+    for ie in item_equals:
+        d = dict(ie)
+        # equalsはカンマ区切りの文字列で格納されているためリスト化
+        d['equals'] = _as_list(d.get('equals'), sep=',')
+        itemequal_dict[d['itemName']] = d
+
+    return Catalog(
+        version=version,
+        recipe_dict=recipe_dict,
+        recipeitem_dict=recipeitem_dict,
+        recipe_nutritions=nutrition_dict,
+        itemweight_dict=itemweight_dict,
+        itemequal_dict=itemequal_dict,
+    )
+
+
+#data/*.json からDBと同じ形のカタログ・栄養目標を作る（DBを使わないベンチマーク用）
+KIND1_JSON_MAP = {
+    '主食': 'staple',
+    '鍋物・主食': 'staple',
+    '主菜': 'main',
+    '鍋物': 'main',
+    '副菜': 'side',
+    '汁物': 'soup',
+}
+
+def _load_json(data_dir, filename):
+    with open(os.path.join(data_dir, filename), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def load_json_catalog(data_dir=DATA_DIR):
+    recipes = []
+    for rec in _load_json(data_dir, "recipe.json"):
+        data = {k: v for k, v in rec.items() if k != "recipeId"}
+        data['kind1'] = KIND1_JSON_MAP.get(data.get('kind1'), data.get('kind1'))
+        recipes.append({'recipeId': rec['recipeId'], 'data': data})
+
+    def split_id(rows, column):
+        return [{'recipeId': row['recipeId'], column: {k: v for k, v in row.items() if k != "recipeId"}} for row in rows]
+
+    item_weights = [{'itemName': k, 'weights': v} for row in _load_json(data_dir, "itemWeight.json") for k, v in row.items()]
+    item_equals = [{'itemName': k, 'equals': v} for row in _load_json(data_dir, "itemEqual.json") for k, v in row.items()]
+
+    return build_catalog(
+        "json",
+        recipes=recipes,
+        recipe_items=split_id(_load_json(data_dir, "recipeItem.json"), 'items'),
+        recipe_nutritions=split_id(_load_json(data_dir, "recipeNutrition.json"), 'nutritions'),
+        item_weights=item_weights,
+        item_equals=item_equals,
+    )
+
+# "13~20" / "3.08以上" / "21未満" → (下限, 上限)
+def _parse_range(text):
+    text = str(text).replace(',', '.')
+    if '~' in text:
+        lower, upper = text.split('~')
+        return float(lower), float(upper)
+    if text.endswith('以上'):
+        return float(text[:-2]), None
+    if text.endswith('未満'):
+        return None, float(text[:-2])
+    return float(text), None
+
+# JSONの項目名 → nutritionalTargetsテーブルでのキー名
+TARGET_JSON_KEYS = {
+    'たんぱく質(%エネルギー)': 'たんぱく質',
+    '脂質(%エネルギー)': '脂質',
+    '炭水化物(%エネルギー)': '炭水化物',
+    'ビタミンA(μg)': 'ビタミンA',
+    'ビタミンB₁(mg)': 'ビタミンB1',
+    'ビタミンB₂(mg)': 'ビタミンB2',
+    'ビタミンC(mg)': 'ビタミンC',
+    'カルシウム(mg)': 'カルシウム',
+    '鉄(mg)': '鉄',
+    '鉄(mg)・月経時': '鉄・月経時',
+    '食塩(g)': '食塩',
+    '食物繊維(g)': '食物繊維',
+    'ビタミンD(μg)': 'ビタミンD',
+}
+
+def load_json_targets(data_dir=DATA_DIR):
+    targets = []
+    for row in _load_json(data_dir, "nutritionalTarget.json"):
+        userInfo = {k: row[k] for k in ('年齢', '性別', '運動レベル')}
+        nutritionals = {'カロリー': row['カロリー(kcal)']}
+        for json_key, name in TARGET_JSON_KEYS.items():
+            if json_key not in row:
+                continue
+            lower, upper = _parse_range(row[json_key])
+            if lower is not None:
+                nutritionals[f"{name}_下限"] = lower
+            if upper is not None:
+                nutritionals[f"{name}_上限"] = upper
+        targets.append({'userInfo': userInfo, 'nutritionals': nutritionals})
+    return targets
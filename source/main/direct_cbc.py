@@ -0,0 +1,314 @@
+#Pyomoを通さずにCBCで解く（SOLVER_BACKEND=mps）
+#api_pyomo_model4.build_model（matrix_model.build_model）と同じモデルを、行列の添字から直接MPSファイルに書き出し、
+#CBCをサブプロセスで実行して、解のファイルを配列に読み込む
+#変数・制約の名前は列番号・行番号（C0, R0, ...）にするので、Pyomoの式の木とLPライターを使わない
+import os,subprocess,tempfile
+import numpy as np
+
+from .matrix_model import (
+    build_matrices, big_m_values, nutrition_bounds, item_representatives,
+    PFC_KEYS, OTHER_KEYS, STAPLE_SPECIAL_KIND2,
+    WEIGHT_ITEM, WEIGHT_REGIST, PENALTY_NOT_USE, WEIGHT_MULTIPLE,
+)
+from .metrics import timed
+
+# CBCの解ファイルの1行目 → Pyomoの termination_condition と同じ名前
+CBC_STATUS = [
+    ('Optimal', 'optimal'),
+    ('Infeasible', 'infeasible'),
+    ('Integer infeasible', 'infeasible'),
+    ('Unbounded', 'unbounded'),
+    ('Stopped on time', 'maxTimeLimit'),
+    ('Stopped on iterations', 'maxIterations'),
+    ('Stopped on nodes', 'maxEvaluations'),
+    ('Stopped on solutions', 'other'),
+]
+TOLERANCE = 1e-6
+
+
+class DirectModel:
+    """列（変数）・行（制約）・係数を配列で持つモデル"""
+
+    def __init__(self):
+        self.col_integer = []   # 0-1変数なら True
+        self.col_cost = []      # 目的関数の係数
+        self.row_sense = []     # 'E' / 'L' / 'G'
+        self.row_rhs = []
+        self.row_range = []     # 上下限のある制約の幅（なければ None）
+        self.entry_rows, self.entry_cols, self.entry_vals = [], [], []
+        self.objective_constant = 0.0
+
+    @property
+    def n_cols(self):
+        return len(self.col_integer)
+
+    @property
+    def n_rows(self):
+        return len(self.row_sense)
+
+    def add_vars(self, n, integer, cost=0.0):
+        start = self.n_cols
+        self.col_integer.extend([integer] * n)
+        self.col_cost.extend([float(cost)] * n)
+        return np.arange(start, start + n)
+
+    #lower <= Σ coefs * cols <= upper（None は制約なし）
+    def add_row(self, cols, coefs, lower=None, upper=None):
+        if lower is None and upper is None:
+            return
+        if lower is not None and upper is not None and abs(upper - lower) <= TOLERANCE:
+            sense, rhs, width = 'E', upper, None
+        elif upper is not None:
+            sense, rhs, width = 'L', upper, None if lower is None else upper - lower
+        else:
+            sense, rhs, width = 'G', lower, None
+        row = self.n_rows
+        self.row_sense.append(sense)
+        self.row_rhs.append(float(rhs))
+        self.row_range.append(width)
+        cols = np.asarray(cols, dtype=int)
+        self.entry_rows.append(np.full(len(cols), row))
+        self.entry_cols.append(cols)
+        self.entry_vals.append(np.broadcast_to(np.asarray(coefs, dtype=float), cols.shape))
+
+    def entries(self):
+        if not self.entry_cols:
+            return np.empty(0, dtype=int), np.empty(0, dtype=int), np.empty(0)
+        rows = np.concatenate(self.entry_rows)
+        cols = np.concatenate(self.entry_cols)
+        vals = np.concatenate(self.entry_vals)
+        keep = vals != 0
+        order = np.lexsort((rows[keep], cols[keep]))
+        return rows[keep][order], cols[keep][order], vals[keep][order]
+
+
+class MenuModel(DirectModel):
+    """献立のモデル。x の列番号と、解から献立を取り出すための情報を持つ"""
+
+    def x_column(self, d, r):
+        i, k = self.day_index.get(d), self.recipe_index.get(r)
+        if i is None or k is None:
+            return None
+        return int(self.x[i, k])
+
+    #解の値 → {menuN: {kind1: recipeId}}（formulations.extract_day_menus と同じ形）
+    def day_menus(self, values):
+        chosen = values[self.x] > 0.5
+        day_menus = {}
+        for i, d in enumerate(self.days):
+            menu = day_menus[f"menu{d}"] = {}
+            for k in np.flatnonzero(chosen[i]):
+                r = self.recipe_ids[k]
+                menu[self.kind1[r]] = r
+        return day_menus
+
+
+#build_args から model4 と同じ制約・目的関数のモデルを作る
+def build_direct_model(build_args, tight_big_m=False):
+    days = list(build_args['days'])
+    recipe_dict = build_args['recipe_dict']
+    regist_item = build_args['regist_item']
+    itemweight_dict = build_args['itemweight_dict']
+    matrices = build_matrices(build_args['recipe_ids'], build_args['recipeitem_dict'], build_args['filtered_recipe_nutritions'])
+    recipe_ids = matrices.recipe_ids
+    n = len(recipe_ids)
+    big_m_regist, big_m_link, big_m_rep = big_m_values(matrices, recipe_dict, len(days), tight_big_m)
+
+    model = MenuModel()
+    model.days = days
+    model.recipe_ids = recipe_ids
+    model.day_index = {d: i for i, d in enumerate(days)}
+    model.recipe_index = {r: k for k, r in enumerate(recipe_ids)}
+    model.kind1 = {r: recipe_dict[r]['data']['kind1'] for r in recipe_ids}
+    kind2 = {r: recipe_dict[r]['data']['kind2'] for r in recipe_ids}
+    model.x = model.add_vars(len(days) * n, True).reshape(len(days), n)
+    x = model.x
+
+    positive = np.asarray((matrices.A > 0).sum(axis=0)).ravel() > 0
+    ingredients = [i for j, i in enumerate(matrices.items) if positive[j]]
+    item_used = dict(zip(itemweight_dict, model.add_vars(len(itemweight_dict), True)))
+    y_item = dict(zip(ingredients, model.add_vars(len(ingredients), True, WEIGHT_ITEM)))
+
+    # --- 献立の構成（主食・主菜・副菜・汁物） ---
+    staple_special = np.array([kind2[r] in STAPLE_SPECIAL_KIND2 and model.kind1[r] == 'staple' for r in recipe_ids], dtype=bool)
+    by_kind = {k: np.array([model.kind1[r] == k for r in recipe_ids], dtype=bool) for k in ('staple', 'main', 'side', 'soup')}
+    by_kind['main'] = by_kind['main'] | staple_special
+    for kind in ('staple', 'main', 'side', 'soup'):
+        for i in range(len(days)):
+            model.add_row(x[i, by_kind[kind]], 1, 1, 1)
+
+    for k in range(n):
+        model.add_row(x[:, k], 1, None, 7 if staple_special[k] else 1)
+
+    # --- 栄養素 ---
+    nutritionals = next(iter(build_args['nutritionaltarget_dict'].values()))['nutritionals']
+    nut_keys = PFC_KEYS + OTHER_KEYS if build_args['use_pfc'] else OTHER_KEYS
+    for nut in nut_keys:
+        bounds = nutrition_bounds(nut, nutritionals, build_args['menstruation'])
+        if bounds is None:
+            continue
+        rows, coefs = matrices.nutrient_column(nut)
+        model.add_row(x[:, rows].ravel(), np.tile(coefs, len(days)), bounds[0], bounds[1])
+
+    for i in range(len(days)):
+        model.add_row(x[i], 1, 3, 4)
+
+    # --- 食材ごとの週の使用量 Σ_d Σ_r a[r, i] x[d, r] の列と係数 ---
+    def usage(item):
+        rows, coefs = matrices.item_column(item)
+        return x[:, rows].ravel(), np.tile(coefs, len(days))
+
+    unused = dict(zip(regist_item, model.add_vars(len(regist_item), False)))
+    for i, amount in regist_item.items():
+        cols, coefs = usage(i)
+        model.add_row(np.append(cols, unused[i]), np.append(coefs, 1.0), float(amount), float(amount))
+
+    # 登録食材を使ったかどうか: -WEIGHT_REGIST * y + PENALTY_NOT_USE * (1 - y)
+    regist_ingredients = [i for i in ingredients if i in regist_item]
+    y_regist = dict(zip(regist_ingredients, model.add_vars(len(regist_ingredients), True, -WEIGHT_REGIST - PENALTY_NOT_USE)))
+    model.objective_constant += PENALTY_NOT_USE * len(regist_ingredients)
+    for i in regist_ingredients:
+        cols, coefs = usage(i)
+        model.add_row(np.append(cols, y_regist[i]), np.append(coefs, -big_m_regist[i]), None, 0)
+
+    # --- 指定食材の使用量を重さの倍数に近づける（誤差変数 e） ---
+    for i in ingredients:
+        if i not in itemweight_dict or not itemweight_dict[i].get("weights"):
+            continue
+        weight = itemweight_dict[i]["weights"][0]
+        rows, coefs = matrices.item_column(i)
+        for k, a in zip(rows, coefs):
+            if a <= 0:
+                continue
+            nearest = weight * round(a / weight)
+            for d in range(len(days)):
+                e = model.add_vars(1, False, WEIGHT_MULTIPLE)[0]
+                model.add_row([e, x[d, k]], [1, -a], -nearest, None)
+                model.add_row([e, x[d, k]], [1, a], nearest, None)
+
+    # --- 同一食材の紐付け ---
+    target_items, rep_map = item_representatives(itemweight_dict, build_args['itemequal_dict'])
+    reps = sorted(set(rep_map.values()))
+    y_item_rep = dict(zip(reps, model.add_vars(len(reps), True)))
+    item_used_rep = dict(zip(reps, model.add_vars(len(reps), False)))
+    for i in sorted(target_items):
+        if i in itemweight_dict:
+            model.add_row([item_used[i], item_used_rep[rep_map[i]]], [1, -1], None, 0)
+    for rep in reps:
+        model.add_row([item_used_rep[rep], y_item_rep[rep]], [1, -big_m_rep], None, 0)
+    for i in itemweight_dict:
+        cols, coefs = usage(i)
+        model.add_row(np.append(cols, item_used[i]), np.append(-coefs, 1.0), 0, None)
+
+    # --- ご飯は7回まで、それ以外は1回まで ---
+    for k, r in enumerate(recipe_ids):
+        model.add_row(x[:, k], 1, None, 7 if kind2[r] == 'ご飯' else 1)
+
+    for i in ingredients:
+        cols, coefs = usage(i)
+        model.add_row(np.append(cols, y_item[i]), np.append(coefs, -big_m_link[i]), None, 0)
+
+    # write_mps で列ごとに参照するので配列にしておく
+    model.col_integer = np.array(model.col_integer, dtype=bool)
+    model.col_cost = np.array(model.col_cost)
+    return model
+
+
+def _number(v):
+    return f"{v:.17g}"
+
+#自由形式のMPSを書き出す（整数の列は MARKER で囲み、上限を1にする）
+def write_mps(model, path):
+    rows, cols, vals = model.entries()
+    lines = ["NAME MENU", "ROWS", " N OBJ"]
+    lines += [f" {sense} R{i}" for i, sense in enumerate(model.row_sense)]
+    lines.append("COLUMNS")
+    starts = np.searchsorted(cols, np.arange(model.n_cols + 1))
+    integer = False
+    for j in range(model.n_cols):
+        if model.col_integer[j] != integer:
+            integer = bool(model.col_integer[j])
+            lines.append(f"    M{j} 'MARKER' '{'INTORG' if integer else 'INTEND'}'")
+        name = f"C{j}"
+        if model.col_cost[j] != 0 or starts[j] == starts[j + 1]:
+            lines.append(f"    {name} OBJ {_number(model.col_cost[j])}")
+        lines += [f"    {name} R{i} {_number(v)}" for i, v in zip(rows[starts[j]:starts[j + 1]], vals[starts[j]:starts[j + 1]])]
+    if integer:
+        lines.append(f"    M{model.n_cols} 'MARKER' 'INTEND'")
+    # 目的関数の定数項は1に固定した列で渡す（CBCの ratioGap が Pyomo のLPライター経由と同じ値に対する比率になる）
+    if model.objective_constant:
+        lines.append(f"    OBJCONST OBJ {_number(model.objective_constant)}")
+    lines.append("RHS")
+    lines += [f"    RHS R{i} {_number(v)}" for i, v in enumerate(model.row_rhs) if v != 0]
+    ranges = [(i, w) for i, w in enumerate(model.row_range) if w is not None]
+    if ranges:
+        lines.append("RANGES")
+        lines += [f"    RNG R{i} {_number(w)}" for i, w in ranges]
+    lines.append("BOUNDS")
+    lines += [f" UP BND C{j} 1" for j in np.flatnonzero(model.col_integer)]
+    if model.objective_constant:
+        lines.append(" FX BND OBJCONST 1")
+    lines.append("ENDATA")
+    with open(path, 'w') as f:
+        f.write("\n".join(lines) + "\n")
+
+#CBCの -mipstart に渡す初期解（CBCの解ファイルと同じ形式。指定しない列はCBCが決める）
+def write_mipstart(columns, path):
+    with open(path, 'w') as f:
+        f.write("Optimal - objective value 0\n")
+        for j, value in sorted(columns.items()):
+            f.write(f"{j} C{j} {_number(value)} 0\n")
+
+
+def _status(header):
+    for prefix, status in CBC_STATUS:
+        if header.startswith(prefix):
+            return status
+    return 'other'
+
+#CBCの解ファイル（-solu）を読み、(状態, 目的関数の値, 列の値の配列) を返す。解がなければ値は None
+def read_solution(path, n_cols):
+    with open(path) as f:
+        header = f.readline().strip()
+        status = _status(header)
+        if status in ('infeasible', 'unbounded') or 'no integer solution' in header:
+            return status, None, None
+        values = np.zeros(n_cols)
+        for line in f:
+            parts = line.split()
+            if parts and parts[0] == '**':  # 制約を満たさない値の印
+                parts = parts[1:]
+            if len(parts) >= 3 and parts[1].startswith('C'):
+                values[int(parts[1][1:])] = float(parts[2])
+    try:
+        objective = float(header.rsplit('objective value', 1)[1])
+    except (IndexError, ValueError):
+        objective = None
+    return status, objective, values
+
+
+#MPSを書き出してCBCを実行し、(状態, 目的関数の値, 列の値) を返す
+#start: {列番号: 値} の初期解（なければ None）。timings には書き出し・実行・読み込みの時間を入れる
+def solve(model, cbc_path, time_limit, ratio_gap, start=None, tee=False, timings=None):
+    timings = {} if timings is None else timings
+    with tempfile.TemporaryDirectory(prefix='menu_cbc_') as work:
+        mps_path = os.path.join(work, 'menu.mps')
+        sol_path = os.path.join(work, 'menu.sol')
+        command = [cbc_path, '-import', mps_path, '-sec', str(time_limit), '-ratioGap', str(ratio_gap)]
+        with timed(timings, 'solver_write'):
+            write_mps(model, mps_path)
+            if start:
+                start_path = os.path.join(work, 'menu.start')
+                write_mipstart(start, start_path)
+                command += ['-mipstart', start_path]
+        command += ['-solve', '-solu', sol_path]
+
+        with timed(timings, 'solver_solve'):
+            completed = subprocess.run(command, capture_output=not tee, text=True)
+        if not os.path.exists(sol_path):
+            output = '' if tee else (completed.stdout or '')[-500:]
+            raise RuntimeError(f"CBCが解ファイルを出力しませんでした(終了コード={completed.returncode}) {output}")
+
+        with timed(timings, 'solver_read'):
+            status, objective, values = read_solution(sol_path, model.n_cols)
+    return status, objective, values
@@ -0,0 +1,144 @@
+#ソルバーを使う前の実行可能性チェック
+#献立の構成ルール（毎日 主食1・副菜1・汁物1、主菜は通常の主食の日だけ、各レシピは週1回まで）の下で
+#1週間の合計が取りうる最小・最大を栄養素ごと・食材ごとにまとめて計算し、明らかに解けない入力をすぐに弾く
+#（栄養素・食材を1つずつ見た緩和なので、ここで弾いたものは必ず解なし。通っても解があるとは限らない）
+import numpy as np
+
+from .matrix_model import build_matrices, nutrition_bounds, PFC_KEYS, OTHER_KEYS, STAPLE_SPECIAL_KIND2
+
+MEAL_KINDS = ('staple', 'main', 'side', 'soup')
+KIND_NAMES = {'staple': '主食', 'main': '主菜', 'side': '副菜', 'soup': '汁物', 'special': 'ご飯もの等の主食', 'other': 'その他'}
+TOLERANCE = 1e-6
+
+
+#レシピを献立の構成上の区分に分ける（normal: 通常の主食 / special: 主菜なしの日の主食）
+def recipe_classes(recipe_dict, recipe_ids):
+    classes = {k: [] for k in ('normal', 'special', 'main', 'side', 'soup', 'other')}
+    for row, r in enumerate(recipe_ids):
+        data = recipe_dict[r]['data']
+        kind1 = data['kind1']
+        if kind1 == 'staple':
+            classes['special' if data['kind2'] in STAPLE_SPECIAL_KIND2 else 'normal'].append(row)
+        elif kind1 in MEAL_KINDS:
+            classes[kind1].append(row)
+        else:
+            classes['other'].append(row)
+    return {k: np.array(v, dtype=int) for k, v in classes.items()}
+
+#各列について、区分の中から k 品選んだときの合計の最大・最小（k=0..品数）
+def _prefix_sums(values):
+    if values.shape[0] == 0:
+        zero = np.zeros((1, values.shape[1]))
+        return zero, zero
+    ascending = np.sort(values, axis=0)
+    zero = np.zeros((1, values.shape[1]))
+    low = np.vstack([zero, np.cumsum(ascending, axis=0)])
+    high = np.vstack([zero, np.cumsum(ascending[::-1], axis=0)])
+    return low, high
+
+#1週間の合計の (最小, 最大) を列ごとに返す。構成ルールを満たせない場合は None
+def weekly_range(values, classes, n_days):
+    sums = {k: _prefix_sums(values[rows]) for k, rows in classes.items()}
+    counts = {k: len(rows) for k, rows in classes.items()}
+    if counts['side'] < n_days or counts['soup'] < n_days:
+        return None
+
+    low = np.full(values.shape[1], np.inf)
+    high = np.full(values.shape[1], -np.inf)
+    # s: 主菜なしの日（ご飯もの等の主食の日）の数
+    for s in range(n_days + 1):
+        normal_days = n_days - s
+        if counts['special'] < s or counts['normal'] < normal_days or counts['main'] < normal_days:
+            continue
+        base_low = sums['side'][0][n_days] + sums['soup'][0][n_days] \
+            + sums['normal'][0][normal_days] + sums['main'][0][normal_days] + sums['special'][0][s]
+        base_high = sums['side'][1][n_days] + sums['soup'][1][n_days] \
+            + sums['normal'][1][normal_days] + sums['main'][1][normal_days] + sums['special'][1][s]
+        # 3品の日にだけ追加できる分類外のレシピ（0品でもよい）
+        n_other = min(s, counts['other'])
+        other_low = sums['other'][0][:n_other + 1].min(axis=0)
+        other_high = sums['other'][1][:n_other + 1].max(axis=0)
+        low = np.minimum(low, base_low + other_low)
+        high = np.maximum(high, base_high + other_high)
+    if np.isinf(low).any():
+        return None
+    return low, high
+
+
+#食材ごとの週の最大使用量（献立の構成ルールの下で。構成できない場合は全レシピの合計）
+def max_item_usage(matrices, recipe_dict, n_days):
+    usage = matrices.A.toarray()
+    ranges = weekly_range(usage, recipe_classes(recipe_dict, matrices.recipe_ids), n_days)
+    if ranges is None:
+        return usage.sum(axis=0)
+    return ranges[1]
+
+
+def _missing_kinds(classes, n_days):
+    problems = []
+    for kind in ('side', 'soup'):
+        if len(classes[kind]) < n_days:
+            problems.append(f"{KIND_NAMES[kind]}のレシピが{len(classes[kind])}品しかなく、{n_days}日分の献立を作れません")
+    if not problems:
+        problems.append(f"主食・主菜のレシピが足りず、{n_days}日分の献立を作れません")
+    return problems
+
+
+#登録量より多く使うレシピは選べない（使用量 + 使い残し = 登録量、使い残し >= 0）
+def excluded_by_regist(matrices, regist_item):
+    excluded = np.zeros(len(matrices.recipe_ids), dtype=bool)
+    causes = []
+    for item, amount in regist_item.items():
+        rows, coefs = matrices.item_column(item)
+        over = rows[coefs > float(amount) + TOLERANCE]
+        if len(over):
+            excluded[over] = True
+            causes.append(item)
+    return excluded, causes
+
+
+#解けない理由のメッセージのリストを返す（空なら解ける可能性がある）
+def check_feasibility(build_args, matrices=None):
+    if matrices is None:
+        matrices = build_matrices(build_args['recipe_ids'], build_args['recipeitem_dict'], build_args['filtered_recipe_nutritions'])
+    n_days = len(build_args['days'])
+    regist_item = build_args['regist_item']
+    for item, amount in regist_item.items():
+        if float(amount) < 0:
+            return [f"{item} の登録量が負の値です"]
+
+    excluded, causes = excluded_by_regist(matrices, regist_item)
+    classes = recipe_classes(build_args['recipe_dict'], matrices.recipe_ids)
+    classes = {k: rows[~excluded[rows]] for k, rows in classes.items()}
+    because = f"（{'・'.join(causes)} の登録量より多く使うレシピを除くと）" if causes else ""
+    problems = []
+
+    # --- 栄養素 ---
+    nutritionals = next(iter(build_args['nutritionaltarget_dict'].values()))['nutritionals']
+    nut_keys = PFC_KEYS + OTHER_KEYS if build_args['use_pfc'] else OTHER_KEYS
+    bounds = {nut: nutrition_bounds(nut, nutritionals, build_args['menstruation']) for nut in nut_keys}
+    bounds = {nut: b for nut, b in bounds.items() if b is not None}
+    values = np.zeros((len(matrices.recipe_ids), len(bounds)))
+    for k, nut in enumerate(bounds):
+        rows, coefs = matrices.nutrient_column(nut)
+        values[rows, k] = coefs
+    ranges = weekly_range(values, classes, n_days)
+    if ranges is None:
+        return [because + message for message in _missing_kinds(classes, n_days)]
+    low, high = ranges
+    for k, (nut, (lower, upper)) in enumerate(bounds.items()):
+        if lower is not None and high[k] < lower - TOLERANCE:
+            problems.append(f"{because}{nut} は1週間で最大 {high[k]:.1f} しかとれず、下限 {lower:.1f} に届きません")
+        if upper is not None and low[k] > upper + TOLERANCE:
+            problems.append(f"{because}{nut} は1週間で最低でも {low[k]:.1f} になり、上限 {upper:.1f} を超えます")
+
+    # --- 登録食材：最低使用量が登録量を超えると解けない ---
+    items = [i for i in regist_item if i in matrices.item_index]
+    if items:
+        usage = matrices.A[:, [matrices.item_index[i] for i in items]].toarray()
+        low, _ = weekly_range(usage, classes, n_days)
+        for k, item in enumerate(items):
+            amount = float(regist_item[item])
+            if low[k] > amount + TOLERANCE:
+                problems.append(f"{because}{item} はどの献立でも最低 {low[k]:.0f}g 使われますが、登録量は {amount:.0f}g です")
+    return problems
@@ -0,0 +1,291 @@
+#モデル（定式化）の登録簿
+#api_pyomo_model*.py はプロセスごとに1回だけ読み込んで検証し、リクエストでは読み込み済みの関数を名前で選んで呼ぶ
+#どの定式化にも build_args（make_build_args の戻り値）を渡せるよう、引数の形を変換するアダプタを付ける
+import os,glob,inspect,logging
+from contextlib import contextmanager
+from dataclasses import dataclass
+from functools import partial
+from typing import Callable
+import pyomo.environ as pyo
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+@dataclass(frozen=True)
+class Formulation:
+    name: str
+    build: Callable          # build(**build_args) → モデル
+    extract: Callable        # extract(model) → {menuN: {kind1: recipeId}}
+    templatable: bool = False  # templates.py のひな形として使えるか（model4と同じ制約名を持つか）
+    source: str = ''
+
+
+#誤ったreturn文を自動削除処理
+def sanitize_pyomo_code(code):
+    # よくある誤りパターンを一括補正（False→Infeasible, True→Skip）
+    code = code.replace('return False', 'return pyo.Constraint.Infeasible')
+    code = code.replace('return True', 'return pyo.Constraint.Skip')
+    return code
+
+#API出力コードの読み込み(ソルバー周辺調整用)
+def load_build_model(filename="api_pyomo_model4.py", function="build_model"):
+    api_file_path = os.path.join(BASE_DIR, filename)
+    with open(api_file_path, encoding='utf-8') as f:
+        pyomo_code_str = f.read()
+    pyomo_code_str = sanitize_pyomo_code(pyomo_code_str)
+    scope = {}
+    exec(compile(pyomo_code_str, api_file_path, 'exec'), scope, scope)
+    return scope.get(function)
+
+
+# --- 献立の取り出し ---
+
+#x[d, r] から曜日ごとの献立 {menuN: {kind1: recipeId}} を取り出す
+def extract_day_menus(model):
+    day_menus = {}
+    for d in model.Days:
+        menu_name = f"menu{d}"
+        day_menus[menu_name] = {}
+
+        for r in model.Recipes:
+            val = pyo.value(model.x[d, r], exception=False)
+            if val is not None and val > 0.5:
+                kind1 = model.kind1_map[r]  # 'staple', 'main', 'side', 'soup'
+                # 1日1品しか選ばれない前提で key:value 形式に格納
+                day_menus[menu_name][kind1] = r
+    return day_menus
+
+#料理の種類ごとに変数が分かれているモデル用（{kind1: 変数名}）
+def kind_var_extractor(var_names):
+    def extract(model):
+        day_menus = {}
+        for kind1, var_name in var_names.items():
+            for (d, r), v in getattr(model, var_name).items():
+                val = pyo.value(v, exception=False)
+                if val is not None and val > 0.5:
+                    day_menus.setdefault(f"menu{d}", {})[kind1] = r
+        return dict(sorted(day_menus.items()))
+    return extract
+
+
+# --- 引数の変換 ---
+
+def _flat_recipes(build_args):
+    # {rid: {'kind1':..., 'kind2':..., 'recipeTitle':..., 'title':...}}
+    recipes = {}
+    for r in build_args['recipe_ids']:
+        data = dict(build_args['recipe_dict'][r]['data'])
+        data['title'] = data.get('recipeTitle')
+        recipes[r] = data
+    return recipes
+
+def _target(build_args):
+    return next(iter(build_args['nutritionaltarget_dict'].values()))
+
+def _model1_args(build_args):
+    return {
+        'Days': list(build_args['days']),
+        'Recipes': _flat_recipes(build_args),
+        'RecipeItem': {(r, i): v for r in build_args['recipe_ids'] for i, v in build_args['recipeitem_dict'][r].items()},
+        'RecipeNutrition': build_args['filtered_recipe_nutritions'],
+        'NutritionalTarget': build_args['nutritionaltarget_dict'],
+        'userInfo': _target(build_args)['userInfo'],
+        'ItemWeight': build_args['itemweight_dict'],
+        'ItemEqual': build_args['itemequal_dict'],
+    }
+
+def _model2_args(build_args):
+    return {
+        'recipe_dict': _flat_recipes(build_args),
+        'recipe_item_dict': {r: build_args['recipeitem_dict'][r] for r in build_args['recipe_ids']},
+        'recipe_nutrition_dict': build_args['filtered_recipe_nutritions'],
+        'nutritional_target_dict': build_args['nutritionaltarget_dict'],
+        'user_info': _target(build_args)['userInfo'],
+        'item_weight_dict': build_args['itemweight_dict'],
+        'item_equal_dict': build_args['itemequal_dict'],
+        'user_input_ingredients': build_args['regist_item'],
+    }
+
+def _model3_args(build_args):
+    # NutritionalTarget[userInfo] で引くので、キーはハッシュ可能な値にする
+    return {
+        'Days': list(build_args['days']),
+        'Recipes': _flat_recipes(build_args),
+        'RecipeItem': build_args['recipeitem_dict'],
+        'RecipeNutrition': build_args['filtered_recipe_nutritions'],
+        'NutritionalTarget': {0: _target(build_args)['nutritionals']},
+        'ItemWeight': build_args['itemweight_dict'],
+        'ItemEqual': build_args['itemequal_dict'],
+        'userInfo': 0,
+        'regist_item': build_args['regist_item'],
+    }
+
+def _identity_args(build_args):
+    return build_args
+
+def _adapted(function, adapter):
+    return lambda **build_args: function(**adapter(build_args))
+
+
+# 既知のファイル: 名前 → (ファイル, 関数名, 引数の変換, 取り出し, ひな形対応)
+KNOWN_FILES = {
+    'model1': ('api_pyomo_model.py', 'build_model', _model1_args,
+               kind_var_extractor({'staple': 'staple', 'main': 'main', 'side': 'side', 'soup': 'soup'}), False),
+    'model2': ('api_pyomo_model2.py', 'create_meal_plan_model', _model2_args,
+               kind_var_extractor({'staple': 'x_staple', 'main': 'x_main', 'side': 'x_side', 'soup': 'x_soup'}), False),
+    'model3': ('api_pyomo_model3.py', 'build_model', _model3_args, extract_day_menus, False),
+    'model4': ('api_pyomo_model4.py', 'build_model', _identity_args, extract_day_menus, True),
+}
+
+
+# 今のPyomoではモデルを作れないことが分かっている定式化（生成されたファイル自体の誤り）
+# 読み込まずに理由だけを registry_errors() に残す（ファイルを直したらここから外す）
+EXCLUDED = {
+    'model2': "api_pyomo_model2.py は Pyomo の予約属性 model.items に集合を宣言しているため作れません",
+    'model3': "api_pyomo_model3.py はレシピの辞書で Set を初期化し、Param を Set の要素と比べているため作れません",
+}
+
+
+# 検証用の小さな入力（主食・主菜・副菜・汁物が1品ずつ、1日分）
+_SMOKE_KINDS = {1: 'staple', 2: 'main', 3: 'side', 4: 'soup'}
+SMOKE_BUILD_ARGS = {
+    'days': [1],
+    'recipe_dict': {r: {'recipeId': r, 'data': {'kind1': k, 'kind2': 'ご飯' if k == 'staple' else k, 'recipeTitle': f"recipe{r}"}}
+                    for r, k in _SMOKE_KINDS.items()},
+    'recipe_ids': list(_SMOKE_KINDS),
+    'recipeitem_dict': {r: {'にんじん': 10.0} for r in _SMOKE_KINDS},
+    'filtered_recipe_nutritions': {r: {'カロリー(kcal)': 100.0, '鉄(mg)': 1.0} for r in _SMOKE_KINDS},
+    'nutritionaltarget_dict': {0: {'nutritionals': {'カロリー': 400, '鉄_下限': 1.0},
+                                   'userInfo': {'年齢': '30~49(歳)', '性別': '女性', '運動レベル': 'ふつう'}}},
+    'itemweight_dict': {},
+    'itemequal_dict': {},
+    'menstruation': 'なし',
+    'regist_item': {'にんじん': 40.0},
+    'use_pfc': True,
+}
+
+# ひな形（templates.py）で書き換える部品
+TEMPLATE_COMPONENTS = ['RegistItemBalance', 'Unused', 'RegistIngredients', 'y_regist', 'YRegistConstraint', 'NutritionConstraints', 'obj']
+
+#変換後の引数名が関数の引数と合うか確認する
+def _check_signature(function, adapter):
+    names = set(adapter(SMOKE_BUILD_ARGS))
+    params = inspect.signature(function).parameters
+    if any(p.kind == inspect.Parameter.VAR_KEYWORD for p in params.values()):
+        accepted = names
+    else:
+        accepted = set(params)
+    required = {n for n, p in params.items()
+                if p.default is inspect.Parameter.empty and p.kind not in (p.VAR_POSITIONAL, p.VAR_KEYWORD)}
+    if not required <= names:
+        raise TypeError(f"引数が足りません: {sorted(required - names)}")
+    if not names <= accepted:
+        raise TypeError(f"受け取れない引数があります: {sorted(names - accepted)}")
+
+#小さな入力でモデルを作り、献立の取り出しまで通るか確認する
+def validate(formulation):
+    model = formulation.build(**SMOKE_BUILD_ARGS)
+    formulation.extract(model)
+    if formulation.templatable:
+        missing = [c for c in TEMPLATE_COMPONENTS if not hasattr(model, c)]
+        if missing:
+            raise TypeError(f"ひな形に必要な部品がありません: {missing}")
+
+
+#読み込み・検証で失敗したモデルの構築エラーは理由を1行にまとめて出すので、Pyomo自身のERRORログは抑える
+@contextmanager
+def _quiet_pyomo():
+    loggers = [logging.getLogger(name) for name in ('pyomo', 'pyomo.core')]
+    levels = [lg.level for lg in loggers]
+    for lg in loggers:
+        lg.setLevel(logging.CRITICAL)
+    try:
+        yield
+    finally:
+        for lg, level in zip(loggers, levels):
+            lg.setLevel(level)
+
+
+def _load_file(name, filename, function_name, adapter, extract, templatable):
+    function = load_build_model(filename, function_name)
+    if not callable(function):
+        raise TypeError(f"{function_name} が見つかりません")
+    _check_signature(function, adapter)
+    return Formulation(name, _adapted(function, adapter), extract, templatable, filename)
+
+
+def _builtin_formulations():
+    from .matrix_model import build_model as matrix_build
+    from .aggregate_model import build_model as aggregate_build, extract_day_menus as assign_days
+    # *_tight: big-M を食材ごとの週の最大使用量にしたもの（LP緩和が強くなる）
+    return [
+        Formulation('matrix', matrix_build, extract_day_menus, True, 'matrix_model.py'),
+        Formulation('aggregate', aggregate_build, assign_days, True, 'aggregate_model.py'),
+        Formulation('matrix_tight', partial(matrix_build, tight_big_m=True), extract_day_menus, True, 'matrix_model.py'),
+        Formulation('aggregate_tight', partial(aggregate_build, tight_big_m=True), assign_days, True, 'aggregate_model.py'),
+    ]
+
+
+#全定式化を読み込む。読み込めない・引数が合わないものはログに出して登録しない（EXCLUDED は理由だけ残す）
+def load_formulations():
+    registry = {f.name: f for f in _builtin_formulations()}
+    errors = dict(EXCLUDED)
+
+    known_files = {spec[0] for spec in KNOWN_FILES.values()}
+    for name, spec in KNOWN_FILES.items():
+        if name in EXCLUDED:
+            continue
+        try:
+            registry[name] = _load_file(name, *spec)
+        except Exception as e:
+            errors[name] = str(e)
+
+    # 新しく生成されたファイル（api_pyomo_model5.py など）は model4 と同じ引数の build_model を持つものだけ登録する
+    for path in sorted(glob.glob(os.path.join(BASE_DIR, "api_pyomo_model*.py"))):
+        filename = os.path.basename(path)
+        if filename in known_files:
+            continue
+        name = filename[len("api_pyomo_"):-len(".py")]
+        try:
+            registry[name] = _load_file(name, filename, 'build_model', _identity_args, extract_day_menus, False)
+        except Exception as e:
+            errors[name] = str(e)
+
+    with _quiet_pyomo():
+        for name, formulation in list(registry.items()):
+            try:
+                validate(formulation)
+            except Exception as e:
+                errors[name] = f"{type(e).__name__}: {e}"
+                del registry[name]
+
+    for name, message in errors.items():
+        if name in EXCLUDED:
+            logger.info("定式化 %s は除外しています: %s", name, message)
+        else:
+            logger.warning("定式化 %s を登録できません: %s", name, message)
+    return registry, errors
+
+
+_registry = None
+_errors = {}
+
+def get_registry():
+    global _registry, _errors
+    if _registry is None:
+        _registry, _errors = load_formulations()
+    return _registry
+
+def registry_errors():
+    get_registry()
+    return dict(_errors)
+
+def get(name):
+    registry = get_registry()
+    if name not in registry:
+        reason = _errors.get(name)
+        if reason:
+            raise KeyError(f"定式化 {name} は登録されていません: {reason}")
+        raise KeyError(f"定式化 {name} は登録されていません（登録済み: {sorted(registry)}）")
+    return registry[name]
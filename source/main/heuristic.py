@@ -0,0 +1,232 @@
+#ソルバーを使わない献立のヒューリスティック（貪欲法で作り、1品ずつの入れ替えで改善する）
+#すぐに返す献立、ソルバーが時間内に解を返さなかった時の代わり、ソルバーの初期解として使う
+#制約・目的関数は api_pyomo_model4.build_model と同じものを NumPy の配列で評価する
+import os,time
+import numpy as np
+
+from .matrix_model import build_matrices, nutrition_bounds, PFC_KEYS, OTHER_KEYS, WEIGHT_ITEM, WEIGHT_MULTIPLE
+from .feasibility import recipe_classes
+from .presolve import multiple_delta
+
+HEURISTIC_TIME_LIMIT = float(os.environ.get("HEURISTIC_TIME_LIMIT", 0.1))  # 秒
+PENALTY_VIOLATION = 1000  # 制約違反（上下限に対する割合）1あたりの罰則
+TOLERANCE = 1e-6
+
+
+class MenuArrays:
+    """献立の評価に使う配列（レシピは行）"""
+
+    def __init__(self, build_args):
+        matrices = build_matrices(build_args['recipe_ids'], build_args['recipeitem_dict'], build_args['filtered_recipe_nutritions'])
+        self.recipe_ids = matrices.recipe_ids
+        n = len(self.recipe_ids)
+
+        # 栄養素の週の上下限
+        nutritionals = next(iter(build_args['nutritionaltarget_dict'].values()))['nutritionals']
+        nut_keys = PFC_KEYS + OTHER_KEYS if build_args['use_pfc'] else OTHER_KEYS
+        bounds = {nut: nutrition_bounds(nut, nutritionals, build_args['menstruation']) for nut in nut_keys}
+        bounds = {nut: b for nut, b in bounds.items() if b is not None}
+        self.values = np.zeros((n, len(bounds)))
+        for k, nut in enumerate(bounds):
+            rows, coefs = matrices.nutrient_column(nut)
+            self.values[rows, k] = coefs
+        self.lower = np.array([-np.inf if b[0] is None else b[0] for b in bounds.values()])
+        self.upper = np.array([np.inf if b[1] is None else b[1] for b in bounds.values()])
+        self.nut_scale = np.maximum(np.abs(np.where(np.isfinite(self.lower), self.lower, self.upper)), 1.0)
+
+        # 食材の週の使用量の上限: 登録食材は登録量、重さを登録した食材は item_used（0/1）
+        limits = {i: float(amount) for i, amount in build_args['regist_item'].items()}
+        for i in build_args['itemweight_dict']:
+            limits[i] = min(limits.get(i, 1.0), 1.0)
+        limits = {i: v for i, v in limits.items() if i in matrices.item_index}
+        self.limit = np.array(list(limits.values()))
+        self.limit_usage = matrices.A[:, [matrices.item_index[i] for i in limits]].toarray() if limits else np.zeros((n, 0))
+        self.limit_scale = np.maximum(self.limit, 1.0)
+
+        # 使う食材（種類数を数える）と、重さの倍数からの誤差
+        self.uses = (matrices.A > 0).toarray()
+        self.delta = multiple_delta(matrices, build_args['itemweight_dict'])
+
+        # 1品だけで上限を超えるレシピは使わない
+        allowed = (self.limit_usage <= self.limit + TOLERANCE).all(axis=1)
+        allowed &= (self.values <= self.upper + TOLERANCE).all(axis=1)
+        classes = recipe_classes(build_args['recipe_dict'], self.recipe_ids)
+        self.classes = {k: rows[allowed[rows]] for k, rows in classes.items() if k != 'other'}
+
+    def violation(self, nutrients, limit_usage):
+        # 行ごと（最後の軸）に制約違反の大きさを合計する
+        nut = np.maximum(self.lower - nutrients, 0) + np.maximum(nutrients - self.upper, 0)
+        lim = np.maximum(limit_usage - self.limit, 0)
+        return (nut / self.nut_scale).sum(axis=-1) + (lim / self.limit_scale).sum(axis=-1)
+
+
+class WeekState:
+    """1週間の献立と、その合計値"""
+
+    def __init__(self, arrays, days, special_days, rows):
+        self.arrays = arrays
+        self.days = days
+        self.special = set(special_days)
+        self.slots = dict(rows)  # (日, 区分) → レシピの行
+        self.nutrients = arrays.values[list(self.slots.values())].sum(axis=0)
+        self.limit_usage = arrays.limit_usage[list(self.slots.values())].sum(axis=0)
+        self.counts = arrays.uses[list(self.slots.values())].sum(axis=0)
+        self.delta = arrays.delta[list(self.slots.values())].sum()
+
+    def objective(self):
+        return WEIGHT_ITEM * (self.counts > 0).sum() + WEIGHT_MULTIPLE * self.delta
+
+    def violation(self):
+        return float(self.arrays.violation(self.nutrients, self.limit_usage))
+
+    def score(self):
+        return PENALTY_VIOLATION * self.violation() + self.objective()
+
+    #removed の行を外して candidates のどれか1つを入れた時のスコア（候補ごと）
+    def scores_after(self, removed, candidates):
+        a = self.arrays
+        nutrients = self.nutrients - a.values[removed].sum(axis=0) + a.values[candidates]
+        limit_usage = self.limit_usage - a.limit_usage[removed].sum(axis=0) + a.limit_usage[candidates]
+        counts = self.counts - a.uses[removed].sum(axis=0)
+        items = (counts > 0).sum() + (a.uses[candidates] & (counts == 0)).sum(axis=1)
+        delta = self.delta - a.delta[removed].sum() + a.delta[candidates]
+        return PENALTY_VIOLATION * a.violation(nutrients, limit_usage) + WEIGHT_ITEM * items + WEIGHT_MULTIPLE * delta
+
+    def replace(self, removed_slots, added):
+        a = self.arrays
+        for slot in removed_slots:
+            r = self.slots.pop(slot)
+            self.nutrients -= a.values[r]
+            self.limit_usage -= a.limit_usage[r]
+            self.counts -= a.uses[r]
+            self.delta -= a.delta[r]
+        for slot, r in added.items():
+            self.slots[slot] = r
+            self.nutrients += a.values[r]
+            self.limit_usage += a.limit_usage[r]
+            self.counts += a.uses[r]
+            self.delta += a.delta[r]
+
+    def unused(self, kind):
+        rows = self.arrays.classes[kind]
+        used = set(self.slots.values())
+        return np.array([r for r in rows if r not in used], dtype=int)
+
+    def day_menus(self):
+        menus = {f"menu{d}": {} for d in self.days}
+        for (d, kind), r in self.slots.items():
+            menus[f"menu{d}"]['staple' if kind in ('normal', 'special') else kind] = self.arrays.recipe_ids[r]
+        return menus
+
+
+def _day_kinds(special):
+    return ('special', 'side', 'soup') if special else ('normal', 'main', 'side', 'soup')
+
+
+#日ごとに、その時点の合計が週の目標（上下限の中央）の日割りに近づくレシピを選ぶ
+def greedy_week(arrays, days, special_days, rng):
+    target = np.where(np.isfinite(arrays.upper), (np.where(np.isfinite(arrays.lower), arrays.lower, 0) + arrays.upper) / 2, arrays.lower)
+    rows = {}
+    used = set()
+    total = np.zeros(arrays.values.shape[1])
+    for n, d in enumerate(days, start=1):
+        for kind in _day_kinds(d in special_days):
+            candidates = np.array([r for r in arrays.classes[kind] if r not in used], dtype=int)
+            if len(candidates) == 0:
+                return None
+            # 1日の品数で割った目標に対する残り
+            gap = (target * n / len(days) - total - arrays.values[candidates]) / arrays.nut_scale
+            cost = (gap ** 2).sum(axis=1) + rng.random(len(candidates)) * 1e-3
+            r = int(candidates[np.argmin(cost)])
+            rows[(d, kind)] = r
+            used.add(r)
+            total += arrays.values[r]
+    return WeekState(arrays, days, special_days, rows)
+
+#1品の入れ替えと、主菜なしの日⇔通常の日の切り替えのうち、最も良くなるものを繰り返す
+def local_search(state, deadline):
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        current = state.score()
+        for slot in list(state.slots):
+            if slot not in state.slots:
+                continue
+            d, kind = slot
+            candidates = state.unused(kind)
+            if len(candidates) == 0:
+                continue
+            scores = state.scores_after([state.slots[slot]], candidates)
+            k = int(np.argmin(scores))
+            if scores[k] < current - TOLERANCE:
+                state.replace([slot], {slot: int(candidates[k])})
+                current = scores[k]
+                improved = True
+
+        for d in state.days:
+            if time.perf_counter() >= deadline:
+                break
+            if d in state.special:
+                # 主菜なしの主食 → 通常の主食 + 主菜（主食を先に決め、次に主菜を決める）
+                staples, mains = state.unused('normal'), state.unused('main')
+                if len(staples) == 0 or len(mains) == 0:
+                    continue
+                removed = [state.slots[(d, 'special')]]
+                staple = int(staples[np.argmin(state.scores_after(removed, staples))])
+                trial = WeekState(state.arrays, state.days, state.special - {d},
+                                  {s: r for s, r in state.slots.items() if s != (d, 'special')} | {(d, 'normal'): staple})
+                mains = trial.unused('main')
+                scores = trial.scores_after([], mains)
+                k = int(np.argmin(scores))
+                if scores[k] < current - TOLERANCE:
+                    state.replace([(d, 'special')], {(d, 'normal'): staple, (d, 'main'): int(mains[k])})
+                    state.special.discard(d)
+                    current = scores[k]
+                    improved = True
+            else:
+                specials = state.unused('special')
+                if len(specials) == 0:
+                    continue
+                removed = [state.slots[(d, 'normal')], state.slots[(d, 'main')]]
+                scores = state.scores_after(removed, specials)
+                k = int(np.argmin(scores))
+                if scores[k] < current - TOLERANCE:
+                    state.replace([(d, 'normal'), (d, 'main')], {(d, 'special'): int(specials[k])})
+                    state.special.add(d)
+                    current = scores[k]
+                    improved = True
+    return state
+
+
+#制限時間内に初期解を変えながら探索し、最も良い献立を run_menu_job と同じ形の dict で返す
+def heuristic_menu(build_args, time_limit=HEURISTIC_TIME_LIMIT, seed=0):
+    deadline = time.perf_counter() + time_limit
+    arrays = MenuArrays(build_args)
+    days = list(build_args['days'])
+    rng = np.random.default_rng(seed)
+    n_special = len(arrays.classes['special'])
+
+    best = None
+    attempt = 0
+    while time.perf_counter() < deadline or best is None:
+        # 主菜なしの日の数を変えて作り直す（最初は0日から）
+        count = min(attempt % (len(days) + 1), n_special)
+        special_days = set(rng.choice(days, size=count, replace=False).tolist()) if count else set()
+        state = greedy_week(arrays, days, special_days, rng)
+        attempt += 1
+        if state is None:
+            if attempt > len(days):
+                break
+            continue
+        state = local_search(state, deadline)
+        if best is None or state.score() < best.score():
+            best = state
+        if attempt > 1000:
+            break
+
+    if best is None:
+        return {'ok': False, 'status': 'heuristic', 'day_menus': {}, 'message': "献立を作成できませんでした"}
+    if best.violation() > TOLERANCE:
+        return {'ok': False, 'status': 'heuristic', 'day_menus': best.day_menus(),
+                'message': "栄養素・登録食材の条件を満たす献立が見つかりませんでした"}
+    return {'ok': True, 'status': 'heuristic', 'day_menus': best.day_menus(), 'message': None, 'score': float(best.objective())}
@@ -0,0 +1,41 @@
+#献立作成ジョブのキュー
+#ソルバーはWebリクエストの外（ローカルのワーカープロセス）で実行し、結果はコールバックで受け取る
+import os,uuid
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from .optimize import run_menu_job
+from .formulations import get_registry
+from .racing import should_race, race_menu_job
+
+SOLVER_WORKERS = int(os.environ.get("SOLVER_WORKERS", 2))
+
+_executor = None
+
+def get_executor():
+    # gunicornのワーカーがforkされた後に作るため遅延生成する
+    # 子プロセスはDB接続を引き継がないようspawnで起動する
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=SOLVER_WORKERS,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=get_registry,  # 定式化はワーカー起動時に1回だけ読み込む
+        )
+    return _executor
+
+def new_job_id():
+    return uuid.uuid4().hex
+
+#ジョブを投入し、終了時に on_done(job_id, result) を呼ぶ
+def submit_menu_job(job_id, build_args, on_done, warm_starts=None, catalog_version=None):
+    def _done(future):
+        try:
+            result = future.result()
+        except Exception as e:
+            result = {'ok': False, 'status': 'error', 'day_menus': {}, 'message': f"ソルバー実行エラー: {e}"}
+        on_done(job_id, result)
+
+    job = race_menu_job if should_race(build_args) else run_menu_job
+    future = get_executor().submit(job, build_args, warm_starts, catalog_version)
+    future.add_done_callback(_done)
+    return future
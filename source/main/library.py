@@ -0,0 +1,60 @@
+#登録食材なしのリクエスト用の献立ライブラリ
+#登録食材がなければモデルは栄養目標・月経の有無・use_pfc だけで決まるので、事前に解いて複数の最適解を保存しておく
+import os,hashlib
+import pyomo.environ as pyo
+
+from . import formulations
+from .optimize import SOLVER_RATIO_GAP, MENU_FORMULATION, get_formulation, make_solver, target_key
+from .presolve import USE_PRESOLVE, presolve, add_objective_offset
+
+LIBRARY_SIZE = int(os.environ.get("MENU_LIBRARY_SIZE", 5))  # 1プロファイルあたりの献立数
+LIBRARY_GAP = float(os.environ.get("MENU_LIBRARY_GAP", SOLVER_RATIO_GAP))  # 最良解からの許容差
+
+#ライブラリの検索キー（月経は 'あり' とそれ以外の2通りしかモデルに影響しない）
+def library_key(build_args):
+    menstruation = 'あり' if build_args['menstruation'] == 'あり' else 'なし'
+    key = target_key(dict(build_args, menstruation=menstruation))
+    return hashlib.md5(key.encode('utf-8')).hexdigest()
+
+#レシピの週の使用回数（x[d, r] のモデルでも集約モデルでも同じ式で扱う）
+def _weekly_count(model, r):
+    if hasattr(model, 'n'):
+        return model.n[r]
+    return sum(model.x[d, r] for d in model.Days)
+
+#最適解を求め、同じレシピの組み合わせを禁止して解き直すことを繰り返す
+#曜日の入れ替えだけの解を除くため、禁止は週単位のレシピの組（ご飯以外）で行う
+def solve_library_menus(build_args, size=LIBRARY_SIZE, gap=LIBRARY_GAP, formulation=None):
+    build_model, extract = get_formulation(formulation)
+    build_args = dict(build_args, regist_item={})
+    if USE_PRESOLVE and formulations.get(formulation or MENU_FORMULATION).templatable:
+        build_args, report = presolve(build_args)
+        model = build_model(**build_args)
+        add_objective_offset(model, report['objective_offset'])  # LIBRARY_GAP を絞り込みなしと同じ意味にする
+    else:
+        model = build_model(**build_args)
+    model.LibraryCuts = pyo.ConstraintList()
+    solver = make_solver()
+
+    menus = []
+    best = None
+    for _ in range(size):
+        results = solver.solve(model, load_solutions=False)
+        if len(results.solution) == 0:
+            break
+        model.solutions.load_from(results)
+        objective = pyo.value(model.obj)
+        if best is None:
+            best = objective
+        elif objective > best + abs(best) * gap:
+            break
+        menus.append({'objective': objective, 'day_menus': extract(model)})
+
+        used = [
+            r for r in model.Recipes
+            if model.kind2_map[r] != 'ご飯' and round(pyo.value(_weekly_count(model, r))) >= 1
+        ]
+        if not used:
+            break
+        model.LibraryCuts.add(sum(_weekly_count(model, r) for r in used) <= len(used) - 1)
+    return menus
@@ -0,0 +1,325 @@
+#行列ベースのモデル作成
+#api_pyomo_model4.build_model と同じモデルを、レシピ×食材・レシピ×栄養素の疎行列の非ゼロ要素から直接作る
+from dataclasses import dataclass
+import numpy as np
+import pyomo.environ as pyo
+from pyomo.core.expr.numeric_expr import LinearExpression
+from scipy import sparse
+
+PFC_KEYS = [
+    'カロリー(kcal)',
+    'たんぱく質(g)',
+    '脂質(g)',
+    '炭水化物(g)',
+]
+
+OTHER_KEYS = [
+    "食物繊維(g)",
+    "カルシウム(mg)",
+    "ビタミンA(μg)",
+    "ビタミンD(μg)",
+    "ビタミンC(mg)",
+    "ビタミンB₁(mg)",
+    "ビタミンB₂(mg)",
+    "鉄(mg)"
+]
+
+STAPLE_SPECIAL_KIND2 = {'ご飯もの', 'パスタ', 'カレー', '鍋'}
+
+# 目的関数の重み（api_pyomo_model4と同じ）
+WEIGHT_ITEM = 1
+WEIGHT_REGIST = 10
+PENALTY_NOT_USE = 50
+WEIGHT_MULTIPLE = 3
+BIG_M_REGIST = 1000
+BIG_M_LINK = 1e6
+
+
+#tight_big_m=True の時の big-M: 食材ごとの週の最大使用量（献立の構成ルールから計算）
+#item_used_rep は item_used（0/1）以上であればよいので上限は1
+def big_m_values(matrices, recipe_dict, n_days, tight_big_m):
+    if not tight_big_m:
+        return {i: BIG_M_REGIST for i in matrices.items}, {i: BIG_M_LINK for i in matrices.items}, BIG_M_LINK
+    from .feasibility import max_item_usage  # feasibility は matrix_model を使うので、ここで読み込む
+    usage = {i: float(v) for i, v in zip(matrices.items, max_item_usage(matrices, recipe_dict, n_days))}
+    return usage, usage, 1.0
+
+
+@dataclass(frozen=True)
+class RecipeMatrices:
+    recipe_ids: list
+    items: list              # 行列の列に対応する食材名
+    item_index: dict         # 食材名 → 列番号
+    A: sparse.csc_matrix     # レシピ×食材（使用量g）
+    nutrients: list
+    nutrient_index: dict
+    N: sparse.csc_matrix     # レシピ×栄養素（含有量）
+
+    def item_column(self, item):
+        """食材の列の非ゼロ要素 (レシピ番号の配列, 使用量の配列) を返す"""
+        j = self.item_index.get(item)
+        if j is None:
+            return np.empty(0, dtype=int), np.empty(0)
+        start, end = self.A.indptr[j], self.A.indptr[j + 1]
+        return self.A.indices[start:end], self.A.data[start:end]
+
+    def nutrient_column(self, nut):
+        j = self.nutrient_index.get(nut)
+        if j is None:
+            return np.empty(0, dtype=int), np.empty(0)
+        start, end = self.N.indptr[j], self.N.indptr[j + 1]
+        return self.N.indices[start:end], self.N.data[start:end]
+
+
+def _to_csc(recipe_ids, values_dict):
+    names = sorted({k for values in values_dict.values() for k, v in values.items() if v})
+    index = {name: j for j, name in enumerate(names)}
+    rows, cols, data = [], [], []
+    for row, r in enumerate(recipe_ids):
+        for k, v in values_dict.get(r, {}).items():
+            if v:
+                rows.append(row)
+                cols.append(index[k])
+                data.append(float(v))
+    matrix = sparse.csc_matrix((data, (rows, cols)), shape=(len(recipe_ids), len(names)))
+    matrix.sort_indices()
+    return names, index, matrix
+
+
+#recipeitem_dict / filtered_recipe_nutritions を疎行列に変換する
+def build_matrices(recipe_ids, recipeitem_dict, filtered_recipe_nutritions):
+    items, item_index, A = _to_csc(recipe_ids, recipeitem_dict)
+    nutrients, nutrient_index, N = _to_csc(recipe_ids, filtered_recipe_nutritions)
+    return RecipeMatrices(
+        recipe_ids=list(recipe_ids),
+        items=items,
+        item_index=item_index,
+        A=A,
+        nutrients=nutrients,
+        nutrient_index=nutrient_index,
+        N=N,
+    )
+
+
+#栄養素ごとの (下限, 上限) を返す。制約にしない場合は None
+def nutrition_bounds(nut, nutritionals, menstruation):
+    cal_val = nutritionals.get('カロリー', None)
+
+    if nut == 'カロリー(kcal)':
+        return cal_val * 0.9, cal_val * 1.1
+    if nut == 'たんぱく質(g)':
+        return (cal_val * (nutritionals.get('たんぱく質_下限',0)/100) / 4,
+                cal_val * (nutritionals.get('たんぱく質_上限',0)/100) / 4)
+    if nut == '脂質(g)':
+        return (cal_val * (nutritionals.get('脂質_下限',0)/100) / 9,
+                cal_val * (nutritionals.get('脂質_上限',0)/100) / 9)
+    if nut == '炭水化物(g)':
+        return (cal_val * (nutritionals.get('炭水化物_下限',0)/100) / 4,
+                cal_val * (nutritionals.get('炭水化物_上限',0)/100) / 4)
+
+    # それ以外の栄養素
+    lower = nutritionals.get(f"{nut.split('(')[0]}_下限", None)
+    upper = nutritionals.get(f"{nut.split('(')[0]}_上限", None)
+
+    # 鉄の月経対応
+    if nut == '鉄(mg)':
+        if menstruation == 'あり':
+            lower = nutritionals.get('鉄・月経時_下限', None)
+        else:
+            lower = nutritionals.get('鉄_下限', None)
+        upper = nutritionals.get('鉄_上限', None)
+
+    if lower is None and upper is None:
+        return None
+    return lower, upper
+
+
+#同一食材（itemequal_dict）をまとめ、食材 → 代表の食材（名前順で最初のもの）の対応を返す
+def item_representatives(itemweight_dict, itemequal_dict):
+    target_items = set(itemweight_dict.keys()) | set(itemequal_dict.keys())
+    eq_classes = []
+    visited = set()
+    for i in sorted(target_items):
+        if i in visited:
+            continue
+        group = set([i])
+        if i in itemequal_dict:
+            group.update(itemequal_dict[i]['equals'])
+        for j in list(group):
+            if j in itemequal_dict:
+                group.update(itemequal_dict[j]['equals'])
+        eq_classes.append(frozenset(group))
+        visited.update(group)
+
+    rep_map = {}
+    for group in eq_classes:
+        rep = sorted(group)[0]
+        for i in group:
+            rep_map[i] = rep
+    return target_items, rep_map
+
+
+#列の非ゼロ要素から 週全体の Σ_d Σ_r coef[r] * x[d, r] を作る
+def weekly_expr(model, days, recipe_ids, rows, coefs):
+    x = model.x
+    linear_vars = [x[d, recipe_ids[k]] for d in days for k in rows]
+    linear_coefs = [float(c) for _ in days for c in coefs]
+    return LinearExpression(constant=0, linear_coefs=linear_coefs, linear_vars=linear_vars)
+
+def daily_expr(model, d, recipes):
+    x = model.x
+    return LinearExpression(constant=0, linear_coefs=[1] * len(recipes), linear_vars=[x[d, r] for r in recipes])
+
+def weekly_count_expr(model, days, r):
+    x = model.x
+    return LinearExpression(constant=0, linear_coefs=[1] * len(days), linear_vars=[x[d, r] for d in days])
+
+
+def build_model(
+    days,
+    recipe_dict,
+    recipe_ids,
+    recipeitem_dict,
+    filtered_recipe_nutritions,
+    nutritionaltarget_dict,
+    itemweight_dict,
+    itemequal_dict,
+    menstruation,
+    regist_item,
+    use_pfc=True,
+    matrices=None,
+    tight_big_m=False
+):
+    if matrices is None:
+        matrices = build_matrices(recipe_ids, recipeitem_dict, filtered_recipe_nutritions)
+    recipe_ids = matrices.recipe_ids
+    days = list(days)
+    big_m_regist, big_m_link, big_m_rep = big_m_values(matrices, recipe_dict, len(days), tight_big_m)
+
+    model = pyo.ConcreteModel()
+    model.Days = pyo.Set(initialize=days)
+    model.Recipes = pyo.Set(initialize=recipe_ids)
+
+    kind1 = {r: recipe_dict[r]['data']['kind1'] for r in recipe_ids}
+    kind2 = {r: recipe_dict[r]['data']['kind2'] for r in recipe_ids}
+    model.kind1_map = pyo.Param(model.Recipes, initialize=kind1, within=pyo.Any)
+    model.kind2_map = pyo.Param(model.Recipes, initialize=kind2, within=pyo.Any)
+
+    staple_special = [r for r in recipe_ids if kind1[r] == 'staple' and kind2[r] in STAPLE_SPECIAL_KIND2]
+    model.StapleSpecialRecipes = pyo.Set(initialize=staple_special)
+
+    model.x = pyo.Var(model.Days, model.Recipes, domain=pyo.Binary)
+
+    # 使用量が正の食材 = 行列の列のうち正の要素を持つもの
+    positive = np.asarray((matrices.A > 0).sum(axis=0)).ravel() > 0
+    ingredients = [i for j, i in enumerate(matrices.items) if positive[j]]
+    model.Ingredients = pyo.Set(initialize=ingredients)
+
+    model.item_used = pyo.Var(itemweight_dict.keys(), domain=pyo.Binary)
+    model.y_item = pyo.Var(model.Ingredients, domain=pyo.Binary)
+
+    # --- 献立の構成（主食・主菜・副菜・汁物） ---
+    by_kind = {k: [r for r in recipe_ids if kind1[r] == k] for k in ('staple', 'main', 'side', 'soup')}
+    model.StapleCount = pyo.Constraint(model.Days, rule=lambda m, d: daily_expr(m, d, by_kind['staple']) == 1)
+    model.MainCount = pyo.Constraint(model.Days, rule=lambda m, d: daily_expr(m, d, by_kind['main'] + staple_special) == 1)
+    model.SideCount = pyo.Constraint(model.Days, rule=lambda m, d: daily_expr(m, d, by_kind['side']) == 1)
+    model.SoupCount = pyo.Constraint(model.Days, rule=lambda m, d: daily_expr(m, d, by_kind['soup']) == 1)
+
+    staple_special_set = set(staple_special)
+    def recipe_usage_rule(m, r):
+        return weekly_count_expr(m, days, r) <= (7 if r in staple_special_set else 1)
+    model.RecipeUsage = pyo.Constraint(model.Recipes, rule=recipe_usage_rule)
+
+    # --- 栄養素 ---
+    nutritionals = next(iter(nutritionaltarget_dict.values()))['nutritionals']
+    nut_keys = PFC_KEYS + OTHER_KEYS if use_pfc else OTHER_KEYS
+
+    def nutrition_rule(m, nut):
+        bounds = nutrition_bounds(nut, nutritionals, menstruation)
+        if bounds is None:
+            return pyo.Constraint.Skip
+        rows, coefs = matrices.nutrient_column(nut)
+        return pyo.inequality(bounds[0], weekly_expr(m, days, recipe_ids, rows, coefs), bounds[1])
+    model.NutritionConstraints = pyo.Constraint(nut_keys, rule=nutrition_rule)
+
+    model.ItemsPerDay = pyo.Constraint(model.Days, rule=lambda m, d: pyo.inequality(3, daily_expr(m, d, recipe_ids), 4))
+
+    # --- 食材ごとの週の使用量（4つの制約で共通に使う） ---
+    usage_items = set(ingredients) | set(regist_item.keys()) | set(itemweight_dict.keys())
+    usage = {}
+    for i in usage_items:
+        rows, coefs = matrices.item_column(i)
+        usage[i] = weekly_expr(model, days, recipe_ids, rows, coefs)
+
+    model.Unused = pyo.Var(regist_item.keys(), domain=pyo.NonNegativeReals)
+    model.RegistItemBalance = pyo.Constraint(
+        regist_item.keys(), rule=lambda m, i: usage[i] + m.Unused[i] == regist_item[i])
+
+    # 登録食材を使ったかどうか（登録された食材のみ）
+    model.RegistIngredients = pyo.Set(initialize=[i for i in ingredients if i in regist_item])
+    model.y_regist = pyo.Var(model.RegistIngredients, domain=pyo.Binary)
+    model.YRegistConstraint = pyo.Constraint(
+        model.RegistIngredients, rule=lambda m, i: usage[i] <= big_m_regist[i] * m.y_regist[i])
+
+    # --- 指定食材の使用量を重さの倍数に近づける（誤差変数） ---
+    # 食材の列の非ゼロ要素（レシピがその食材を使う組）だけに作る
+    amount = {}
+    for i in ingredients:
+        if i not in itemweight_dict or not itemweight_dict[i].get("weights"):
+            continue
+        rows, coefs = matrices.item_column(i)
+        for k, a in zip(rows, coefs):
+            if a > 0:
+                amount[recipe_ids[k], i] = float(a)
+    position = {r: k for k, r in enumerate(recipe_ids)}
+    weight_pairs = sorted(amount, key=lambda ri: (position[ri[0]], ri[1]))
+    model.WeightIndex = pyo.Set(dimen=3, initialize=[(d, r, i) for d in days for (r, i) in weight_pairs])
+    model.e = pyo.Var(model.WeightIndex, within=pyo.NonNegativeReals)
+
+    def multiple_soft_rule(m, d, r, i):
+        a = amount[r, i]
+        weight = itemweight_dict[i]["weights"][0]
+        return m.e[d, r, i] >= m.x[d, r] * a - (weight * round(a / weight))
+
+    def multiple_soft_rule2(m, d, r, i):
+        a = amount[r, i]
+        weight = itemweight_dict[i]["weights"][0]
+        return m.e[d, r, i] >= weight * round(a / weight) - m.x[d, r] * a
+
+    model.MultipleSoft1 = pyo.Constraint(model.WeightIndex, rule=multiple_soft_rule)
+    model.MultipleSoft2 = pyo.Constraint(model.WeightIndex, rule=multiple_soft_rule2)
+
+    # --- 同一食材の紐付け ---
+    target_items, rep_map = item_representatives(itemweight_dict, itemequal_dict)
+    reps = sorted(set(rep_map.values()))
+
+    model.y_item_rep = pyo.Var(reps, domain=pyo.Binary)
+    model.item_used_rep = pyo.Var(reps, domain=pyo.NonNegativeReals)
+
+    def item_used_rep_rule(m, i):
+        if i not in itemweight_dict:
+            return pyo.Constraint.Skip
+        return m.item_used[i] <= m.item_used_rep[rep_map[i]]
+    model.ItemUsedRepLink = pyo.Constraint(sorted(target_items), rule=item_used_rep_rule)
+    model.ItemUsedYLink = pyo.Constraint(reps, rule=lambda m, rep: m.item_used_rep[rep] <= big_m_rep * m.y_item_rep[rep])
+
+    model.ItemUsedCalc = pyo.Constraint(itemweight_dict.keys(), rule=lambda m, i: m.item_used[i] >= usage[i])
+
+    # --- ご飯は7回まで、それ以外は1回まで ---
+    model.GohanRecipes = [r for r in recipe_ids if kind2[r] == 'ご飯']
+    model.NonGohanRecipes = [r for r in recipe_ids if kind2[r] != 'ご飯']
+    model.LimitGohan = pyo.Constraint(model.GohanRecipes, rule=lambda m, r: weekly_count_expr(m, days, r) <= 7)
+    model.LimitNonGohan = pyo.Constraint(model.NonGohanRecipes, rule=lambda m, r: weekly_count_expr(m, days, r) <= 1)
+
+    model.IngredientLink = pyo.Constraint(model.Ingredients, rule=lambda m, i: usage[i] <= big_m_link[i] * m.y_item[i])
+
+    # --- 目的関数 ---
+    model.obj = pyo.Objective(
+        expr = sum(WEIGHT_ITEM * model.y_item[i] for i in model.Ingredients)
+            - sum(WEIGHT_REGIST * model.y_regist[i] for i in model.RegistIngredients)
+            + PENALTY_NOT_USE * sum(1 - model.y_regist[i] for i in model.RegistIngredients)
+            + WEIGHT_MULTIPLE * sum(model.e.values()),
+        sense = pyo.minimize
+    )
+
+    return model
@@ -1,19 +1,35 @@
-from flask import Flask,render_template,request,redirect,flash,url_for,session
+from flask import Flask,render_template,request,redirect,flash,url_for,session,jsonify,abort,Response
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.ext.automap import automap_base
-from sqlalchemy import  cast, BigInteger,literal,select,union_all,Column,DateTime,func,Integer, String
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy import  Column,DateTime,func,Integer, String,text
+from sqlalchemy.dialects.postgresql import JSONB, insert as pg_insert
 from sqlalchemy.ext.mutable import MutableDict
 from flask_login import UserMixin,LoginManager,login_user,login_required,logout_user,current_user
 from werkzeug.security import generate_password_hash,check_password_hash
-import os,json,requests,re,traceback
-from collections import defaultdict
+import os,json,requests,re,traceback,time,zlib,threading
+import multiprocessing
+import click
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from collections import OrderedDict
 from dotenv import load_dotenv
 from perplexity import Perplexity
 from pyomo.environ import SolverFactory
 import pyomo.environ as pyo
-from datetime import datetime
+from datetime import datetime, timedelta
+from functools import partial
 from decimal import Decimal, ROUND_HALF_UP
+from .catalog import build_catalog
+from .jobs import new_job_id, submit_menu_job, get_executor
+from .library import LIBRARY_SIZE, library_key, solve_library_menus
+from .feasibility import check_feasibility
+from .swap import swap_dish
+from .heuristic import heuristic_menu
+from . import solution_cache
+from .solution_cache import normalize_regist_item
+from . import metrics
+from .metrics import timed, observe_timings
+from . import formulations
+from .optimize import SOLVER_TIME_LIMIT, MENU_FORMULATION, make_build_args, wrap_nutritional_target, target_key, remember_solution, cached_solution
 
 
 app = Flask(__name__)
@@ -33,8 +49,92 @@ SQLALCHEMY_DATABASE_URI = os.environ.get("DATABASE_URL")
 app.config['SQLALCHEMY_DATABASE_URI'] = SQLALCHEMY_DATABASE_URI
 db.init_app(app)
 
+#アプリ側で作成するテーブル
+class MenuJob(db.Model):
+    __tablename__ = "menuJobs"
+    jobId = db.Column(db.String(32), primary_key=True)
+    userName = db.Column(db.String(20), nullable=False, index=True)
+    status = db.Column(db.String(10), nullable=False)  # queued / done / failed
+    message = db.Column(db.String, nullable=True)
+    registItem = db.Column(JSONB, nullable=True)
+    createdAt = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    finishedAt = db.Column(db.DateTime, nullable=True)
+
+#登録食材なしのリクエスト用に事前計算した献立（flask build_menu_library で作成）
+class MenuLibrary(db.Model):
+    __tablename__ = "menuLibrary"
+    libraryId = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    libraryKey = db.Column(db.String(32), nullable=False, index=True)
+    catalogVersion = db.Column(db.String(32), nullable=False)
+    rank = db.Column(db.Integer, nullable=False)  # 0が最良
+    objective = db.Column(db.Float, nullable=True)
+    menus = db.Column(JSONB, nullable=False)  # {menuN: {kind1: recipeId}}
+    createdAt = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+#同じ最適化の入力に対する解のキャッシュ（solution_cache.py、ワーカー間で共有）
+class MenuSolution(db.Model):
+    __tablename__ = "menuSolutions"
+    solutionKey = db.Column(db.String(32), primary_key=True)
+    catalogVersion = db.Column(db.String(32), nullable=False, index=True)
+    status = db.Column(db.String(20), nullable=True)
+    menus = db.Column(JSONB, nullable=False)  # {menuN: {kind1: recipeId}}
+    createdAt = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+#献立の買い物リスト（献立の保存時に作る。menuCreatedAt が献立の作成日時と違えば古い）
+class MenuShoppingList(db.Model):
+    __tablename__ = "menuShoppingLists"
+    userName = db.Column(db.String(20), primary_key=True)
+    menuCreatedAt = db.Column(db.DateTime, nullable=False)
+    catalogVersion = db.Column(db.String(32), nullable=False)
+    items = db.Column(JSONB, nullable=False)  # {食材の代表名: 使用量(g)}
+    totalTypes = db.Column(db.Integer, nullable=False)
+
+#献立の栄養素の合計と目標の幅（献立の保存時に作る。/nutrition はこの1行だけを読む）
+class MenuNutritionSummary(db.Model):
+    __tablename__ = "menuNutritionSummaries"
+    userName = db.Column(db.String(20), primary_key=True)
+    menuCreatedAt = db.Column(db.DateTime, nullable=False)
+    catalogVersion = db.Column(db.String(32), nullable=False)
+    weekly = db.Column(JSONB, nullable=False)   # {栄養素名: 週の合計}
+    daily = db.Column(JSONB, nullable=False)    # {menuN: {栄養素名: 1日の合計}}
+    targets = db.Column(JSONB, nullable=False)  # {栄養素名: {'min':..., 'max':...}}
+
+#献立の1品ずつの行（menu の menu1〜menu7 のJSONを正規化したもの。menu の行を消すと一緒に消える）
+#レシピ系のテーブルは読み込み時に全件削除して入れ直すので、recipeId には外部キーを付けずインデックスだけ付ける
+class MenuEntry(db.Model):
+    __tablename__ = "menuEntries"
+    menuId = db.Column(db.Integer, db.ForeignKey('menu.menuId', ondelete='CASCADE'), primary_key=True)
+    day = db.Column(db.SmallInteger, primary_key=True)       # 1〜7（menuN の N）
+    mealType = db.Column(db.String(10), primary_key=True)    # staple / main / side / soup など
+    recipeId = db.Column(db.BigInteger, nullable=False, index=True)
+
+#ユーザーごとの現在の献立（menu の行は献立の版として追加するだけで、更新・削除しない）
+class CurrentMenu(db.Model):
+    __tablename__ = "currentMenus"
+    userName = db.Column(db.String(20), primary_key=True)
+    menuId = db.Column(db.Integer, db.ForeignKey('menu.menuId'), nullable=False)
+    registItem = db.Column(JSONB, nullable=True)  # 現在の献立を作った時の登録食材（1品の入れ替えで使う）
+    updatedAt = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+MENU_COLUMNS = ['menu1','menu2','menu3','menu4','menu5','menu6','menu7']
+
+# 初期解の候補にする過去の献立の版の数（現在の献立を除く）
+MENU_HISTORY_WARM_STARTS = int(os.environ.get("MENU_HISTORY_WARM_STARTS", 3))
+
+# 献立作成時にヒューリスティックの献立をすぐに返すか（ソルバーの結果は後から置き換える）
+INSTANT_MENUS = os.environ.get("INSTANT_MENUS", "0") == "1"
+
+# 結果が返ってこないジョブを失敗扱いにするまでの時間(秒)
+JOB_EXPIRE_SECONDS = SOLVER_TIME_LIMIT * 2
+
+# 定式化は起動時に読み込んで検証し、設定された名前が使えなければ起動を止める
+formulations.get(MENU_FORMULATION)
+
 Base = automap_base()
 with app.app_context():
+    # menuEntries の外部キーの参照先（menu）をアプリ側のメタデータにも読み込む
+    db.metadata.reflect(db.engine, only=['menu'])
+    db.create_all()
     Base.prepare(db.engine, reflect=True)
 RecipeUrl = Base.classes.recipeUrls
 Menu = Base.classes.menu
@@ -87,40 +187,45 @@ def as_dict(row):
     #     out['kind1'] = ''
     return out
 
-#ループ対策
-def wrap_nutritional_target(nt):
-    # nt.nutritionals, nt.userInfo が両方存在すると仮定
-    nutr = nt.nutritionals if hasattr(nt, 'nutritionals') else nt.get('nutritionals', {})
-    userinfo = nt.userInfo if hasattr(nt, 'userInfo') else nt.get('userInfo', {})
-    # None補正
-    for nut, val in nutr.items():
-        if val is None:
-            nutr[nut] = 0
-    return {0: {"nutritionals": nutr, "userInfo": userinfo}}
-
-#誤ったreturn文を自動削除処理
-def sanitize_pyomo_code(code):
-    # よくある誤りパターンを一括補正（False→Infeasible, True→Skip）
-    code = code.replace('return False', 'return pyo.Constraint.Infeasible')
-    code = code.replace('return True', 'return pyo.Constraint.Skip')
-    return code
-
-#ユーザーごとに制約とする栄養素を判断するためのフラグ
-def should_use_pfc(userInfo):
-    age = userInfo.get("年齢")
-    sex = userInfo.get("性別")
-    level = userInfo.get("運動レベル")
-
-    # カロリー考慮で解なしになるユーザー群
-    high_need_patterns = [
-        ("18~29(歳)", "男性", "高い"),
-        ("30~49(歳)", "男性", "高い"),
-        ("50~64(歳)", "男性", "高い")
-    ]
-
-    if (age, sex, level) in high_need_patterns:
-        return False  # PFC制約を外す
-    return True
+#レシピカタログ（ワーカーごとに1つ保持し、カタログのバージョンが変わった時だけ読み直す）
+CATALOG_TABLES = ['recipes', 'recipeItems', 'recipeNutritions', 'itemWeights', 'itemEquals']
+CATALOG_CHECK_INTERVAL = int(os.environ.get("CATALOG_CHECK_INTERVAL", 30))  # バージョン確認の間隔(秒)
+_catalog = None
+_catalog_checked_at = 0.0
+_catalog_lock = threading.Lock()  # ジョブ終了のコールバックのスレッドからも呼ばれる
+
+def catalog_version():
+    # カタログ系テーブルの中身のハッシュをDB側で計算する（1クエリ）
+    parts = " || ".join(
+        f'''(SELECT coalesce(md5(string_agg(t::text, '' ORDER BY t::text)), '') FROM "{name}" t)'''
+        for name in CATALOG_TABLES
+    )
+    return db.session.execute(text(f"SELECT md5({parts})")).scalar()
+
+def get_catalog():
+    global _catalog, _catalog_checked_at
+    with _catalog_lock:
+        now = time.monotonic()
+        if _catalog is not None and now - _catalog_checked_at < CATALOG_CHECK_INTERVAL:
+            return _catalog
+
+        version = catalog_version()
+        _catalog_checked_at = now
+        if _catalog is not None and _catalog.version != version:
+            # カタログが変わったら以前のカタログの解を消す（呼び出し側のトランザクションとは別に行う）
+            with db.engine.begin() as conn:
+                conn.execute(MenuSolution.__table__.delete().where(MenuSolution.catalogVersion != version))
+        if _catalog is None or _catalog.version != version:
+            _catalog = build_catalog(
+                version,
+                recipes=[as_dict(r) for r in db.session.query(Recipe).all()],
+                recipe_items=[as_dict(ri) for ri in db.session.query(RecipeItem).all()],
+                recipe_nutritions=[as_dict(rn) for rn in db.session.query(RecipeNutrition).all()],
+                item_weights=[as_dict(iw) for iw in db.session.query(ItemWeight).all()],
+                item_equals=[as_dict(ie) for ie in db.session.query(ItemEqual).all()],
+            )
+            print(f"カタログ読み込み完了 version={version}")
+        return _catalog
 
 #日毎の献立
 def extract_day_menus_with_categories(model, recipe_list):
@@ -215,128 +320,147 @@ class UserWrapper(UserMixin):
 def home():
     return render_template("home.html", show_navbar=False)
     
-@app.route("/showmenu")
-@login_required
-def show_menus():
-    weekly_data = []
-    menu = db.session.query(Menu).filter_by(userName=current_user.userName).first()
-
-    if menu is None:
-        return render_template("showmenu.html", weekly_data=[], show_navbar=True)
-    
-    menu_created_date = getattr(menu, 'createdAt', None)
-
-    queries = []
-    idx = 0
-
-    for menu_col in ['menu1', 'menu2', 'menu3', 'menu4', 'menu5', 'menu6', 'menu7']:
-        menu_json = getattr(menu, menu_col, {})
-        for meal_type in ['staple', 'main', 'side', 'soup']:
-            if isinstance(menu_json, dict):
-                val = menu_json.get(meal_type)
-            else:
-                val = menu_json
+#献立画面の表示データ（ユーザー → (献立のmenuId・作成日時, 表示データ)）。ワーカーごとに保持する
+SHOWMENU_CACHE_SIZE = int(os.environ.get("SHOWMENU_CACHE_SIZE", 1024))
+MEAL_TYPES = ['staple', 'main', 'side', 'soup']
+_showmenu_cache = OrderedDict()
+_showmenu_lock = threading.Lock()  # ジョブ終了のコールバックのスレッドからも消す
+
+#献立のJSON（{menuN: {区分: recipeId}}）の各枠の (menuN, 区分, recipeId)
+def day_menu_slots(day_menus):
+    slots = []
+    for menu_col in MENU_COLUMNS:
+        menu_json = day_menus.get(menu_col) or {}
+        for meal_type, val in (menu_json.items() if isinstance(menu_json, dict) else []):
             if val is None:  # nullはスキップ
                 continue
-
             try:
-                recipe_id = int(val) if not hasattr(val, 'astext') else int(val.astext)
+                slots.append((menu_col, meal_type, int(val)))
             except (ValueError, TypeError):
                 continue
+    return slots
+
+#献立の各枠の (menuN, 区分, recipeId)。menuEntries の行から作る（移行前の献立はJSONの列から作る）
+def menu_recipe_slots(menu):
+    entries = (
+        db.session.query(MenuEntry.day, MenuEntry.mealType, MenuEntry.recipeId)
+        .filter(MenuEntry.menuId == menu.menuId, MenuEntry.mealType.in_(MEAL_TYPES))
+        .all()
+    )
+    if entries:
+        slots = [(f"menu{e.day}", e.mealType, e.recipeId) for e in entries]
+    else:
+        slots = [slot for slot in day_menu_slots({col: getattr(menu, col, None) for col in MENU_COLUMNS})
+                 if slot[1] in MEAL_TYPES]
+    return sorted(slots, key=lambda slot: (MENU_COLUMNS.index(slot[0]), MEAL_TYPES.index(slot[1])))
+
+#menuEntries に入れる行
+def menu_entry_rows(menu_id, day_menus):
+    return [
+        {'menuId': menu_id, 'day': int(menu_col[len('menu'):]), 'mealType': meal_type, 'recipeId': recipe_id}
+        for menu_col, meal_type, recipe_id in day_menu_slots(day_menus)
+    ]
 
-            idx += 1
-
-            query = (
-                db.session.query(
-                    RecipeUrl.recipeTitle.label('recipeTitle'),
-                    RecipeUrl.recipeUrl.label('recipeUrl'),
-                    RecipeUrl.foodImageUrl.label('foodImageUrl'),
-                    literal(f'{menu_col}_{meal_type}').label('meal_type'),
-                )
-                .join(Menu, RecipeUrl.recipeId == cast(getattr(Menu, menu_col)[meal_type].astext, BigInteger))
-                .filter(Menu.userName == current_user.userName)
-                .filter(RecipeUrl.recipeId == recipe_id)
-            )
-            queries.append(query)
-
-    if not queries:
-        return render_template("showmenu.html", weekly_data=[], show_navbar=True)
-
-    full_query = queries[0]
-    for q in queries[1:]:
-        full_query = full_query.union_all(q)
-
-    core_queries = [q.statement for q in queries]
-    full_union = union_all(*core_queries).alias('full_union')
-
-    stmt = select(
-        full_union.c.recipeTitle,
-        full_union.c.recipeUrl,
-        full_union.c.foodImageUrl,
-        full_union.c.meal_type,
+#献立のレシピをmenuEntriesとrecipeUrlsの結合1回で取得し、曜日ごとの [(タイトル, URL, 画像URL, menuN_区分)] にまとめる
+def weekly_menu_data(menu):
+    rows = (
+        db.session.query(MenuEntry.day, MenuEntry.mealType, RecipeUrl.recipeTitle, RecipeUrl.recipeUrl, RecipeUrl.foodImageUrl)
+        .join(RecipeUrl, RecipeUrl.recipeId == MenuEntry.recipeId)
+        .filter(MenuEntry.menuId == menu.menuId, MenuEntry.mealType.in_(MEAL_TYPES))
+        .all()
     )
+    if rows:
+        slots = {(f"menu{r.day}", r.mealType): (r.recipeTitle, r.recipeUrl, r.foodImageUrl) for r in rows}
+    else:
+        # 移行前の献立: JSONの列のrecipeIdで1回だけIN検索する
+        json_slots = menu_recipe_slots(menu)
+        if not json_slots:
+            return []
+        recipe_ids = {recipe_id for _, _, recipe_id in json_slots}
+        urls = {
+            row.recipeId: (row.recipeTitle, row.recipeUrl, row.foodImageUrl)
+            for row in db.session.query(RecipeUrl.recipeId, RecipeUrl.recipeTitle, RecipeUrl.recipeUrl, RecipeUrl.foodImageUrl)
+            .filter(RecipeUrl.recipeId.in_(recipe_ids))
+        }
+        slots = {(menu_col, meal_type): urls[r] for menu_col, meal_type, r in json_slots if r in urls}
+    if not slots:
+        return []
+    return [
+        [(*slots[(menu_col, meal_type)], f'{menu_col}_{meal_type}') for meal_type in MEAL_TYPES if (menu_col, meal_type) in slots]
+        for menu_col in MENU_COLUMNS
+    ]
 
-    results = db.session.execute(stmt).fetchall()
+@app.route("/showmenu")
+@login_required
+def show_menus():
+    weekly_data = []
+    menu = current_menu(current_user.userName)
+    # 作成中の献立があれば画面に表示する
+    menu_pending = db.session.query(MenuJob).filter_by(userName=current_user.userName, status='queued').first() is not None
 
-    grouped = defaultdict(list)
-    for r in results:
-        menu_col = r.meal_type.split('_')[0] 
-        grouped[menu_col].append(r)
+    if menu is None:
+        return render_template("showmenu.html", weekly_data=[], menu_pending=menu_pending, show_navbar=True)
+    
+    menu_created_date = getattr(menu, 'createdAt', None)
+
+    # 献立の版（menuId）は保存のたびに変わり、版の中身は変わらないので、他のワーカーの古い表示データは使われない
+    stamp = menu.menuId
+    with _showmenu_lock:
+        cached = _showmenu_cache.get(current_user.userName)
+        if cached is not None and cached[0] == stamp:
+            _showmenu_cache.move_to_end(current_user.userName)
+        else:
+            cached = None
+    if cached is not None:
+        weekly_data = cached[1]
+    else:
+        weekly_data = weekly_menu_data(menu)
+        with _showmenu_lock:
+            _showmenu_cache[current_user.userName] = (stamp, weekly_data)
+            while len(_showmenu_cache) > SHOWMENU_CACHE_SIZE:
+                _showmenu_cache.popitem(last=False)
 
-    menu_order = ['menu1', 'menu2', 'menu3', 'menu4', 'menu5', 'menu6', 'menu7']
-    weekly_data = [grouped[m] for m in menu_order]
+    if not weekly_data:
+        return render_template("showmenu.html", weekly_data=[], menu_pending=menu_pending, show_navbar=True)
 
-    return render_template("showmenu.html", weekly_data=weekly_data, menu_created_date=menu_created_date, current_page='showmenu', show_navbar=True)
+    return render_template("showmenu.html", weekly_data=weekly_data, menu_created_date=menu_created_date, menu_pending=menu_pending, current_page='showmenu', show_navbar=True)
 
 @app.route("/item")
 @login_required
 def show_item():
-    aggregated_ingredients = {}
-    menu = db.session.query(Menu).filter_by(userName=current_user.userName).first()
+    menu = current_menu(current_user.userName)
     if menu is None:
-        return render_template("item.html", ingredients=aggregated_ingredients, total_types=0, current_page='item', show_navbar=True)
-
-    # menu1〜menu7のすべてのrecipeIdを取得（中身が例えば {staple:123, main:456} のような構造を想定）
-    recipe_ids = []
-    for menu_col in ['menu1', 'menu2', 'menu3', 'menu4', 'menu5', 'menu6', 'menu7']:
-        menu_json = getattr(menu, menu_col, {})
-        for meal_type in ['staple', 'main', 'side', 'soup']:
-            val = menu_json.get(meal_type)
-            if val is None:
-                continue
-            try:
-                recipe_id = int(val) if not hasattr(val, 'astext') else int(val.astext)
-            except (ValueError, TypeError):
-                continue
-            recipe_ids.append(recipe_id)
-
-    recipe_ids = list(set(recipe_ids))
-
-    # ItemEqualの辞書作成: 等価食材名 -> 代表名
-    item_equals = db.session.query(ItemEqual).all()
-    item_equal_map = {}
-    for eq in item_equals:
-        equals_list = eq.equals.split(',') if eq.equals else []
-        for k in equals_list:
-            item_equal_map[k] = eq.itemName
-        item_equal_map[eq.itemName] = eq.itemName
-
-    # recipeIdごとにitemsを集計
-    for rid in recipe_ids:
-        recipe_item = db.session.query(RecipeItem).filter(RecipeItem.recipeId == rid).first()
-        if not recipe_item:
-            continue
-        for ing_name, qty in recipe_item.items.items():
-            # 代表名に変換
-            rep_name = item_equal_map.get(ing_name, ing_name)
-            # Noneなら0に変換
-            qty = qty if qty is not None else 0
-            # 加算
-            aggregated_ingredients[rep_name] = aggregated_ingredients.get(rep_name, 0) + qty
-
-    total_types = sum(1 for qty in aggregated_ingredients.values() if qty != 0)
+        return render_template("item.html", ingredients={}, total_types=0, current_page='item', show_navbar=True)
 
-    return render_template('item.html', ingredients=aggregated_ingredients, total_types=total_types, current_page='item', show_navbar=True)
+    # 献立の保存時に作った買い物リストを使う（献立・カタログが変わっていれば作り直す）
+    catalog = get_catalog()
+    shopping = db.session.get(MenuShoppingList, current_user.userName)
+    if shopping is None or shopping.menuCreatedAt != menu.createdAt or shopping.catalogVersion != catalog.version:
+        items = store_shopping_list(catalog, current_user.userName, menu, menu.createdAt)
+        db.session.commit()
+    else:
+        items = shopping.items
+
+    return render_template('item.html', ingredients=items, total_types=len(items), current_page='item', show_navbar=True)
+
+#献立のレシピの食材を代表名ごとに合計して保存し、{食材の代表名: 使用量(g)} を返す（commitは呼び出し側）
+#同じレシピを複数の日に使っても1回分として数える
+#同じユーザーの /item が同時に作り直しても主キーが衝突しないよう upsert する
+def store_shopping_list(catalog, userName, menu, menu_created_at):
+    recipe_ids = {recipe_id for _, _, recipe_id in menu_recipe_slots(menu)}
+    items = catalog.shopping_list(recipe_ids)
+    stmt = pg_insert(MenuShoppingList.__table__).values(
+        userName=userName,
+        menuCreatedAt=menu_created_at,
+        catalogVersion=catalog.version,
+        items=items,
+        totalTypes=len(items),
+    )
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=['userName'],
+        set_={c: stmt.excluded[c] for c in ('menuCreatedAt', 'catalogVersion', 'items', 'totalTypes')},
+    ))
+    return items
 
 @app.route('/registitem', methods=['GET'])
 @login_required
@@ -348,15 +472,11 @@ def regist_item():
 def create_menu():
     if request.method == 'POST':
         # リクエストデータを受け取る
-        regist_item = request.json if request.json else {}
-
-        # 0. ログインユーザが以前取得した献立を削除
-        menu = db.session.query(Menu).filter_by(userName=current_user.userName).first()
-        if menu is not None:
-            db.session.delete(menu)
-            db.session.commit()
+        regist_item = normalize_regist_item(request.json if request.json else {})
+        timings = {}
+        lookup_start = time.perf_counter()
 
-        # 1. ログインユーザ情報取得とユーザの以前の献立削除
+        # 1. ログインユーザ情報取得（以前の献立は新しい献立ができた時点で入れ替える）
         user = db.session.query(User).filter_by(userName=current_user.userName).first()
         if not user or not user.userInfo:
             flash("ユーザーターゲットが登録されていません")
@@ -364,130 +484,20 @@ def create_menu():
         user_userInfo = user.userInfo # jsonb型。Pythonではdict想定
         
         # 2. NutritionalTargetからマッチングレコード探索
-        # 年齢、性別、運動レベル
-        userInfo_conditions = user_userInfo.copy()
-        age = userInfo_conditions.get('年齢', None)
-        gender = userInfo_conditions.get('性別', None)
-        activity = userInfo_conditions.get('運動レベル', None)
-
-        # 「75歳以上」かつ「運動レベル 高い」なら運動レベルを「ふつう」に
-        activity_query = activity
-        if age and ('75' in age and activity == '高い'):
-            activity_query = 'ふつう'
-
-        # SQLAlchemyによるjsonbフィールド完全一致 AND 年齢・性別・運動レベル条件
-        nt = db.session.query(NutritionalTarget).filter(
-            NutritionalTarget.userInfo['年齢'].astext == str(age),
-            NutritionalTarget.userInfo['性別'].astext == str(gender),
-            NutritionalTarget.userInfo['運動レベル'].astext == str(activity_query)
-        ).first()
+        nt = find_nutritional_target(user_userInfo)
         if nt is None:
             flash("栄養ターゲットが見つかりません")
             return redirect(url_for('index'))
         nutritional = nt.nutritionals
+        timings['target_lookup'] = time.perf_counter() - lookup_start
 
-        # 3. レシピ・食材・関連データ一式をIDごとにまとめて取得
-        recipes = db.session.query(Recipe).all()
-        recipe_nutritions = {r.recipeId: r.nutritions for r in db.session.query(RecipeNutrition).all()}
-        recipe_items = {ri.recipeId: ri.items for ri in db.session.query(RecipeItem).all()}
-        item_weights = {iw.itemName: iw.weights for iw in db.session.query(ItemWeight).all()}
-        item_equals = {ie.itemName: ie.equals for ie in db.session.query(ItemEqual).all()}
-
-        # PFCを考慮するかどうか判断する
-        no_pfc_users = [
-            ("18~29(歳)", "男性", "高い"),
-            ("30~49(歳)", "男性", "高い"),
-            ("50~64(歳)", "男性", "高い"),
-        ]
-
-        if user_userInfo in no_pfc_users:
-            nutrition_match = {
-                "食塩_上限":"食塩(g)",
-                "食物繊維_下限":"食物繊維(g)",
-                "カルシウム_上限":"カルシウム(mg)",
-                "カルシウム_下限":"カルシウム(mg)",
-                "ビタミンA_上限":"ビタミンA(μg)",
-                "ビタミンA_下限":"ビタミンA(μg)",
-                "ビタミンD_上限": "ビタミンD(μg)",
-                "ビタミンD_下限": "ビタミンD(μg)",
-                "ビタミンC_下限": "ビタミンC(mg)",
-                "ビタミンB1_下限":"ビタミンB₁(mg)",
-                "ビタミンB2_下限":"ビタミンB₂(mg)",
-                "鉄・月経時_下限":"鉄(mg)",
-                "鉄_下限":"鉄(mg)"
-            }
-        else:
-            nutrition_match = {
-            "カロリー":"カロリー(kcal)",
-            "たんぱく質_上限":"たんぱく質(g)",
-            "たんぱく質_下限":"たんぱく質(g)",
-            "脂質_上限":"脂質(g)",
-            "脂質_下限":"脂質(g)",
-            "炭水化物_上限":"炭水化物(g)",
-            "炭水化物_下限":"炭水化物(g)",
-            "食物繊維_下限":"食物繊維(g)",
-            "カルシウム_上限":"カルシウム(mg)",
-            "カルシウム_下限":"カルシウム(mg)",
-            "ビタミンA_上限":"ビタミンA(μg)",
-            "ビタミンA_下限":"ビタミンA(μg)",
-            "ビタミンD_上限": "ビタミンD(μg)",
-            "ビタミンD_下限": "ビタミンD(μg)",
-            "ビタミンC_下限": "ビタミンC(mg)",
-            "ビタミンB1_下限":"ビタミンB₁(mg)",
-            "ビタミンB2_下限":"ビタミンB₂(mg)",
-            "鉄・月経時_下限":"鉄(mg)",
-            "鉄_下限":"鉄(mg)"
-        }
-
-        target_keys = list(nutrition_match.keys())
-
-        filtered_nutritional = {
-            nutrition_match[k]: v
-            for k, v in nt.nutritionals.items()
-            if k in nutrition_match and nutrition_match[k] is not None
-        }
+        # 3. レシピ・食材・関連データ一式はワーカー共通のカタログから取得
+        with timed(timings, 'catalog_load'):
+            catalog = get_catalog()
+        observe_timings(timings)
 
-        nutri_keys = list(filtered_nutritional.keys())
-        filtered_recipe_nutritions = {
-            r.recipeId: {k: v for k, v in r.nutritions.items() if k in nutri_keys}
-            for r in db.session.query(RecipeNutrition).all()
-        }
-
-        # SQLAlchemyからリストやディクショナリでデータ取得
-        recipe_dict = {}
-        for r in db.session.query(Recipe).all():
-            d = as_dict(r)
-            recipe_dict[r.recipeId] = d
-        itemweight_dict = {}
-        for iw in db.session.query(ItemWeight).all():
-            d = as_dict(iw)  # itemName, weights しか存在しない場合
-            # "weights"を必ずリスト化
-            if not isinstance(d.get('weights'), list):
-                d['weights'] = [d['weights']] if d.get('weights') is not None else []
-            # "kind1"がない場合は空文字で補完
-            d['kind1'] = ''
-            itemweight_dict[d['itemName']] = d
-        itemequal_dict = {ie.itemName: as_dict(ie) for ie in db.session.query(ItemEqual).all()}
-        recipeitem_dict = {}
-        recipeitem_list = [as_dict(ri) for ri in db.session.query(RecipeItem).all()]
-        for rec in recipeitem_list:
-            rid = rec['recipeId']
-            items = rec.get('items', {})
-            items_fixed = {k: (v if v is not None else 0) for k, v in items.items()}  # ←qtyそのまま
-            recipeitem_dict[rid] = items_fixed
-        recipenutrition_dict = {rn.recipeId: as_dict(rn) for rn in db.session.query(RecipeNutrition).all()}
-        nutritionaltarget_dict = wrap_nutritional_target(nt)
-        for nt_id, nt_val in nutritionaltarget_dict.items():
-            if 'nutritionals' in nt_val:
-                for nut, val in nt_val['nutritionals'].items():
-                    if val is None:
-                        nt_val['nutritionals'][nut] = 0
-        user = db.session.query(User).filter_by(userName=current_user.userName).first()
         menstruation = user.menstruation
 
-        days = list(range(1,8)) 
-        recipe_ids = list(recipe_dict.keys())
-
         # for r in recipe_dict:
         #     print(r, type(recipe_dict[r]), recipe_dict[r])
 
@@ -533,171 +543,560 @@ def create_menu():
         # print(pyomo_code_str)
         # print('API出力完了')
 
-        #API出力コードの読み込み(ソルバー周辺調整用)
-        base_dir = os.path.dirname(__file__)  # menuapp.pyのある場所
-        api_file_path = os.path.join(base_dir, "api_pyomo_model4.py")
-        with open(api_file_path, encoding='utf-8') as f:
-            pyomo_code_str = f.read()
-        
-        pyomo_code_str = sanitize_pyomo_code(pyomo_code_str)
-        use_pfc = should_use_pfc(user_userInfo)
-
-        scope = {
-            'days': days,                                    # list(range(1,8)) 等
-            'recipe_dict': recipe_dict,
-            'recipe_ids': recipe_ids,             # レシピIDリスト
-            'recipeitem_dict': recipeitem_dict,                   # {rid: {item: qty}}
-            'filtered_recipe_nutritions': filtered_recipe_nutritions,   # {rid: {nutrient: value}}
-            'nutritionaltarget_dict': nutritionaltarget_dict,     # {ターゲットID: {...}}等
-            'itemweight_dict': itemweight_dict,                   # {item: weights}
-            'itemequal_dict': itemequal_dict,                     # {item: equals}
-            'menstruation': menstruation,                        
-            'regist_item': regist_item,                      # dict or None
-            'use_pfc': use_pfc
-        }
-
-        exec(pyomo_code_str, scope, scope)
-        build_model = scope.get('build_model')
+        # 4. モデル作成用の入力をまとめる（ユーザごとに異なる部分のみ計算）
+        build_args = make_build_args(catalog, wrap_nutritional_target(nt), user_userInfo, menstruation, regist_item)
+        nutritionaltarget_dict = build_args['nutritionaltarget_dict']
 
-        print("use_pfc:", use_pfc)
+        print("use_pfc:", build_args['use_pfc'])
         print("cal_val:", next(iter(nutritionaltarget_dict.values()))['nutritionals'].get('カロリー'))
-        print("sample nutritionals:", next(iter(nutritionaltarget_dict.values()))['nutritionals'])
-        # PFCキーが filtered_recipe_nutritions に存在するか確認（最初の数レシピで確認）
-        for k in ['カロリー(kcal)','たんぱく質(g)','脂質(g)','炭水化物(g)']:
-            sample_has = any(k in v for v in filtered_recipe_nutritions.values())
-            print(f"nut key {k} present in recipes?:", sample_has)
-
-        model = build_model(
-            days,
-            recipe_dict, 
-            recipe_ids,
-            recipeitem_dict, 
-            filtered_recipe_nutritions,  
-            nutritionaltarget_dict, 
-            itemweight_dict, 
-            itemequal_dict,
-            menstruation,
-            regist_item,
-            use_pfc
-        )
 
-        # 必要ならnutri_keysも抽出
-        nutri_keys = set()
-        for nutr_t in nutritionaltarget_dict.values():
-            nutri_keys.update(nutr_t.get('nutritionals', {}).keys())
-        nutri_keys = list(nutri_keys)
-
-        print('ソルバー準備完了')
-
-        cbc_path = "/Users/hiruse/cbc/bin/cbc"
-        solver = SolverFactory('cbc', executable=cbc_path)  # フルパスを指定
-        solver.options['sec'] = 300          # 最大5分実行
-        solver.options['ratioGap'] = 0.02    # 2%以内で打ち切り
-        results = solver.solve(model,tee=True)
-        day_menus = extract_day_menus_with_categories(model,list(recipe_dict.values()))
-        print('献立作成完了')
-
-        import logging
-        from pyomo.util.infeasible import log_infeasible_constraints
-
-        logging.getLogger('pyomo.core').setLevel(logging.INFO)
-        log_infeasible_constraints(model)
-
-        # 7. 曜日ごとのMenuレコード保存
-        day_menus = {}
-        for d in model.Days:
-            menu_name = f"menu{d}"
-            day_menus[menu_name] = {}
-            
-            for r in model.Recipes:
-                val = pyo.value(model.x[d, r])
-                if val is not None and val > 0.5:
-                    kind1 = model.kind1_map[r]  # 'staple', 'main', 'side', 'soup'
-                    # 1日1品しか選ばれない前提で key:value 形式に格納
-                    day_menus[menu_name][kind1] = r
-
-        menu_obj = Menu(
+        # 明らかに解けない入力はソルバーに渡さず、理由を返す
+        feasibility_timings = {}
+        with timed(feasibility_timings, 'feasibility_check'):
+            problems = check_feasibility(build_args)
+        observe_timings(feasibility_timings)
+        if problems:
+            print("実行可能性チェックで除外:", problems)
+            return jsonify({'status': 'failed', 'message': '\n'.join(problems)}), 422
+
+        old_menu = current_menu(current_user.userName)
+
+        # 登録食材がなければ事前計算した献立から選ぶ（ソルバーを使わない）
+        if not regist_item:
+            library_menus = pick_library_menus(catalog, build_args, current_user.userName, old_menu)
+            if library_menus is not None:
+                return finish_without_solver(regist_item, {'ok': True, 'status': 'library', 'day_menus': library_menus, 'message': None})
+
+        # 同じ入力で解いたことがあれば、その解を使う（モデル作成・ソルバーを省略）
+        solution_key = solution_cache.solution_key(catalog.version, MENU_FORMULATION, build_args)
+        cached_menus = lookup_solution(solution_key, catalog.version)
+        if cached_menus is not None:
+            return finish_without_solver(regist_item, {'ok': True, 'status': 'cached', 'day_menus': cached_menus, 'message': None})
+
+        # 5. 初期解の候補：前回の献立 → 同じ栄養目標で最後に得られた献立 → それより前の献立の版
+        warm_starts = []
+        if old_menu is not None:
+            warm_starts.append(('previous', {col: getattr(old_menu, col) or {} for col in MENU_COLUMNS}))
+        cached = cached_solution(target_key(build_args))
+        if cached is not None:
+            warm_starts.append(('cached', cached))
+        for k, past in enumerate(menu_history(current_user.userName, old_menu, MENU_HISTORY_WARM_STARTS), start=1):
+            warm_starts.append((f'history{k}', {col: getattr(past, col) or {} for col in MENU_COLUMNS}))
+
+        # 6. 献立作成ジョブを登録し、ソルバーはワーカープロセスで実行する
+        job = MenuJob(
+            jobId=new_job_id(),
             userName=current_user.userName,
-            menu1=day_menus.get('menu1', {}),
-            menu2=day_menus.get('menu2', {}),
-            menu3=day_menus.get('menu3', {}),
-            menu4=day_menus.get('menu4', {}),
-            menu5=day_menus.get('menu5', {}),
-            menu6=day_menus.get('menu6', {}),
-            menu7=day_menus.get('menu7', {}),
+            status='queued',
+            registItem=regist_item,
             createdAt=datetime.now()
         )
+        db.session.add(job)
+
+        # ヒューリスティックの献立をすぐに保存して表示し、ソルバーの結果が出たら置き換える
+        instant = None
+        if INSTANT_MENUS:
+            with timed(timings, 'heuristic'):
+                instant = heuristic_menu(build_args)
+            observe_timings({'heuristic': timings['heuristic']})
+            if instant['ok']:
+                save_menu_version(current_user.userName, instant['day_menus'], regist_item)
+                warm_starts.append(('heuristic', instant['day_menus']))
+        db.session.commit()
+        submit_menu_job(job.jobId, build_args, partial(save_menu_result, solution_key=solution_key, version=catalog.version), warm_starts, catalog.version)
+
+        return jsonify({
+            'jobId': job.jobId,
+            'status': 'done' if instant is not None and instant['ok'] else job.status,
+            'statusUrl': url_for('menu_job_status', job_id=job.jobId)
+        }), 202
+
+#ソルバーを使わずに得た献立をジョブとして記録して保存する
+def finish_without_solver(regist_item, result):
+    job = MenuJob(
+        jobId=new_job_id(),
+        userName=current_user.userName,
+        status='queued',
+        registItem=regist_item,
+        createdAt=datetime.now()
+    )
+    db.session.add(job)
+    db.session.commit()
+    save_menu_result(job.jobId, result)
+    return jsonify({
+        'jobId': job.jobId,
+        'status': 'done',
+        'statusUrl': url_for('menu_job_status', job_id=job.jobId)
+    }), 200
+
+#解のキャッシュを引く（ワーカーのメモリ → DB）
+def lookup_solution(key, version):
+    day_menus = solution_cache.get(key)
+    if day_menus is not None:
+        return day_menus
+    row = db.session.get(MenuSolution, key)
+    if row is None or row.catalogVersion != version or solution_cache.expired(row.createdAt.timestamp()):
+        return None
+    solution_cache.put(key, row.menus, row.createdAt.timestamp())
+    return row.menus
+
+#解をキャッシュに保存し、期限切れの解を消す（commitは呼び出し側）
+#古いカタログの解はキーが違うので引かれない。消すのはカタログが変わった時だけ（get_catalog）
+def store_solution(key, version, day_menus, result):
+    db.session.query(MenuSolution).filter(
+        MenuSolution.createdAt < datetime.now() - timedelta(seconds=solution_cache.SOLUTION_CACHE_TTL)
+    ).delete(synchronize_session=False)
+    db.session.merge(MenuSolution(
+        solutionKey=key,
+        catalogVersion=version,
+        status=result.get('status'),
+        menus=day_menus,
+        createdAt=datetime.now()
+    ))
+    solution_cache.put(key, day_menus)
+
+#年齢・性別・運動レベルが一致する栄養目標を探す
+def find_nutritional_target(user_userInfo):
+    userInfo_conditions = user_userInfo.copy()
+    age = userInfo_conditions.get('年齢', None)
+    gender = userInfo_conditions.get('性別', None)
+    activity = userInfo_conditions.get('運動レベル', None)
+
+    # 「75歳以上」かつ「運動レベル 高い」なら運動レベルを「ふつう」に
+    activity_query = activity
+    if age and ('75' in age and activity == '高い'):
+        activity_query = 'ふつう'
+
+    # SQLAlchemyによるjsonbフィールド完全一致 AND 年齢・性別・運動レベル条件
+    return db.session.query(NutritionalTarget).filter(
+        NutritionalTarget.userInfo['年齢'].astext == str(age),
+        NutritionalTarget.userInfo['性別'].astext == str(gender),
+        NutritionalTarget.userInfo['運動レベル'].astext == str(activity_query)
+    ).first()
+
+#献立の1品だけを入れ替える（他の料理は固定し、ソルバーは使わない）
+#リクエスト: {"day": 1〜7, "kind1": "staple" / "main" / "side" / "soup"}
+@app.route('/showmenu/swap', methods=['POST'])
+@login_required
+def swap_menu_dish():
+    data = request.get_json(silent=True) or {}
+    day = data.get('day')
+    kind1 = data.get('kind1')
+    menu_col = f"menu{day}"
+    if menu_col not in MENU_COLUMNS or kind1 not in ('staple', 'main', 'side', 'soup'):
+        return jsonify({'status': 'failed', 'message': '入れ替える料理の指定が正しくありません'}), 400
+
+    menu = current_menu(current_user.userName)
+    user = db.session.query(User).filter_by(userName=current_user.userName).first()
+    if menu is None or not user or not user.userInfo:
+        return jsonify({'status': 'failed', 'message': '献立がありません'}), 404
+    nt = find_nutritional_target(user.userInfo)
+    if nt is None:
+        return jsonify({'status': 'failed', 'message': '栄養ターゲットが見つかりません'}), 404
+
+    timings = {}
+    with timed(timings, 'swap'):
+        # 今の献立の版を作った時の登録食材の条件を引き継ぐ（ジョブを経ない一括作成などの版は登録食材なし）
+        pointer = db.session.get(CurrentMenu, current_user.userName)
+        regist_item = (pointer.registItem if pointer is not None else None) or {}
+        build_args = make_build_args(get_catalog(), wrap_nutritional_target(nt), user.userInfo, user.menstruation, regist_item)
+        day_menus = {col: getattr(menu, col) or {} for col in MENU_COLUMNS}
+        result = swap_dish(build_args, day_menus, day, kind1)
+    observe_timings(timings)
+    if not result['ok']:
+        return jsonify({'status': 'failed', 'message': result['message']}), 422
+
+    # 入れ替えた献立は新しい版として保存する
+    save_menu_version(current_user.userName, result['day_menus'], regist_item)
+    db.session.commit()
+    return jsonify({'status': 'done', 'recipeId': result['recipeId']}), 200
+
+#ライブラリの献立をユーザーと週ごとに順番に割り当てる（今の献立と同じものは避ける）
+def pick_library_menus(catalog, build_args, userName, old_menu):
+    entries = db.session.query(MenuLibrary).filter_by(
+        libraryKey=library_key(build_args),
+        catalogVersion=catalog.version
+    ).order_by(MenuLibrary.rank).all()
+    if not entries:
+        return None
+    return rotate_menus([entry.menus for entry in entries], userName, old_menu)
+
+#献立の候補からユーザーと週ごとに1つ選ぶ（今の献立と同じものは避ける）
+def rotate_menus(menu_list, userName, old_menu):
+    week = datetime.now().isocalendar()[1]
+    start = zlib.crc32(userName.encode('utf-8')) + week
+    current = {col: getattr(old_menu, col) for col in MENU_COLUMNS} if old_menu is not None else None
+    for k in range(len(menu_list)):
+        menus = menu_list[(start + k) % len(menu_list)]
+        if menus != current:
+            return menus
+    return menu_list[start % len(menu_list)]
+
+#ユーザーの現在の献立の版（currentMenus の無い移行前のユーザーは最新の版）
+def current_menu(userName):
+    return (
+        db.session.query(Menu)
+        .outerjoin(CurrentMenu, CurrentMenu.userName == Menu.userName)
+        .filter(Menu.userName == userName)
+        .filter(CurrentMenu.menuId.is_(None) | (CurrentMenu.menuId == Menu.menuId))
+        .order_by(Menu.menuId.desc())
+        .first()
+    )
 
-        db.session.add(menu_obj)
+#現在の献立より前の版（新しい順）
+def menu_history(userName, current, limit):
+    if limit <= 0:
+        return []
+    query = db.session.query(Menu).filter(Menu.userName == userName)
+    if current is not None:
+        query = query.filter(Menu.menuId != current.menuId)
+    return query.order_by(Menu.menuId.desc()).limit(limit).all()
+
+#currentMenus を rows（[{userName, menuId, registItem, updatedAt}]）の版に切り替える
+def point_current_menus(rows):
+    stmt = pg_insert(CurrentMenu.__table__)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=['userName'],
+        set_={'menuId': stmt.excluded.menuId, 'registItem': stmt.excluded.registItem, 'updatedAt': stmt.excluded.updatedAt},
+    ), rows)
+
+#献立を新しい版として追加し、現在の献立をその版に切り替える（以前の版は残す。commitは呼び出し側）
+#regist_item: 献立を作った時の登録食材（版と一緒に currentMenus に残す）
+def save_menu_version(userName, day_menus, regist_item=None):
+    menu_obj = Menu(
+        userName=userName,
+        menu1=day_menus.get('menu1', {}),
+        menu2=day_menus.get('menu2', {}),
+        menu3=day_menus.get('menu3', {}),
+        menu4=day_menus.get('menu4', {}),
+        menu5=day_menus.get('menu5', {}),
+        menu6=day_menus.get('menu6', {}),
+        menu7=day_menus.get('menu7', {}),
+        createdAt=datetime.now()
+    )
+    db.session.add(menu_obj)
+    db.session.flush()  # menuId を採番する
+    entry_rows = menu_entry_rows(menu_obj.menuId, day_menus)
+    if entry_rows:
+        db.session.execute(MenuEntry.__table__.insert(), entry_rows)
+    point_current_menus([{'userName': userName, 'menuId': menu_obj.menuId, 'registItem': regist_item or {}, 'updatedAt': datetime.now()}])
+    with _showmenu_lock:
+        _showmenu_cache.pop(userName, None)
+    catalog = get_catalog()
+    store_shopping_list(catalog, userName, menu_obj, menu_obj.createdAt)
+    store_nutrition_summary(catalog, userName, menu_obj)
+
+#ジョブ終了時に呼ばれる。曜日ごとのMenuレコード保存（以前の献立との入れ替え）
+def save_menu_result(job_id, result, solution_key=None, version=None):
+    observe_timings(result.get('timings'))
+    # ライブラリ・解のキャッシュの献立（finish_without_solver）はソルバーの終了状態として数えない
+    source = result.get('status') if result.get('status') in ('library', 'cached') else 'solver'
+    metrics.menu_source_total.inc(source=source)
+    if source == 'solver':
+        metrics.solver_status_total.inc(status=result.get('status'))
+    timings = {}
+    with app.app_context(), timed(timings, 'db_save'):
+        job = db.session.get(MenuJob, job_id)
+        if job is None:
+            return
+        try:
+            if result['ok']:
+                day_menus = result['day_menus']
+                if result.get('status') != 'heuristic':
+                    remember_solution(result.get('target_key'), day_menus)
+                # 時間切れなどギャップに届いていない解は、次のリクエストで解き直して良くする
+                if result.get('status') == 'optimal' and solution_key is not None:
+                    store_solution(solution_key, version, day_menus, result)
+                save_menu_version(job.userName, day_menus, job.registItem)
+                job.status = 'done'
+            else:
+                job.status = 'failed'
+            job.message = result.get('message')
+            job.finishedAt = datetime.now()
+            db.session.commit()
+        except Exception as e:
+            # Futureのコールバックの例外は握りつぶされるので、ここでジョブを失敗にしないと作成中のままになる
+            print(f'献立の保存に失敗 job={job_id}: {e}')
+            traceback.print_exc()
+            db.session.rollback()
+            job = db.session.get(MenuJob, job_id)
+            job.status = 'failed'
+            job.message = '献立を保存できませんでした'
+            job.finishedAt = datetime.now()
+            db.session.commit()
+        metrics.job_seconds.observe((job.finishedAt - job.createdAt).total_seconds(), result=job.status)
+        print(f'menucreate終了 job={job_id} status={job.status}')
+    observe_timings(timings)
+
+#登録食材なしの献立ライブラリを全栄養目標×月経の有無について作り直す
+@app.cli.command("build_menu_library")
+def build_menu_library():
+    catalog = get_catalog()
+    executor = get_executor()
+    futures = []
+    for nt in db.session.query(NutritionalTarget).all():
+        for menstruation in ('なし', 'あり'):
+            build_args = make_build_args(catalog, wrap_nutritional_target(nt), nt.userInfo, menstruation, {})
+            futures.append((nt.userInfo, menstruation, library_key(build_args), executor.submit(solve_library_menus, build_args)))
+
+    db.session.query(MenuLibrary).delete()
+    total = 0
+    for userInfo, menstruation, key, future in futures:
+        try:
+            menus = future.result()
+        except Exception as e:
+            print(f"Error processing {userInfo} 月経{menstruation}: {e}")
+            continue
+        for rank, menu in enumerate(menus):
+            db.session.add(MenuLibrary(
+                libraryKey=key,
+                catalogVersion=catalog.version,
+                rank=rank,
+                objective=menu['objective'],
+                menus=menu['day_menus'],
+                createdAt=datetime.now()
+            ))
+        total += len(menus)
+        print(f"{userInfo} 月経{menstruation}: {len(menus)}件")
+    db.session.commit()
+    print(f"{len(futures)}件の栄養目標について{total}件の献立を保存しました")
+
+    #flask --app source.main.menuapp build_menu_library をターミナルで実行
+
+#全ユーザーの献立をまとめて作り直す（定期実行用、登録食材なし）
+#栄養目標・月経の有無が同じユーザーを1グループにし、グループごとに1つのモデルから複数の献立を求めて順番に割り当てる
+#献立ライブラリ（build_menu_library）にあるグループは解かずにそれを使う
+@app.cli.command("regenerate_menus")
+@click.option('--workers', type=int, default=os.cpu_count(), help="ソルバーのプロセス数")
+@click.option('--batch-size', type=int, default=200, help="1トランザクションで保存する献立数")
+def regenerate_menus(workers, batch_size):
+    start = time.perf_counter()
+    catalog = get_catalog()
+    old_menus = {m.userName: m for m in db.session.query(Menu).join(CurrentMenu, CurrentMenu.menuId == Menu.menuId)}
+
+    groups = {}
+    targets = {}
+    failures = []
+    for user in db.session.query(User).all():
+        if not user.userInfo:
+            failures.append((user.userName, "ユーザーターゲットが登録されていません"))
+            continue
+        profile = json.dumps(user.userInfo, ensure_ascii=False, sort_keys=True)
+        if profile not in targets:
+            targets[profile] = find_nutritional_target(user.userInfo)
+        nt = targets[profile]
+        if nt is None:
+            failures.append((user.userName, "栄養ターゲットが見つかりません"))
+            continue
+        build_args = make_build_args(catalog, wrap_nutritional_target(nt), user.userInfo, user.menstruation, {})
+        group = groups.setdefault(library_key(build_args), {'build_args': build_args, 'users': []})
+        group['users'].append(user.userName)
+    print(f"{sum(len(g['users']) for g in groups.values())}人を{len(groups)}グループに分けました")
+
+    executor = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=formulations.get_registry,
+    )
+    futures = {}
+    ready = []
+    for key, group in groups.items():
+        entries = db.session.query(MenuLibrary).filter_by(libraryKey=key, catalogVersion=catalog.version) \
+            .order_by(MenuLibrary.rank).all()
+        if entries:
+            ready.append((group, [entry.menus for entry in entries]))
+            continue
+        problems = check_feasibility(group['build_args'])
+        if problems:
+            failures.extend((userName, ' / '.join(problems)) for userName in group['users'])
+            continue
+        size = min(len(group['users']), LIBRARY_SIZE)
+        futures[executor.submit(solve_library_menus, group['build_args'], size)] = group
+
+    saved = 0
+    rows = []
+    def save_rows(rows):
+        # 新しい献立の版の追加と現在の献立の切り替えを1トランザクションで行う（以前の版は残す）
+        menu_table = Menu.__table__
+        user_names = [r['userName'] for r in rows]
+        inserted = db.session.execute(
+            menu_table.insert().returning(menu_table.c.menuId, sort_by_parameter_order=True), rows
+        ).scalars().all()
+        entry_rows = [entry for menu_id, row in zip(inserted, rows) for entry in menu_entry_rows(menu_id, row)]
+        if entry_rows:
+            db.session.execute(MenuEntry.__table__.insert(), entry_rows)
+        point_current_menus([
+            {'userName': row['userName'], 'menuId': menu_id, 'registItem': {}, 'updatedAt': row['createdAt']}
+            for menu_id, row in zip(inserted, rows)
+        ])
+        # 栄養の集計は次の表示で作り直す（買い物リストは献立の作成日時で古いと分かる）
+        db.session.query(MenuNutritionSummary).filter(MenuNutritionSummary.userName.in_(user_names)).delete(synchronize_session=False)
         db.session.commit()
-        print('menucreate終了')
+        elapsed = time.perf_counter() - start
+        print(f"{saved + len(rows)}件保存 ({(saved + len(rows)) / elapsed * 60:.1f}件/分)")
+        return len(rows)
+
+    def finished_groups():
+        yield from ready
+        for future in as_completed(futures):
+            group = futures[future]
+            try:
+                yield group, [menu['day_menus'] for menu in future.result()]
+            except Exception as e:
+                failures.extend((userName, f"ソルバー実行エラー: {e}") for userName in group['users'])
 
-        # # デバッグ出力
-        # print("=== day_menus ===")
-        # print(day_menus)
+    try:
+        for group, menu_list in finished_groups():
+            if not menu_list:
+                failures.extend((userName, "解が見つかりませんでした") for userName in group['users'])
+                continue
+            for userName in group['users']:
+                menus = rotate_menus(menu_list, userName, old_menus.get(userName))
+                rows.append(dict({col: menus.get(col, {}) for col in MENU_COLUMNS}, userName=userName, createdAt=datetime.now()))
+            while len(rows) >= batch_size:
+                saved += save_rows(rows[:batch_size])
+                rows = rows[batch_size:]
+        if rows:
+            saved += save_rows(rows)
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+    elapsed = time.perf_counter() - start
+    print(f"{saved}件の献立を{elapsed:.1f}秒で作成しました（{saved / elapsed * 60:.1f}件/分）、失敗{len(failures)}件")
+    for userName, message in failures:
+        print(f"  {userName}: {message}")
+
+    #flask --app source.main.menuapp regenerate_menus --workers 8 をターミナルで実行
+
+#menu の menu1〜menu7 のJSONを menuEntries の行に移す（何度実行してもよい）
+@app.cli.command("migrate_menu_entries")
+@click.option('--batch-size', type=int, default=500, help="1トランザクションで移す献立数")
+def migrate_menu_entries(batch_size):
+    menu_table = Menu.__table__
+    entry_table = MenuEntry.__table__
+    columns = [menu_table.c.menuId] + [menu_table.c[col] for col in MENU_COLUMNS]
+    last_id = None
+    migrated = entries = 0
+    while True:
+        query = db.select(*columns).order_by(menu_table.c.menuId).limit(batch_size)
+        if last_id is not None:
+            query = query.where(menu_table.c.menuId > last_id)
+        menus = db.session.execute(query).all()
+        if not menus:
+            break
+        menu_ids = [m.menuId for m in menus]
+        rows = [entry for m in menus for entry in menu_entry_rows(m.menuId, {col: getattr(m, col) for col in MENU_COLUMNS})]
+        db.session.execute(entry_table.delete().where(entry_table.c.menuId.in_(menu_ids)))
+        if rows:
+            db.session.execute(entry_table.insert(), rows)
+        db.session.commit()
+        last_id = menu_ids[-1]
+        migrated += len(menus)
+        entries += len(rows)
+        print(f"{migrated}件の献立を移行しました（{entries}品）")
+    print(f"完了: {migrated}件の献立、{entries}品")
+
+    #flask --app source.main.menuapp migrate_menu_entries をターミナルで実行
+
+#献立の版への移行: 版の検索用のインデックスを作り、currentMenus の無いユーザーは最新の版を現在の献立にする（何度実行してもよい）
+#registItem 列の無い currentMenus には列を足し、空の行は最後に完了したジョブの登録食材で埋める
+@app.cli.command("migrate_menu_versions")
+def migrate_menu_versions():
+    db.session.execute(text('CREATE INDEX IF NOT EXISTS "menu_userName_menuId_idx" ON menu ("userName", "menuId")'))
+    db.session.execute(text('ALTER TABLE "currentMenus" ADD COLUMN IF NOT EXISTS "registItem" JSONB'))
+    result = db.session.execute(text('''
+        INSERT INTO "currentMenus" ("userName", "menuId", "updatedAt")
+        SELECT DISTINCT ON ("userName") "userName", "menuId", now()
+        FROM menu
+        ORDER BY "userName", "menuId" DESC
+        ON CONFLICT ("userName") DO NOTHING
+    '''))
+    db.session.execute(text('''
+        UPDATE "currentMenus" c SET "registItem" = COALESCE((
+            SELECT j."registItem" FROM "menuJobs" j
+            WHERE j."userName" = c."userName" AND j.status = 'done'
+            ORDER BY j."finishedAt" DESC LIMIT 1
+        ), '{}'::jsonb)
+        WHERE c."registItem" IS NULL
+    '''))
+    db.session.commit()
+    print(f"{result.rowcount}人の現在の献立を設定しました")
+
+    #flask --app source.main.menuapp migrate_menu_versions をターミナルで実行
+
+# /metrics を外部から見られるようにするか（既定ではローカルからのみ）
+METRICS_PUBLIC = os.environ.get("METRICS_PUBLIC", "0") == "1"
+
+#処理時間・ソルバー結果の集計（Prometheusのテキスト形式）
+@app.route('/metrics', methods=['GET'])
+def show_metrics():
+    if not METRICS_PUBLIC and request.remote_addr not in ('127.0.0.1', '::1'):
+        abort(404)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+#献立作成ジョブの状況確認
+@app.route('/createmenu/status/<job_id>', methods=['GET'])
+@login_required
+def menu_job_status(job_id):
+    job = db.session.get(MenuJob, job_id)
+    if job is None or job.userName != current_user.userName:
+        return jsonify({'status': 'notfound'}), 404
+
+    # ワーカーの再起動などで結果が返ってこなかったジョブは失敗扱いにする
+    if job.status == 'queued' and datetime.now() - job.createdAt > timedelta(seconds=JOB_EXPIRE_SECONDS):
+        job.status = 'failed'
+        job.message = '献立作成がタイムアウトしました'
+        job.finishedAt = datetime.now()
+        db.session.commit()
+        metrics.job_expired_total.inc()
 
-        return redirect('/showmenu')
+    return jsonify({'jobId': job.jobId, 'status': job.status, 'message': job.message})
 
 @app.route("/nutrition")
 @login_required
 def show_nutrition():
-    # NutritionalTarget→RecipeNutritionへのkey変換dict
-    key_map = {
-        "カロリー":"カロリー(kcal)",
-        "たんぱく質_上限":"たんぱく質(g)",
-        "たんぱく質_下限":"たんぱく質(g)",
-        "脂質_上限":"脂質(g)",
-        "脂質_下限":"脂質(g)",
-        "炭水化物_上限":"炭水化物(g)",
-        "炭水化物_下限":"炭水化物(g)",
-        "食塩_上限":"食塩(g)",
-        "食物繊維_下限":"食物繊維(g)",
-        "カルシウム_上限":"カルシウム(mg)",
-        "カルシウム_下限":"カルシウム(mg)",
-        "ビタミンA_上限":"ビタミンA(μg)",
-        "ビタミンA_下限":"ビタミンA(μg)",
-        "ビタミンD_上限":"ビタミンD(μg)",
-        "ビタミンD_下限":"ビタミンD(μg)",
-        "ビタミンC_下限":"ビタミンC(mg)",
-        "ビタミンB1_下限":"ビタミンB₁(mg)",
-        "ビタミンB2_下限":"ビタミンB₂(mg)",
-        "鉄_下限":"鉄(mg)",
-        "鉄・月経時_下限":"鉄(mg)"
-    }
-    aggregated_nutrition = {}
-    recipe_ids = []
-
-    menu = db.session.query(Menu).filter_by(userName=current_user.userName).first()
+    menu = current_menu(current_user.userName)
     if menu is None:
-        return render_template("nutrition.html", nutrition=aggregated_nutrition, nutritionals={}, current_page='nutrition', show_navbar=True)
-
-    # menu1〜menu7からrecipeId収集
-    for menu_col in ['menu1','menu2','menu3','menu4','menu5','menu6','menu7']:
-        menu_json = getattr(menu, menu_col, {})
-        for meal_type in ['staple','main','side','soup']:
-            recipe_id = menu_json.get(meal_type)
-            if recipe_id is None:
-                continue
-            try:
-                recipe_id = int(recipe_id) if not hasattr(recipe_id, 'astext') else int(recipe_id.astext)
-            except (ValueError, TypeError):
-                continue
-            recipe_ids.append(recipe_id)
-
-            rec_nut = db.session.query(RecipeNutrition).filter(RecipeNutrition.recipeId == recipe_id).first()
-            if not rec_nut:
-                continue
-
-            for nut_name, nut_val in rec_nut.nutritions.items():
-                nut_val = nut_val if nut_val is not None else 0
-                aggregated_nutrition[nut_name] = aggregated_nutrition.get(nut_name, 0) + nut_val
+        return render_template("nutrition.html", nutrition={}, nutritionals={}, current_page='nutrition', show_navbar=True)
 
-    recipe_ids = list(set(recipe_ids))
-    
-    rounded_nutrition = {k: sig_round(v, 4) for k, v in aggregated_nutrition.items()}
-
-    # ユーザー目標値取得・対応keyにリネーム
-    user = db.session.query(User).filter_by(userName=current_user.userName).first()
+    # 献立の保存時に計算した合計・目標の幅を使う（無い・献立やレシピが変わって古い場合はここで作り直す）
+    catalog = get_catalog()
+    summary = db.session.get(MenuNutritionSummary, current_user.userName)
+    if summary is None or summary.menuCreatedAt != menu.createdAt or summary.catalogVersion != catalog.version:
+        weekly, targets = store_nutrition_summary(catalog, current_user.userName, menu)
+        db.session.commit()
+    else:
+        weekly, targets = summary.weekly, summary.targets
+
+    return render_template("nutrition.html", nutrition=weekly, nutritionals=targets, current_page='nutrition', show_navbar=True)
+
+# NutritionalTarget→RecipeNutritionへのkey変換dict
+NUTRITION_KEY_MAP = {
+    "カロリー":"カロリー(kcal)",
+    "たんぱく質_上限":"たんぱく質(g)",
+    "たんぱく質_下限":"たんぱく質(g)",
+    "脂質_上限":"脂質(g)",
+    "脂質_下限":"脂質(g)",
+    "炭水化物_上限":"炭水化物(g)",
+    "炭水化物_下限":"炭水化物(g)",
+    "食塩_上限":"食塩(g)",
+    "食物繊維_下限":"食物繊維(g)",
+    "カルシウム_上限":"カルシウム(mg)",
+    "カルシウム_下限":"カルシウム(mg)",
+    "ビタミンA_上限":"ビタミンA(μg)",
+    "ビタミンA_下限":"ビタミンA(μg)",
+    "ビタミンD_上限":"ビタミンD(μg)",
+    "ビタミンD_下限":"ビタミンD(μg)",
+    "ビタミンC_下限":"ビタミンC(mg)",
+    "ビタミンB1_下限":"ビタミンB₁(mg)",
+    "ビタミンB2_下限":"ビタミンB₂(mg)",
+    "鉄_下限":"鉄(mg)",
+    "鉄・月経時_下限":"鉄(mg)"
+}
+
+#ユーザーの栄養目標を、栄養素ごとの {item:{'min':val, 'max':val}} に再構成する
+def nutrition_target_bands(userName):
+    user = db.session.query(User).filter_by(userName=userName).first()
     nutritionals_raw = {}
     if user is not None:
         nutritional_obj = db.session.query(NutritionalTarget).filter(NutritionalTarget.userInfo == user.userInfo).first()
@@ -713,8 +1112,6 @@ def show_nutrition():
                 if "鉄・月経時_下限" in nutritionals_raw:
                     nutritionals_raw.pop("鉄・月経時_下限")
 
-
-    # 各栄養素ごとに下限・上限（key_mapによる統一名）で {item:{'min':val, 'max':val}}に再構成
     nutritionals = {}
 
     # カロリー特別処理（targetsの"カロリー"キーで±10％幅）
@@ -725,7 +1122,7 @@ def show_nutrition():
         nutritionals["カロリー(kcal)"] = {"min": cal_min, "max": cal_max}
 
     for k, v in nutritionals_raw.items():
-        rep_key = key_map.get(k)
+        rep_key = NUTRITION_KEY_MAP.get(k)
         if not rep_key:
             continue
         if '_下限' in k:
@@ -742,8 +1139,35 @@ def show_nutrition():
                 nutritionals.setdefault(rep_key, {})['max'] = percent_to_g(v, cal_base, 9)
             else:
                 nutritionals.setdefault(rep_key, {})['max'] = v
-
-    return render_template("nutrition.html", nutrition=rounded_nutrition, nutritionals=nutritionals, current_page='nutrition', show_navbar=True)
+    return nutritionals
+
+#献立の栄養素の合計（週・曜日ごと）と目標の幅を計算して保存し、(週の合計, 目標の幅) を返す（commitは呼び出し側）
+#同じユーザーの /nutrition が同時に作り直しても主キーが衝突しないよう upsert する
+def store_nutrition_summary(catalog, userName, menu):
+    weekly, daily = {}, {}
+    for menu_col, _, recipe_id in menu_recipe_slots(menu):
+        nutritions = catalog.recipe_nutritions.get(recipe_id)
+        if nutritions is None:
+            continue
+        day = daily.setdefault(menu_col, {})
+        for nut_name, nut_val in nutritions.items():
+            day[nut_name] = day.get(nut_name, 0) + nut_val
+            weekly[nut_name] = weekly.get(nut_name, 0) + nut_val
+    weekly = {k: sig_round(v, 4) for k, v in weekly.items()}
+    targets = nutrition_target_bands(userName)
+    stmt = pg_insert(MenuNutritionSummary.__table__).values(
+        userName=userName,
+        menuCreatedAt=menu.createdAt,
+        catalogVersion=catalog.version,
+        weekly=weekly,
+        daily={menu_col: {k: sig_round(v, 4) for k, v in day.items()} for menu_col, day in daily.items()},
+        targets=targets,
+    )
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=['userName'],
+        set_={c: stmt.excluded[c] for c in ('menuCreatedAt', 'catalogVersion', 'weekly', 'daily', 'targets')},
+    ))
+    return weekly, targets
 
 
 @app.route("/signup",methods=['GET','POST'])
@@ -784,6 +1208,8 @@ def user_update():
             # menstruation カラムに代入
             user.menstruation = menstruation
 
+            # 栄養目標の幅が変わるので、保存済みの栄養の集計は次の表示で作り直す
+            db.session.query(MenuNutritionSummary).filter_by(userName=user.userName).delete()
             db.session.commit()
         return redirect('/showmenu')
 
@@ -0,0 +1,108 @@
+#献立作成の処理時間・ソルバー結果の集計（Prometheusのテキスト形式で /metrics に出す）
+#値はプロセスごと（gunicornのワーカー間では共有しない）。ワーカープロセスで測った時間は結果と一緒に返して集計する
+import threading,time
+from contextlib import contextmanager
+
+# 処理段階ごとの時間のバケット(秒)。ソルバーの上限300秒まで
+PHASE_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+# 値はリクエストのスレッドとジョブ終了のコールバックのスレッドから更新するので、更新・出力は必ずこのロックの中で行う
+_lock = threading.RLock()
+_metrics = []
+
+
+def _register(metric):
+    with _lock:
+        _metrics.append(metric)
+
+
+def _label_text(labelnames, values):
+    if not labelnames:
+        return ''
+    pairs = ','.join(f'{k}="{_escape(v)}"' for k, v in zip(labelnames, values))
+    return '{' + pairs + '}'
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        _register(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(k, '')) for k in self.labelnames)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with _lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            lines.append(f"{self.name}{_label_text(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=PHASE_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # ラベル → [バケットごとの件数, 合計, 件数]
+        _register(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(k, '')) for k in self.labelnames)
+        with _lock:
+            counts, total, n = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for k, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[k] += 1
+            self._values[key] = (counts, total + value, n + 1)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with _lock:
+            values = [(key, (list(counts), total, n)) for key, (counts, total, n) in sorted(self._values.items())]
+        for key, (counts, total, n) in values:
+            for bound, count in zip(self.buckets, counts):
+                labels = _label_text(self.labelnames + ('le',), key + (repr(float(bound)),))
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _label_text(self.labelnames + ('le',), key + ('+Inf',))
+            lines.append(f"{self.name}_bucket{labels} {n}")
+            lines.append(f"{self.name}_sum{_label_text(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_label_text(self.labelnames, key)} {n}")
+        return lines
+
+
+def render():
+    with _lock:
+        lines = [line for metric in _metrics for line in metric.render()]
+    return '\n'.join(lines) + '\n'
+
+
+phase_seconds = Histogram('menu_phase_seconds', '献立作成の処理段階ごとの時間(秒)', ['phase'])
+job_seconds = Histogram('menu_job_seconds', '献立作成ジョブの投入から保存までの時間(秒)', ['result'])
+solver_status_total = Counter('menu_solver_status_total', 'ソルバーの終了状態ごとのジョブ数（ソルバーを実行したジョブのみ）', ['status'])
+menu_source_total = Counter('menu_source_total', '献立の出どころ（solver / library / cached）ごとのジョブ数', ['source'])
+job_expired_total = Counter('menu_job_expired_total', '結果が返らず失敗扱いにしたジョブ数')
+
+
+#with timed(timings, 'model_build'): ... で timings[段階] に経過時間を足す
+@contextmanager
+def timed(timings, phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[phase] = timings.get(phase, 0.0) + time.perf_counter() - start
+
+def observe_timings(timings):
+    for phase, seconds in (timings or {}).items():
+        phase_seconds.observe(seconds, phase=phase)
@@ -0,0 +1,425 @@
+#献立最適化の実行部分
+#Flask・DBに依存しないので、ソルバー用のワーカープロセスからも呼び出せる
+import os,json,logging,threading
+from collections import OrderedDict
+import pyomo.environ as pyo
+from pyomo.environ import SolverFactory
+from pyomo.util.infeasible import log_infeasible_constraints
+from pyomo.core.expr.visitor import identify_variables
+from pyomo.repn import generate_standard_repn
+
+from . import formulations
+from .metrics import timed
+from .templates import template_key, get_template, make_template_solver
+from .presolve import USE_PRESOLVE, presolve, add_objective_offset
+from .heuristic import heuristic_menu
+from . import direct_cbc
+
+CBC_PATH = os.environ.get("CBC_PATH", "/Users/hiruse/cbc/bin/cbc")
+SOLVER_TIME_LIMIT = int(os.environ.get("SOLVER_TIME_LIMIT", 300))  # 最大5分実行
+SOLVER_RATIO_GAP = float(os.environ.get("SOLVER_RATIO_GAP", 0.02))  # 2%以内で打ち切り
+
+# NutritionalTargetのキー → RecipeNutritionの栄養素名
+NUTRITION_MATCH = {
+    "カロリー":"カロリー(kcal)",
+    "たんぱく質_上限":"たんぱく質(g)",
+    "たんぱく質_下限":"たんぱく質(g)",
+    "脂質_上限":"脂質(g)",
+    "脂質_下限":"脂質(g)",
+    "炭水化物_上限":"炭水化物(g)",
+    "炭水化物_下限":"炭水化物(g)",
+    "食物繊維_下限":"食物繊維(g)",
+    "カルシウム_上限":"カルシウム(mg)",
+    "カルシウム_下限":"カルシウム(mg)",
+    "ビタミンA_上限":"ビタミンA(μg)",
+    "ビタミンA_下限":"ビタミンA(μg)",
+    "ビタミンD_上限": "ビタミンD(μg)",
+    "ビタミンD_下限": "ビタミンD(μg)",
+    "ビタミンC_下限": "ビタミンC(mg)",
+    "ビタミンB1_下限":"ビタミンB₁(mg)",
+    "ビタミンB2_下限":"ビタミンB₂(mg)",
+    "鉄・月経時_下限":"鉄(mg)",
+    "鉄_下限":"鉄(mg)"
+}
+
+DAYS = list(range(1,8))
+
+#ループ対策
+def wrap_nutritional_target(nt):
+    # nt.nutritionals, nt.userInfo が両方存在すると仮定
+    nutr = nt.nutritionals if hasattr(nt, 'nutritionals') else nt.get('nutritionals', {})
+    userinfo = nt.userInfo if hasattr(nt, 'userInfo') else nt.get('userInfo', {})
+    # None補正
+    for nut, val in nutr.items():
+        if val is None:
+            nutr[nut] = 0
+    return {0: {"nutritionals": nutr, "userInfo": userinfo}}
+
+#ユーザーごとに制約とする栄養素を判断するためのフラグ
+def should_use_pfc(userInfo):
+    age = userInfo.get("年齢")
+    sex = userInfo.get("性別")
+    level = userInfo.get("運動レベル")
+
+    # カロリー考慮で解なしになるユーザー群
+    high_need_patterns = [
+        ("18~29(歳)", "男性", "高い"),
+        ("30~49(歳)", "男性", "高い"),
+        ("50~64(歳)", "男性", "高い")
+    ]
+
+    if (age, sex, level) in high_need_patterns:
+        return False  # PFC制約を外す
+    return True
+
+#build_modelに渡す入力一式をまとめる（カタログは共通、ユーザごとに異なるのは目標・食材のみ）
+def make_build_args(catalog, nutritionaltarget_dict, user_userInfo, menstruation, regist_item):
+    nutritionals = next(iter(nutritionaltarget_dict.values()))['nutritionals']
+    nutri_keys = list({NUTRITION_MATCH[k] for k in nutritionals if k in NUTRITION_MATCH})
+
+    return {
+        'days': DAYS,                                    # list(range(1,8)) 等
+        'recipe_dict': catalog.recipe_dict,
+        'recipe_ids': catalog.recipe_ids,             # レシピIDリスト
+        'recipeitem_dict': catalog.recipeitem_dict,                   # {rid: {item: qty}}
+        'filtered_recipe_nutritions': catalog.filtered_recipe_nutritions(nutri_keys),   # {rid: {nutrient: value}}
+        'nutritionaltarget_dict': nutritionaltarget_dict,     # {ターゲットID: {...}}等
+        'itemweight_dict': catalog.itemweight_dict,                   # {item: weights}
+        'itemequal_dict': catalog.itemequal_dict,                     # {item: equals}
+        'menstruation': menstruation,
+        'regist_item': regist_item or {},                      # dict
+        'use_pfc': should_use_pfc(user_userInfo)
+    }
+
+#使用するモデル（formulations.py に登録された名前: model1〜model4 / matrix / aggregate など）
+MENU_FORMULATION = os.environ.get("MENU_FORMULATION", "model4")
+
+#モデル作成関数と、解から献立を取り出す関数の組を返す
+def get_formulation(name=None):
+    formulation = formulations.get(name or MENU_FORMULATION)
+    return formulation.build, formulation.extract
+
+# 同じ構造のリクエストではモデルを作り直さず、ひな形の可変Paramを書き換えて解き直す
+USE_MODEL_TEMPLATES = os.environ.get("USE_MODEL_TEMPLATES", "1") == "1"
+
+#時間制限・ギャップのオプション名（ソルバーごとに異なる）
+SOLVER_LIMIT_OPTIONS = {
+    'cbc': ('sec', 'ratioGap'),
+    'appsi_highs': ('time_limit', 'mip_rel_gap'),
+    'gurobi': ('TimeLimit', 'MIPGap'),
+    'cplex': ('timelimit', 'mipgap'),
+    'scip': ('limits/time', 'limits/gap'),
+    'glpk': ('tmlim', 'mipgap'),
+}
+
+#config: {'solver': 'cbc', 'options': {...}}（省略時はCBCの既定設定）
+def make_solver(config=None):
+    config = config or {'solver': 'cbc'}
+    name = config['solver']
+    if name == 'cbc':
+        solver = SolverFactory('cbc', executable=CBC_PATH)  # フルパスを指定
+    else:
+        solver = SolverFactory(name)
+    time_key, gap_key = SOLVER_LIMIT_OPTIONS[name]
+    solver.options[time_key] = SOLVER_TIME_LIMIT
+    solver.options[gap_key] = SOLVER_RATIO_GAP
+    solver.options.update(config.get('options', {}))
+    return solver
+
+#同じ栄養目標で最後に得られた献立（次回の初期解に使う。Webワーカーのプロセスごとに保持）
+WARM_START_CACHE_SIZE = int(os.environ.get("WARM_START_CACHE_SIZE", 128))
+_warm_start_cache = OrderedDict()
+_warm_start_lock = threading.Lock()  # ジョブ終了のコールバックのスレッドからも更新する
+
+#栄養目標・月経の有無・PFC制約の有無が同じなら同じキーになる
+def target_key(build_args):
+    nutritionals = next(iter(build_args['nutritionaltarget_dict'].values()))['nutritionals']
+    return json.dumps(
+        [nutritionals, build_args['menstruation'], build_args['use_pfc']],
+        sort_keys=True, ensure_ascii=False, default=str
+    )
+
+def remember_solution(key, day_menus):
+    if not key or not any(day_menus.values()):
+        return
+    with _warm_start_lock:
+        _warm_start_cache[key] = day_menus
+        _warm_start_cache.move_to_end(key)
+        while len(_warm_start_cache) > WARM_START_CACHE_SIZE:
+            _warm_start_cache.popitem(last=False)
+
+def cached_solution(key):
+    with _warm_start_lock:
+        return _warm_start_cache.get(key)
+
+#前回解いた値を消す（ひな形で固定している変数はそのまま）
+def _clear_values(model):
+    for v in model.component_data_objects(pyo.Var):
+        if not v.fixed:
+            v.set_value(None)
+
+# {menuN: {kind1: recipeId}} → [(曜日, recipeId)]
+def _menu_pairs(day_menus):
+    pairs = []
+    for name, menu in (day_menus or {}).items():
+        if not name.startswith('menu') or not name[4:].isdigit():
+            continue
+        for r in (menu or {}).values():
+            try:
+                pairs.append((int(name[4:]), int(r)))
+            except (TypeError, ValueError):
+                continue
+    return pairs
+
+def _violated(c, tol=1e-6):
+    val = pyo.value(c.body)
+    if c.has_lb() and val < pyo.value(c.lower) - tol:
+        return True
+    if c.has_ub() and val > pyo.value(c.upper) + tol:
+        return True
+    return False
+
+#献立をモデルの変数の初期値に設定し、満たせない制約の数を返す
+#x（集約モデルは n）以外の0-1変数は、関係する制約を満たす範囲で目的関数が良くなる値にする。連続変数はCBCが計算する
+def set_warm_start(model, day_menus):
+    pairs = _menu_pairs(day_menus)
+    if not pairs or not (hasattr(model, 'x') or hasattr(model, 'n')):
+        return None
+    _clear_values(model)
+
+    if hasattr(model, 'n'):
+        counts = {}
+        for _, r in pairs:
+            counts[r] = counts.get(r, 0) + 1
+        if any(r not in model.n for r in counts):
+            return None
+        for r in model.Recipes:
+            model.n[r].set_value(counts.get(r, 0))
+        special_set = set(model.StapleSpecialRecipes)
+        n_special = sum(c for r, c in counts.items() if r in special_set)
+        model.special_days.set_value(n_special)
+        model.full_days.set_value(len(model.Days) - n_special)
+    else:
+        chosen = set(pairs)
+        if any(p not in model.x for p in chosen):
+            return None
+        for idx in model.x:
+            model.x[idx].set_value(1 if idx in chosen else 0)
+
+    cons_by_var = {}
+    for c in model.component_data_objects(pyo.Constraint, active=True):
+        for v in identify_variables(c.body, include_fixed=False):
+            cons_by_var.setdefault(id(v), []).append(c)
+
+    def valued(c):
+        return all(v.value is not None for v in identify_variables(c.body, include_fixed=False))
+
+    obj = next(model.component_data_objects(pyo.Objective, active=True))
+    repn = generate_standard_repn(obj.expr, compute_values=True)
+    sign = 1 if obj.sense == pyo.minimize else -1
+    obj_coef = {id(v): sign * c for v, c in zip(repn.linear_vars, repn.linear_coefs)}
+
+    for v in model.component_data_objects(pyo.Var):
+        if v.value is not None or not v.is_binary():
+            continue
+        preferred, other = (1, 0) if obj_coef.get(id(v), 0) < 0 else (0, 1)
+        v.set_value(preferred)
+        if any(valued(c) and _violated(c) for c in cons_by_var.get(id(v), [])):
+            v.set_value(other)
+
+    return sum(
+        1 for c in model.component_data_objects(pyo.Constraint, active=True)
+        if valued(c) and _violated(c)
+    )
+
+#候補（前回の献立、同じ目標のキャッシュ解など）のうち、制約を満たす最初のものを初期解にする
+def apply_warm_start(model, candidates):
+    for label, day_menus in candidates:
+        violations = set_warm_start(model, day_menus)
+        if violations == 0:
+            return label
+        print(f'初期解 {label} は使用しない(違反制約数={violations})')
+    _clear_values(model)
+    return None
+
+# ソルバーの実行方法: pyomo（Pyomoのモデル → ソルバー）/ mps（MPSを直接書き出してCBCを実行する。direct_cbc.py）
+# mps は model4 と同じ構造の定式化（templatable）で、solver_config を指定しない場合だけ使う
+SOLVER_BACKEND = os.environ.get("SOLVER_BACKEND", "pyomo")
+
+#ソルバーが初期解（warmstart=True）を受け取れるか
+def warm_start_capable(solver):
+    return getattr(solver, 'warm_start_capable', lambda: False)()
+
+#ファイル経由のソルバー（CBCなど）は、ファイル書き出し・実行・解の読み込みの時間を分けて測る
+_SOLVER_PHASES = [('_presolve', 'solver_write'), ('_apply_solver', 'solver_solve'), ('_postsolve', 'solver_read')]
+
+def _timed_method(method, timings, phase):
+    def wrapper(*args, **kwargs):
+        with timed(timings, phase):
+            return method(*args, **kwargs)
+    return wrapper
+
+def timed_solve(solver, model, timings, **options):
+    if not all(hasattr(solver, name) for name, _ in _SOLVER_PHASES):
+        with timed(timings, 'solver_solve'):
+            return solver.solve(model, **options)
+    for name, phase in _SOLVER_PHASES:
+        setattr(solver, name, _timed_method(getattr(solver, name), timings, phase))
+    try:
+        return solver.solve(model, **options)
+    finally:
+        for name, _ in _SOLVER_PHASES:
+            delattr(solver, name)
+
+# ヒューリスティックの献立を初期解・ソルバーが解を返さない時の代わりに使うか
+USE_HEURISTIC = os.environ.get("USE_HEURISTIC", "1") == "1"
+
+#ヒューリスティックの献立を結果にする（目的関数の値はモデルに献立を入れて計算する）
+def heuristic_result(model, day_menus, result):
+    set_warm_start(model, day_menus)
+    objective = next(model.component_data_objects(pyo.Objective, active=True))
+    return dict(result, ok=True, status='heuristic', solver_status=result['status'], day_menus=day_menus,
+                message=None, objective=pyo.value(objective, exception=False))
+
+#ヒューリスティックの献立を初期解の最後の候補にする（ソルバーが解を返さなければ代わりに使う）
+def add_heuristic_start(build_args, warm_starts, timings):
+    warm_starts = list(warm_starts or [])
+    heuristic = None
+    if USE_HEURISTIC:
+        heuristic = next((menus for label, menus in warm_starts if label == 'heuristic'), None)
+        if heuristic is None:
+            with timed(timings, 'heuristic'):
+                found = heuristic_menu(build_args)
+            if found['ok']:
+                heuristic = found['day_menus']
+                warm_starts.append(('heuristic', heuristic))
+    return warm_starts, heuristic
+
+# ソルバーのログを標準出力に出すか
+SOLVER_TEE = os.environ.get("SOLVER_TEE", "1") == "1"
+
+#モデル作成からソルバー実行、献立の抽出までを行う（ワーカープロセスで実行される）
+#warm_starts: [(ラベル, {menuN: {kind1: recipeId}})] の優先順リスト
+#solver_config を指定した場合はその設定のソルバーで解く（並列実行用）
+#結果の timings には処理段階ごとの時間(秒)が入る
+def run_menu_job(build_args, warm_starts=None, catalog_version=None, solver_config=None, tee=None):
+    timings = {}
+    with timed(timings, 'formulation_load'):
+        formulation = formulations.get(MENU_FORMULATION)
+    build_model, extract = formulation.build, formulation.extract
+    presolve_report = None
+    if USE_PRESOLVE and formulation.templatable:
+        with timed(timings, 'presolve'):
+            build_args, presolve_report = presolve(build_args)
+        print('候補レシピ', f"{presolve_report['candidates']}/{presolve_report['recipes']}", presolve_report)
+    if SOLVER_BACKEND == 'mps' and formulation.templatable and solver_config is None:
+        return run_direct_job(formulation, build_args, warm_starts, presolve_report, timings, tee)
+    solver = None
+    with timed(timings, 'model_build'):
+        if USE_MODEL_TEMPLATES and formulation.templatable and catalog_version is not None and solver_config is None:
+            model, solver = get_template(
+                template_key(formulation.name, catalog_version, build_args), build_model, build_args,
+                lambda: make_template_solver(CBC_PATH, SOLVER_TIME_LIMIT, SOLVER_RATIO_GAP)
+            )
+        else:
+            model = build_model(**build_args)
+        if presolve_report is not None:
+            add_objective_offset(model, presolve_report['objective_offset'])
+    if solver is None:
+        solver = make_solver(solver_config)
+    key = target_key(build_args)
+
+    warm_starts, heuristic = add_heuristic_start(build_args, warm_starts, timings)
+
+    with timed(timings, 'warm_start'):
+        warm_start = apply_warm_start(model, warm_starts)
+    # appsi_cbc（ひな形用の永続ソルバー）は初期解を受け取れないので、初期解がある時は通常のソルバーでひな形を解く
+    if warm_start is not None and not warm_start_capable(solver):
+        solver = make_solver(solver_config)
+    if not warm_start_capable(solver):
+        warm_start = None
+    print('ソルバー準備完了', f'初期解={warm_start}')
+
+    solve_options = {'tee': SOLVER_TEE if tee is None else tee, 'load_solutions': False}
+    if warm_start is not None:
+        solve_options['warmstart'] = True
+    result = {'target_key': key, 'warm_start': warm_start, 'timings': timings, 'presolve': presolve_report}
+    try:
+        results = timed_solve(solver, model, timings, **solve_options)
+    except Exception as e:
+        if heuristic is None:
+            raise
+        print(f'ソルバー実行エラーのためヒューリスティックの献立を使用: {e}')
+        return heuristic_result(model, heuristic, dict(result, status='error'))
+    status = str(results.solver.termination_condition)
+    result['status'] = status
+    if len(results.solution) > 0:
+        with timed(timings, 'solver_read'):
+            model.solutions.load_from(results)
+    elif heuristic is not None:
+        print(f'解が見つからなかったためヒューリスティックの献立を使用({status})')
+        return heuristic_result(model, heuristic, result)
+    else:
+        return dict(result, ok=False, day_menus={}, message=f"解が見つかりませんでした({status})")
+
+    with timed(timings, 'extract'):
+        day_menus = extract(model)
+    print('献立作成完了')
+
+    with timed(timings, 'log_infeasible'):
+        logging.getLogger('pyomo.core').setLevel(logging.INFO)
+        log_infeasible_constraints(model)
+
+    if not any(day_menus.values()):
+        return dict(result, ok=False, day_menus=day_menus, message="献立を作成できませんでした")
+    objective = next(model.component_data_objects(pyo.Objective, active=True))
+    return dict(result, ok=True, day_menus=day_menus, message=None, objective=pyo.value(objective))
+
+#候補のうち、全てのレシピがモデルにある最初の献立を x の初期値にする（制約を満たすかはCBCが確かめる）
+def direct_warm_start(model, candidates):
+    for label, day_menus in candidates:
+        pairs = _menu_pairs(day_menus)
+        columns = [model.x_column(d, r) for d, r in pairs]
+        if pairs and None not in columns:
+            start = {int(j): 0 for j in model.x.ravel()}
+            start.update({j: 1 for j in columns})
+            return label, start
+    return None, None
+
+#SOLVER_BACKEND=mps の場合の run_menu_job（Pyomoのモデルを作らない）
+def run_direct_job(formulation, build_args, warm_starts, presolve_report, timings, tee):
+    with timed(timings, 'model_build'):
+        model = direct_cbc.build_direct_model(build_args, tight_big_m=formulation.name.endswith('_tight'))
+        if presolve_report is not None:
+            model.objective_constant += presolve_report['objective_offset']
+    key = target_key(build_args)
+    warm_starts, heuristic = add_heuristic_start(build_args, warm_starts, timings)
+    with timed(timings, 'warm_start'):
+        warm_start, start = direct_warm_start(model, warm_starts)
+    print('ソルバー準備完了', f'初期解={warm_start}', f'変数={model.n_cols} 制約={model.n_rows}')
+
+    result = {'target_key': key, 'warm_start': warm_start, 'timings': timings, 'presolve': presolve_report}
+    heuristic_fallback = dict(ok=True, status='heuristic', day_menus=heuristic, message=None, objective=None)
+    try:
+        status, objective, values = direct_cbc.solve(
+            model, CBC_PATH, SOLVER_TIME_LIMIT, SOLVER_RATIO_GAP, start,
+            tee=SOLVER_TEE if tee is None else tee, timings=timings
+        )
+    except Exception as e:
+        if heuristic is None:
+            raise
+        print(f'ソルバー実行エラーのためヒューリスティックの献立を使用: {e}')
+        return dict(result, solver_status='error', **heuristic_fallback)
+    result['status'] = status
+    if values is None:
+        if heuristic is not None:
+            print(f'解が見つからなかったためヒューリスティックの献立を使用({status})')
+            return dict(result, solver_status=status, **heuristic_fallback)
+        return dict(result, ok=False, day_menus={}, message=f"解が見つかりませんでした({status})")
+
+    with timed(timings, 'extract'):
+        day_menus = model.day_menus(values)
+    print('献立作成完了')
+    if not any(day_menus.values()):
+        return dict(result, ok=False, day_menus=day_menus, message="献立を作成できませんでした")
+    return dict(result, ok=True, day_menus=day_menus, message=None, objective=objective)
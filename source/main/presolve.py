@@ -0,0 +1,159 @@
+#モデル作成前の候補レシピの絞り込み
+#model4 と同じ構造の定式化（formulations.py で templatable のもの）について、最適解に現れ得ないレシピを除く
+#除いても最適な献立は変わらない
+#除いたレシピの分だけ目的関数の定数項が変わる（使わない時に残る誤差変数 e と、除いたレシピにしかない登録食材の y_regist）ので、
+#その差を objective_offset として返し、add_objective_offset で目的関数に足し戻す（ratioGap・目的関数の値を絞り込みなしのモデルと同じ意味にする）
+#どのルールもプロファイル（栄養目標・use_pfc）とカタログだけで決まり、登録食材の量には依存しない
+import os
+import numpy as np
+import pyomo.environ as pyo
+
+from .matrix_model import build_matrices, nutrition_bounds, PFC_KEYS, OTHER_KEYS, STAPLE_SPECIAL_KIND2, WEIGHT_MULTIPLE, WEIGHT_REGIST
+
+USE_PRESOLVE = os.environ.get("USE_PRESOLVE", "1") == "1"
+TOLERANCE = 1e-9
+
+
+#1品だけで週の上限を超えるレシピ（栄養素の値は非負なので、選んだ時点で上限を超える）
+def over_upper(values, bounds):
+    over = np.zeros(values.shape[0], dtype=bool)
+    for k, (_, upper) in enumerate(bounds):
+        if upper is not None:
+            over |= values[:, k] > upper + TOLERANCE
+    return over
+
+#重さを登録した食材を週に1gより多く使うレシピ（ItemUsedCalc: item_used は0/1で item_used >= 使用量）
+def over_item_used(matrices, itemweight_dict):
+    columns = [matrices.item_index[i] for i in itemweight_dict if i in matrices.item_index]
+    if not columns:
+        return np.zeros(len(matrices.recipe_ids), dtype=bool)
+    return np.asarray((matrices.A[:, columns] > 1 + TOLERANCE).sum(axis=1)).ravel() > 0
+
+#重さを登録した食材ごとに (レシピの行, 使用量, 最も近い重さの倍数)
+def _nearest_multiples(matrices, itemweight_dict):
+    for i, info in itemweight_dict.items():
+        if not info.get("weights"):
+            continue
+        rows, coefs = matrices.item_column(i)
+        weight = info["weights"][0]
+        yield rows, coefs, np.array([weight * round(a / weight) for a in coefs])
+
+#1日分あたりの誤差変数 e の (使う場合 - 使わない場合) の差（目的関数への寄与）
+def multiple_delta(matrices, itemweight_dict):
+    delta = np.zeros(len(matrices.recipe_ids))
+    for rows, coefs, nearest in _nearest_multiples(matrices, itemweight_dict):
+        delta[rows] += np.abs(coefs - nearest) - nearest
+    return delta
+
+#使わない時の1日分の誤差変数 e の合計（e >= 最も近い倍数 - x * 使用量 なので、x = 0 でも残る）
+def idle_multiple_error(matrices, itemweight_dict):
+    idle = np.zeros(len(matrices.recipe_ids))
+    for rows, _, nearest in _nearest_multiples(matrices, itemweight_dict):
+        idle[rows] += nearest
+    return idle
+
+
+#入れ替え可能な区分（同じ kind1、主菜なしの日の主食かどうか）。ご飯は週7回まで使えるので対象外
+def swap_class(data):
+    if data['kind2'] == 'ご飯':
+        return None
+    return data['kind1'], data['kind1'] == 'staple' and data['kind2'] in STAPLE_SPECIAL_KIND2
+
+#区分内の各レシピ a が b を支配するか（b の代わりに a を使っても制約を満たし、目的関数が悪くならない）をまとめて判定する
+#栄養素は上下限のあるものは等しく、下限だけなら以上、上限だけなら以下
+#食材はどの食材も使用量が b 以下（使う食材が b の使う食材に含まれる）
+def dominators_of(b, values, has_lower, has_upper, usage, delta):
+    diff = values - values[b]
+    ok = ~((diff < -TOLERANCE) & has_lower).any(axis=1)
+    ok &= ~((diff > TOLERANCE) & has_upper).any(axis=1)
+    ok &= ~(usage > usage[b] + TOLERANCE).any(axis=1)
+    ok &= delta <= delta[b] + TOLERANCE
+    return ok
+
+#支配するレシピが日数以上あるレシピを除く
+#週に同じ区分から選ぶのは日数以下なので、使われていない支配レシピと必ず入れ替えられる
+#（値が同じ組は並び順が先のものを優位とし、入れ替えが循環しないようにする）
+def dominated(recipe_ids, recipe_dict, values, bounds, matrices, delta, n_days, candidates):
+    removed = np.zeros(len(recipe_ids), dtype=bool)
+    has_lower = np.array([lower is not None for lower, _ in bounds], dtype=bool)
+    has_upper = np.array([upper is not None for _, upper in bounds], dtype=bool)
+    groups = {}
+    for row in np.flatnonzero(candidates):
+        key = swap_class(recipe_dict[recipe_ids[row]]['data'])
+        if key is not None:
+            groups.setdefault(key, []).append(row)
+
+    for rows in groups.values():
+        if len(rows) <= n_days:
+            continue
+        rows = np.array(rows)
+        group_values = values[rows]
+        usage = matrices.A[rows].toarray()
+        group_delta = delta[rows]
+        for pos, b in enumerate(rows):
+            better = dominators_of(pos, group_values, has_lower, has_upper, usage, group_delta)
+            better[pos] = False
+            # 互いに支配し合う（全く同じ）レシピは並び順が後のものを数えない
+            for other in np.flatnonzero(better):
+                if other > pos and dominators_of(other, group_values, has_lower, has_upper, usage, group_delta)[pos]:
+                    better[other] = False
+            if better.sum() >= n_days:
+                removed[b] = True
+    return removed
+
+
+#候補レシピに絞った build_args と、除いたレシピの内訳を返す
+def presolve(build_args):
+    recipe_ids = list(build_args['recipe_ids'])
+    recipe_dict = build_args['recipe_dict']
+    matrices = build_matrices(recipe_ids, build_args['recipeitem_dict'], build_args['filtered_recipe_nutritions'])
+
+    nutritionals = next(iter(build_args['nutritionaltarget_dict'].values()))['nutritionals']
+    nut_keys = PFC_KEYS + OTHER_KEYS if build_args['use_pfc'] else OTHER_KEYS
+    bounds = {nut: nutrition_bounds(nut, nutritionals, build_args['menstruation']) for nut in nut_keys}
+    bounds = {nut: b for nut, b in bounds.items() if b is not None}
+    values = np.zeros((len(recipe_ids), len(bounds)))
+    for k, nut in enumerate(bounds):
+        rows, coefs = matrices.nutrient_column(nut)
+        values[rows, k] = coefs
+    bounds = list(bounds.values())
+
+    itemweight_dict = build_args['itemweight_dict']
+    over_nutrition = over_upper(values, bounds)
+    over_weight = over_item_used(matrices, itemweight_dict) & ~over_nutrition
+    candidates = ~(over_nutrition | over_weight)
+    delta = multiple_delta(matrices, itemweight_dict)
+    removed = dominated(recipe_ids, recipe_dict, values, bounds, matrices, delta, len(build_args['days']), candidates)
+    candidates &= ~removed
+
+    kept = [r for r, keep in zip(recipe_ids, candidates) if keep]
+    offset = WEIGHT_MULTIPLE * len(build_args['days']) * idle_multiple_error(matrices, itemweight_dict)[~candidates].sum()
+    # 登録食材の y_regist は使わなくても1にできるので、モデルの食材にある限り -WEIGHT_REGIST が付く
+    recipeitem_dict = build_args['recipeitem_dict']
+    kept_items = {i for r in kept for i, v in recipeitem_dict.get(r, {}).items() if v}
+    all_items = {i for items in recipeitem_dict.values() for i, v in items.items() if v}
+    offset -= WEIGHT_REGIST * sum(1 for i in build_args['regist_item'] if i in all_items and i not in kept_items)
+    report = {
+        'recipes': len(recipe_ids),
+        'candidates': len(kept),
+        'over_nutrition': int(over_nutrition.sum()),
+        'over_item_used': int(over_weight.sum()),
+        'dominated': int(removed.sum()),
+        'objective_offset': float(offset),  # add_objective_offset で目的関数に足す
+    }
+    pruned_args = dict(
+        build_args,
+        recipe_ids=kept,
+        recipeitem_dict={r: build_args['recipeitem_dict'][r] for r in kept if r in build_args['recipeitem_dict']},
+        filtered_recipe_nutritions={r: build_args['filtered_recipe_nutritions'][r] for r in kept if r in build_args['filtered_recipe_nutritions']},
+    )
+    return pruned_args, report
+
+
+#絞り込んだモデルの目的関数に objective_offset を足す（ひな形で使い回すモデルは値だけ書き換える）
+def add_objective_offset(model, offset):
+    if not hasattr(model, 'presolve_offset'):
+        model.presolve_offset = pyo.Param(mutable=True, initialize=0)
+        objective = next(model.component_data_objects(pyo.Objective, active=True))
+        objective.set_value(objective.expr + model.presolve_offset)
+    model.presolve_offset = offset
@@ -0,0 +1,103 @@
+#複数のソルバー設定を並列に実行し、ギャップ以内の解を最初に返したものを採用する
+#解くのに時間がかかるプロファイル（PFC制約を外す高活動の男性など）の待ち時間を、空いているコアで短くする
+import os,json,signal,queue
+import multiprocessing
+from pyomo.environ import SolverFactory
+
+from .optimize import SOLVER_TIME_LIMIT, run_menu_job
+
+# off: 並列実行しない / hard: PFC制約を外すプロファイルのみ / always: 常に並列実行
+SOLVER_RACE = os.environ.get("SOLVER_RACE", "off")
+
+# CBCの戦略・乱数シードを変えた設定（SOLVER_RACE_CONFIGS にJSONで指定すると置き換える）
+RACE_CONFIGS = json.loads(os.environ.get("SOLVER_RACE_CONFIGS", "null")) or [
+    {'label': 'cbc', 'solver': 'cbc', 'options': {}},
+    {'label': 'cbc-seed7', 'solver': 'cbc', 'options': {'randomCbcSeed': 7, 'randomSeed': 7}},
+    {'label': 'cbc-strategy2', 'solver': 'cbc', 'options': {'strategy': 2}},
+    {'label': 'cbc-nocuts', 'solver': 'cbc', 'options': {'cuts': 'off', 'randomCbcSeed': 13}},
+]
+
+# インストールされていれば参加させるCBC以外のソルバー
+OTHER_SOLVERS = ['appsi_highs', 'gurobi', 'cplex', 'scip', 'glpk']
+
+_race_configs = None
+
+
+def should_race(build_args):
+    if SOLVER_RACE == 'always':
+        return True
+    return SOLVER_RACE == 'hard' and not build_args['use_pfc']
+
+def race_configs():
+    global _race_configs
+    if _race_configs is None:
+        configs = list(RACE_CONFIGS)
+        for name in OTHER_SOLVERS:
+            try:
+                available = SolverFactory(name).available(exception_flag=False)
+            except Exception:
+                available = False
+            if available:
+                configs.append({'label': name, 'solver': name, 'options': {}})
+        _race_configs = configs
+    return _race_configs
+
+
+def _racer(results, config, build_args, warm_starts):
+    # CBCなどの子プロセスもまとめて止められるよう、新しいプロセスグループで実行する
+    os.setpgrp()
+    try:
+        result = run_menu_job(build_args, warm_starts, solver_config=config, tee=False)
+    except Exception as e:
+        result = {'ok': False, 'status': 'error', 'day_menus': {}, 'message': f"ソルバー実行エラー: {e}"}
+    result['solver'] = config['label']
+    results.put(result)
+
+def _kill(process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+    process.join()
+
+#ギャップを満たさずに終わった解の優先順: ソルバーの解 → ヒューリスティックの献立、それぞれ目的関数の小さい順（値の無いものは最後）
+def fallback_rank(result):
+    objective = result.get('objective')
+    return (result['status'] == 'heuristic', objective is None, objective if objective is not None else 0)
+
+
+#run_menu_job と同じ形の結果を返す。ギャップを満たさずに終わった解しかなければ目的関数が最小のものを返す
+def race_menu_job(build_args, warm_starts=None, catalog_version=None):
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    processes = []
+    for config in race_configs():
+        p = ctx.Process(target=_racer, args=(results, config, build_args, warm_starts))
+        p.start()
+        processes.append(p)
+
+    fallback = None
+    failures = []
+    try:
+        for _ in processes:
+            try:
+                result = results.get(timeout=SOLVER_TIME_LIMIT * 2)
+            except queue.Empty:
+                break
+            print(f"並列実行 {result['solver']}: {result['status']}")
+            if result['ok'] and result['status'] == 'optimal':
+                return result
+            if result['ok']:
+                if fallback is None or fallback_rank(result) < fallback_rank(fallback):
+                    fallback = result
+            else:
+                failures.append(result)
+    finally:
+        for p in processes:
+            _kill(p)
+
+    if fallback is not None:
+        return fallback
+    if failures:
+        return failures[0]
+    return {'ok': False, 'status': 'error', 'day_menus': {}, 'message': "ソルバーから結果が返りませんでした"}
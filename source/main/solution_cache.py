@@ -0,0 +1,55 @@
+#最適化の入力が同じリクエストの解を使い回すキャッシュ
+#キーは入力（カタログのバージョン・定式化・栄養目標・use_pfc・月経・登録食材）を正規化したもののハッシュ
+#ワーカーごとのLRU（メモリ）と、ワーカー間で共有するDBの表（menuapp.MenuSolution）の2段で持つ
+import os,json,hashlib,time,threading
+from collections import OrderedDict
+
+SOLUTION_CACHE_SIZE = int(os.environ.get("SOLUTION_CACHE_SIZE", 256))  # ワーカーごとの件数
+SOLUTION_CACHE_TTL = int(os.environ.get("SOLUTION_CACHE_TTL", 7 * 24 * 3600))  # 有効期間(秒)
+REGIST_DIGITS = int(os.environ.get("REGIST_DIGITS", 0))  # 登録量を丸める桁（0ならg単位）
+
+_cache = OrderedDict()  # キー → (作成時刻, 献立)
+_lock = threading.Lock()  # ジョブ終了のコールバックのスレッドからも更新する
+
+
+#登録食材を名前順に並べ、量を丸める（モデルにもこの値を渡すので、キーが同じなら入力も同じ）
+def normalize_regist_item(regist_item):
+    return {item: round(float(amount), REGIST_DIGITS) for item, amount in sorted((regist_item or {}).items())}
+
+def solution_key(catalog_version, formulation, build_args):
+    nutritionals = next(iter(build_args['nutritionaltarget_dict'].values()))['nutritionals']
+    canonical = {
+        'catalog': catalog_version,
+        'formulation': formulation,
+        'nutritionals': nutritionals,
+        'use_pfc': build_args['use_pfc'],
+        # 月経は 'あり' とそれ以外の2通りしかモデルに影響しない
+        'menstruation': 'あり' if build_args['menstruation'] == 'あり' else 'なし',
+        'regist_item': normalize_regist_item(build_args['regist_item']),
+        'days': list(build_args['days']),
+    }
+    text = json.dumps(canonical, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.md5(text.encode('utf-8')).hexdigest()
+
+
+def expired(created_at, now=None):
+    return (now or time.time()) - created_at > SOLUTION_CACHE_TTL
+
+def get(key):
+    with _lock:
+        entry = _cache.get(key)
+        if entry is None:
+            return None
+        created_at, day_menus = entry
+        if expired(created_at):
+            del _cache[key]
+            return None
+        _cache.move_to_end(key)
+        return day_menus
+
+def put(key, day_menus, created_at=None):
+    with _lock:
+        _cache[key] = (created_at or time.time(), day_menus)
+        _cache.move_to_end(key)
+        while len(_cache) > SOLUTION_CACHE_SIZE:
+            _cache.popitem(last=False)
@@ -0,0 +1,105 @@
+#献立の1品だけを入れ替える
+#他の曜日・料理は固定し、指定した枠に入るレシピだけを選び直す（1枠なので候補を全部評価すれば厳密に解ける）
+#制約・目的関数は api_pyomo_model4.build_model と同じ
+import numpy as np
+
+from .matrix_model import build_matrices, nutrition_bounds, PFC_KEYS, OTHER_KEYS, STAPLE_SPECIAL_KIND2, WEIGHT_ITEM, WEIGHT_MULTIPLE
+from .presolve import multiple_delta
+
+TOLERANCE = 1e-6
+
+
+def _slot_class(data):
+    # 主食は主菜なしの日（ご飯もの等）かどうかも合わせる
+    return data['kind1'], data['kind1'] == 'staple' and data['kind2'] in STAPLE_SPECIAL_KIND2
+
+def _recipe_row(position, r):
+    if r in position:
+        return position[r]
+    try:
+        return position.get(int(r))
+    except (TypeError, ValueError):
+        return None
+
+
+#day_menus の menu{day} の kind1 を入れ替えた結果を run_menu_job と同じ形の dict で返す
+def swap_dish(build_args, day_menus, day, kind1, matrices=None):
+    recipe_ids = build_args['recipe_ids']
+    recipe_dict = build_args['recipe_dict']
+    if matrices is None:
+        matrices = build_matrices(recipe_ids, build_args['recipeitem_dict'], build_args['filtered_recipe_nutritions'])
+    position = {r: k for k, r in enumerate(matrices.recipe_ids)}
+
+    menu_name = f"menu{day}"
+    current = (day_menus.get(menu_name) or {}).get(kind1)
+    if current is None:
+        return {'ok': False, 'message': "入れ替える料理が献立にありません"}
+
+    # 入れ替える枠以外の週のレシピ（行番号）
+    fixed = []
+    for name, menu in day_menus.items():
+        for k, r in (menu or {}).items():
+            if r is None or (name == menu_name and k == kind1):
+                continue
+            row = _recipe_row(position, r)
+            if row is None:
+                return {'ok': False, 'message': "献立のレシピがカタログにありません"}
+            fixed.append(row)
+    current_row = _recipe_row(position, current)
+    if current_row is None:
+        return {'ok': False, 'message': "献立のレシピがカタログにありません"}
+
+    # 候補: 同じ区分で、週の他の料理に使っていないもの（RecipeUsage: どのレシピも週1回まで）
+    slot = _slot_class(recipe_dict[matrices.recipe_ids[current_row]]['data'])
+    fixed_set = set(fixed)
+    candidates = np.array([
+        row for row, r in enumerate(matrices.recipe_ids)
+        if row != current_row and row not in fixed_set and _slot_class(recipe_dict[r]['data']) == slot
+    ], dtype=int)
+    if len(candidates) == 0:
+        return {'ok': False, 'message': "入れ替えられるレシピがありません"}
+    fixed_rows = np.array(fixed, dtype=int)
+    feasible = np.ones(len(candidates), dtype=bool)
+
+    # 栄養素の週の上下限
+    nutritionals = next(iter(build_args['nutritionaltarget_dict'].values()))['nutritionals']
+    nut_keys = PFC_KEYS + OTHER_KEYS if build_args['use_pfc'] else OTHER_KEYS
+    for nut in nut_keys:
+        bounds = nutrition_bounds(nut, nutritionals, build_args['menstruation'])
+        if bounds is None:
+            continue
+        column = np.zeros(len(matrices.recipe_ids))
+        rows, coefs = matrices.nutrient_column(nut)
+        column[rows] = coefs
+        total = column[fixed_rows].sum() + column[candidates]
+        if bounds[0] is not None:
+            feasible &= total >= bounds[0] - TOLERANCE
+        if bounds[1] is not None:
+            feasible &= total <= bounds[1] + TOLERANCE
+
+    # 食材の週の使用量: 登録食材は登録量以下、重さを登録した食材は item_used（0/1）以下
+    usage = matrices.A[fixed_rows].sum(axis=0).A.ravel() if len(fixed_rows) else np.zeros(len(matrices.items))
+    candidate_usage = matrices.A[candidates].toarray()
+    limits = {i: float(amount) for i, amount in build_args['regist_item'].items()}
+    for i in build_args['itemweight_dict']:
+        limits[i] = min(limits.get(i, 1.0), 1.0)
+    for i, limit in limits.items():
+        j = matrices.item_index.get(i)
+        if j is not None:
+            feasible &= usage[j] + candidate_usage[:, j] <= limit + TOLERANCE
+
+    if not feasible.any():
+        return {'ok': False, 'message': "栄養素・登録食材の条件を満たす入れ替え先がありません"}
+
+    # 目的関数: 週に使う食材の種類数 + 重さの倍数からの誤差（登録食材の項は入れ替えで変わらない）
+    delta = multiple_delta(matrices, build_args['itemweight_dict'])
+    used = usage > 0
+    new_items = ((candidate_usage > 0) & ~used).sum(axis=1)
+    cost = WEIGHT_ITEM * new_items + WEIGHT_MULTIPLE * delta[candidates]
+    cost = np.where(feasible, cost, np.inf)
+    best = candidates[int(np.argmin(cost))]
+
+    recipe_id = matrices.recipe_ids[best]
+    swapped = {name: dict(menu or {}) for name, menu in day_menus.items()}
+    swapped[menu_name][kind1] = recipe_id
+    return {'ok': True, 'day_menus': swapped, 'recipeId': recipe_id, 'message': None}
@@ -0,0 +1,117 @@
+#プロファイルごとのモデルのひな形（ソルバー用のワーカープロセスごとに保持する）
+#モデルの構造はカタログ・use_pfc・どの栄養素に上下限があるかだけで決まり、
+#登録食材の量と栄養素の上下限は右辺が変わるだけなので、可変Paramにして書き換えて解き直す
+import os,json,hashlib
+from collections import OrderedDict
+import pyomo.environ as pyo
+from pyomo.common.fileutils import Executable
+
+from .matrix_model import PFC_KEYS, OTHER_KEYS, WEIGHT_REGIST, nutrition_bounds
+
+# 永続ソルバー（appsi_cbc / appsi_highs）。使えない場合は通常のソルバーでひな形を解く
+# appsi_cbc は初期解を受け取れないので、初期解がある時も通常のソルバー（CBC）で解く（optimize.run_menu_job）
+TEMPLATE_SOLVER = os.environ.get("TEMPLATE_SOLVER", "appsi_cbc")
+TEMPLATE_CACHE_SIZE = int(os.environ.get("TEMPLATE_CACHE_SIZE", 4))
+
+_templates = OrderedDict()
+
+
+def _request_bounds(build_args):
+    nutritionals = next(iter(build_args['nutritionaltarget_dict'].values()))['nutritionals']
+    nut_keys = PFC_KEYS + OTHER_KEYS if build_args['use_pfc'] else OTHER_KEYS
+    return {nut: nutrition_bounds(nut, nutritionals, build_args['menstruation']) for nut in nut_keys}
+
+#構造が同じリクエストは同じキーになる（上下限の値・登録食材はキーに含めない）
+#候補レシピを絞り込んだ場合（presolve.py）はレシピの組もキーに含める
+def template_key(formulation, catalog_version, build_args):
+    pattern = tuple(
+        (nut, None if b is None else (b[0] is not None, b[1] is not None))
+        for nut, b in _request_bounds(build_args).items()
+    )
+    recipes = hashlib.md5(json.dumps(list(build_args['recipe_ids']), default=str).encode('utf-8')).hexdigest()
+    return (formulation, catalog_version, build_args['use_pfc'], pattern, recipes)
+
+
+def build_template(build_model, build_args):
+    # カタログで使われる全食材を登録食材として作り、リクエストごとに有効・無効を切り替える
+    universe = sorted({i for items in build_args['recipeitem_dict'].values() for i, v in items.items() if v})
+    model = build_model(**dict(build_args, regist_item={i: 0 for i in universe}))
+
+    # 右辺0で作った制約の右辺を Param に置き換える
+    model.regist_amount = pyo.Param(list(model.RegistItemBalance.keys()), mutable=True, initialize=0)
+    for i, c in model.RegistItemBalance.items():
+        c.set_value(c.body == model.regist_amount[i])
+
+    nut_keys = list(model.NutritionConstraints.keys())
+    model.nut_lower = pyo.Param(nut_keys, mutable=True, initialize=0)
+    model.nut_upper = pyo.Param(nut_keys, mutable=True, initialize=0)
+    for nut, c in model.NutritionConstraints.items():
+        c.set_value(pyo.inequality(
+            model.nut_lower[nut] if c.has_lb() else None,
+            c.body,
+            model.nut_upper[nut] if c.has_ub() else None,
+        ))
+
+    # 登録されていない食材の y_regist は1に固定するので、その分の -WEIGHT_REGIST を打ち消す
+    model.regist_offset = pyo.Param(mutable=True, initialize=0)
+    model.obj.set_value(model.obj.expr + model.regist_offset)
+    return model
+
+
+#リクエストの登録食材・栄養素の上下限をひな形に反映する
+def apply_request(model, build_args):
+    regist_item = build_args['regist_item']
+    for nut, bounds in _request_bounds(build_args).items():
+        if bounds is None or nut not in model.nut_lower:
+            continue
+        model.nut_lower[nut] = bounds[0] if bounds[0] is not None else 0
+        model.nut_upper[nut] = bounds[1] if bounds[1] is not None else 0
+
+    for i in model.regist_amount:
+        if i in regist_item:
+            model.regist_amount[i] = float(regist_item[i])
+            model.RegistItemBalance[i].activate()
+            model.Unused[i].unfix()
+        else:
+            model.regist_amount[i] = 0
+            model.RegistItemBalance[i].deactivate()
+            model.Unused[i].fix(0)
+
+    unregistered = 0
+    for i in model.RegistIngredients:
+        if i in regist_item:
+            model.YRegistConstraint[i].activate()
+            model.y_regist[i].unfix()
+        else:
+            model.YRegistConstraint[i].deactivate()
+            model.y_regist[i].fix(1)
+            unregistered += 1
+    model.regist_offset = WEIGHT_REGIST * unregistered
+
+
+def make_template_solver(cbc_path, time_limit, ratio_gap):
+    solver = pyo.SolverFactory(TEMPLATE_SOLVER)
+    if TEMPLATE_SOLVER == 'appsi_cbc':
+        solver.config.executable = Executable(cbc_path)  # 文字列のままだと available() で落ちる
+        solver.options['ratioGap'] = ratio_gap
+    elif TEMPLATE_SOLVER == 'appsi_highs':
+        solver.options['mip_rel_gap'] = ratio_gap
+    solver.config.time_limit = time_limit
+    # レガシーI/Fの available() は既定で例外を投げるので、使えなければ None を返す
+    if not solver.available(exception_flag=False):
+        return None
+    return solver
+
+
+#ひな形と永続ソルバーの組を返す（なければ作ってキャッシュする）
+def get_template(key, build_model, build_args, make_solver):
+    entry = _templates.get(key)
+    if entry is None:
+        entry = (build_template(build_model, build_args), make_solver())
+        _templates[key] = entry
+        while len(_templates) > TEMPLATE_CACHE_SIZE:
+            _templates.popitem(last=False)
+    _templates.move_to_end(key)
+    model, solver = entry
+    apply_request(model, build_args)
+    return model, solver
@@ -0,0 +1,90 @@
+#テスト用の小さなカタログ（3日分。Flask・DBを使わず build_args を直接作る）
+import pytest
+import pyomo.environ as pyo
+
+DAYS = [1, 2, 3]
+
+# recipeId: (kind1, kind2, {食材: 使用量(g)}, カロリー, 鉄)
+RECIPES = {
+    101: ('staple', 'パン', {'小麦粉': 80, '塩': 0.3}, 250, 0.5),
+    102: ('staple', 'パン', {'小麦粉': 90}, 260, 0.6),
+    103: ('staple', '麺', {'小麦粉': 100, '玉ねぎ': 20}, 240, 0.4),
+    104: ('staple', 'カレー', {'米': 150, '玉ねぎ': 50, '鶏肉': 80}, 520, 2.0),
+    105: ('staple', 'ご飯もの', {'米': 150, 'たまねぎ': 40, '卵': 0.5}, 500, 1.5),
+    201: ('main', '肉', {'鶏肉': 100, '玉ねぎ': 30}, 210, 1.5),
+    202: ('main', '肉', {'鶏肉': 120}, 230, 1.6),
+    203: ('main', '卵', {'卵': 60, 'にんじん': 20, 'しょうが': 5}, 200, 1.8),  # 重さを登録した食材を1gより多く使う
+    204: ('main', '魚', {'鮭': 90}, 190, 1.2),
+    301: ('side', 'サラダ', {'にんじん': 40, '塩': 0.3}, 80, 1.0),
+    302: ('side', 'サラダ', {'キャベツ': 60}, 80, 1.1),
+    303: ('side', '和え物', {'ほうれん草': 50}, 80, 1.4),
+    304: ('side', '和え物', {'にんじん': 30, 'キャベツ': 30}, 80, 1.2),
+    305: ('side', 'サラダ', {'にんじん': 40, 'キャベツ': 60, 'ほうれん草': 50}, 80, 0.9),  # 302・303・304 に支配される
+    401: ('soup', '味噌汁', {'豆腐': 50, '塩': 0.3}, 60, 0.5),
+    402: ('soup', 'スープ', {'玉ねぎ': 30}, 50, 0.3),
+    403: ('soup', '味噌汁', {'わかめ': 10, '豆腐': 30}, 55, 0.6),
+    404: ('soup', 'スープ', {'にんじん': 20, 'キャベツ': 20}, 45, 0.4),
+}
+
+
+def tiny_build_args(regist_item=None, menstruation='なし', calorie=1800, iron=9.0):
+    return {
+        'days': list(DAYS),
+        'recipe_dict': {r: {'recipeId': r, 'data': {'kind1': k1, 'kind2': k2, 'recipeTitle': f"recipe{r}"}}
+                        for r, (k1, k2, _, _, _) in RECIPES.items()},
+        'recipe_ids': list(RECIPES),
+        'recipeitem_dict': {r: dict(items) for r, (_, _, items, _, _) in RECIPES.items()},
+        'filtered_recipe_nutritions': {r: {'カロリー(kcal)': float(kcal), '鉄(mg)': float(fe)}
+                                       for r, (_, _, _, kcal, fe) in RECIPES.items()},
+        'nutritionaltarget_dict': {0: {'nutritionals': {'カロリー': calorie, '鉄_下限': iron},
+                                       'userInfo': {'年齢': '30~49(歳)', '性別': '女性', '運動レベル': 'ふつう'}}},
+        'itemweight_dict': {
+            '卵': {'itemName': '卵', 'weights': [50], 'kind1': ''},
+            '塩': {'itemName': '塩', 'weights': [0.2], 'kind1': ''},
+        },
+        'itemequal_dict': {'玉ねぎ': {'itemName': '玉ねぎ', 'equals': ['たまねぎ']}},
+        'menstruation': menstruation,
+        'regist_item': dict(regist_item or {}),
+        'use_pfc': True,
+    }
+
+
+@pytest.fixture
+def build_args():
+    return tiny_build_args()
+
+
+#週の合計（栄養素・食材）を献立から計算する
+def menu_recipes(day_menus):
+    return [r for menu in day_menus.values() for r in (menu or {}).values()]
+
+def weekly_total(build_args, day_menus, key):
+    return sum(build_args['filtered_recipe_nutritions'][r].get(key, 0) for r in menu_recipes(day_menus))
+
+#献立の構成ルールと栄養素の上下限を満たすか
+def assert_valid_menu(build_args, day_menus):
+    assert sorted(day_menus) == [f"menu{d}" for d in build_args['days']]
+    recipes = menu_recipes(day_menus)
+    assert len(recipes) == len(set(recipes)), "同じレシピを週に2回使っている"
+    for menu in day_menus.values():
+        kinds = {k: build_args['recipe_dict'][r]['data'] for k, r in menu.items()}
+        assert kinds['staple']['kind1'] == 'staple'
+        assert kinds['side']['kind1'] == 'side' and kinds['soup']['kind1'] == 'soup'
+        assert ('main' in menu) != (kinds['staple']['kind2'] in {'ご飯もの', 'パスタ', 'カレー', '鍋'})
+    nutritionals = build_args['nutritionaltarget_dict'][0]['nutritionals']
+    calorie = weekly_total(build_args, day_menus, 'カロリー(kcal)')
+    assert nutritionals['カロリー'] * 0.9 - 1e-6 <= calorie <= nutritionals['カロリー'] * 1.1 + 1e-6
+    assert weekly_total(build_args, day_menus, '鉄(mg)') >= nutritionals['鉄_下限'] - 1e-6
+
+
+def highs():
+    solver = pyo.SolverFactory('appsi_highs')
+    if not solver.available(exception_flag=False):
+        pytest.skip("HiGHS (highspy) がありません")
+    return solver
+
+#HiGHSで解いて目的関数の値を返す
+def solve_value(model):
+    results = highs().solve(model)
+    assert str(results.solver.termination_condition) == 'optimal'
+    return pyo.value(next(model.component_data_objects(pyo.Objective, active=True)))
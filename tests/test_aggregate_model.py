@@ -0,0 +1,31 @@
+import pyomo.environ as pyo
+
+from source.main import formulations
+from source.main.aggregate_model import build_model, extract_day_menus
+from conftest import assert_valid_menu, solve_value
+
+
+def test_same_optimum_as_model4(build_args):
+    aggregate = build_model(**build_args)
+    model4 = formulations.get('model4').build(**build_args)
+    assert abs(solve_value(aggregate) - solve_value(model4)) < 1e-6
+
+
+def test_extract_day_menus_is_valid_and_deterministic(build_args):
+    model = build_model(**build_args)
+    solve_value(model)
+    day_menus = extract_day_menus(model)
+    assert_valid_menu(build_args, day_menus)
+    assert extract_day_menus(model) == day_menus
+
+
+def test_special_staples_are_spread_over_the_week(build_args):
+    # ご飯もの等の主食を2品選ばせると、主菜なしの日が続かないように割り当てる
+    build_args['days'] = [1, 2, 3, 4]
+    build_args['nutritionaltarget_dict'][0]['nutritionals']['カロリー'] = 2500
+    model = build_model(**build_args)
+    model.SpecialCount = pyo.Constraint(expr=sum(model.n[r] for r in model.StapleSpecialRecipes) == 2)
+    solve_value(model)
+    day_menus = extract_day_menus(model)
+    special = [d for d, menu in sorted(day_menus.items()) if 'main' not in menu]
+    assert special == ['menu2', 'menu4']
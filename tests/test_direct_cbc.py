@@ -0,0 +1,91 @@
+import os
+import numpy as np
+import pytest
+
+from source.main import direct_cbc, formulations
+from source.main.optimize import CBC_PATH
+from source.main.presolve import presolve
+from conftest import tiny_build_args, assert_valid_menu, solve_value
+
+highspy = pytest.importorskip('highspy')
+
+
+#MPSをHiGHSで読んで解き、(目的関数の値, 列の値) を返す
+def solve_mps(path):
+    h = highspy.Highs()
+    h.setOptionValue('output_flag', False)
+    h.readModel(str(path))
+    h.run()
+    assert h.modelStatusToString(h.getModelStatus()) == 'Optimal'
+    values = np.array(h.getSolution().col_value)
+    return h.getInfo().objective_function_value, values
+
+
+#CBCの解ファイルと同じ形式で書き出す
+def write_cbc_solution(path, header, values):
+    with open(path, 'w') as f:
+        f.write(header + "\n")
+        for j, v in enumerate(values):
+            if v != 0:
+                f.write(f"{'** ' if j == 0 else ''}{j} C{j} {v} 0\n")
+
+
+@pytest.mark.parametrize('regist_item', [{}, {'鶏肉': 150, 'にんじん': 40}])
+def test_mps_matches_model4(tmp_path, regist_item):
+    build_args = tiny_build_args(regist_item=regist_item)
+    model = direct_cbc.build_direct_model(build_args)
+    path = tmp_path / 'menu.mps'
+    direct_cbc.write_mps(model, path)
+    objective, values = solve_mps(path)
+    # 目的関数の定数項（OBJCONST の列）も含めて Pyomo のモデルと同じ値になる
+    assert abs(objective - solve_value(formulations.get('model4').build(**build_args))) < 1e-6
+    assert_valid_menu(build_args, model.day_menus(values[:model.n_cols]))
+
+
+def test_mps_keeps_the_presolve_offset(tmp_path):
+    build_args = tiny_build_args(regist_item={'しょうが': 10})
+    pruned, report = presolve(build_args)
+    model = direct_cbc.build_direct_model(pruned)
+    model.objective_constant += report['objective_offset']
+    path = tmp_path / 'menu.mps'
+    direct_cbc.write_mps(model, path)
+    objective, _ = solve_mps(path)
+    assert abs(objective - solve_value(formulations.get('model4').build(**build_args))) < 1e-6
+
+
+def test_read_solution_round_trip(tmp_path, build_args):
+    model = direct_cbc.build_direct_model(build_args)
+    mps = tmp_path / 'menu.mps'
+    direct_cbc.write_mps(model, mps)
+    objective, values = solve_mps(mps)
+    values = values[:model.n_cols]
+
+    sol = tmp_path / 'menu.sol'
+    write_cbc_solution(sol, f"Optimal - objective value {objective}", values)
+    status, read_objective, read_values = direct_cbc.read_solution(sol, model.n_cols)
+    assert status == 'optimal' and abs(read_objective - objective) < 1e-9
+    assert np.allclose(read_values, values)
+    assert model.day_menus(read_values) == model.day_menus(values)
+
+    write_cbc_solution(sol, "Stopped on time - objective value 500.5", values)
+    assert direct_cbc.read_solution(sol, model.n_cols)[0] == 'maxTimeLimit'
+    write_cbc_solution(sol, "Infeasible - objective value 0", [])
+    assert direct_cbc.read_solution(sol, model.n_cols) == ('infeasible', None, None)
+
+
+def test_mipstart_is_readable_as_a_solution(tmp_path, build_args):
+    model = direct_cbc.build_direct_model(build_args)
+    start = {model.x_column(1, 101): 1, model.x_column(1, 201): 1, model.x_column(2, 301): 0}
+    path = tmp_path / 'menu.start'
+    direct_cbc.write_mipstart(start, path)
+    _, _, values = direct_cbc.read_solution(path, model.n_cols)
+    assert {j: values[j] for j in start} == start
+
+
+@pytest.mark.skipif(not os.path.exists(CBC_PATH), reason="CBC がありません")
+def test_solve_with_cbc(build_args):
+    model = direct_cbc.build_direct_model(build_args)
+    status, objective, values = direct_cbc.solve(model, CBC_PATH, 30, 0.0)
+    assert status == 'optimal'
+    assert abs(objective - solve_value(formulations.get('model4').build(**build_args))) < 1e-6
+    assert_valid_menu(build_args, model.day_menus(values))
@@ -0,0 +1,40 @@
+import pytest
+from pyomo.opt import TerminationCondition
+
+from source.main import formulations
+from source.main.feasibility import check_feasibility
+from conftest import tiny_build_args, highs
+
+
+def _model4_feasible(build_args):
+    model = formulations.get('model4').build(**build_args)
+    results = highs().solve(model, load_solutions=False)
+    return results.solver.termination_condition != TerminationCondition.infeasible
+
+
+def test_feasible_request_passes(build_args):
+    assert check_feasibility(build_args) == []
+    assert _model4_feasible(build_args)
+
+
+@pytest.mark.parametrize('build_args, expected', [
+    (tiny_build_args(calorie=4000), 'カロリー(kcal) は1週間で最大'),
+    (tiny_build_args(calorie=500), 'カロリー(kcal) は1週間で最低でも'),
+    (tiny_build_args(iron=20), '鉄(mg) は1週間で最大'),
+    (tiny_build_args(regist_item={'小麦粉': 10}), '（小麦粉 の登録量より多く使うレシピを除くと）主食・主菜のレシピが足りず'),
+])
+def test_rejected_requests_are_infeasible(build_args, expected):
+    problems = check_feasibility(build_args)
+    assert any(expected in p for p in problems), problems
+    assert not _model4_feasible(build_args)
+
+
+def test_not_enough_recipes_for_the_week():
+    build_args = tiny_build_args(calorie=3600, iron=18)
+    build_args['days'] = [1, 2, 3, 4, 5, 6]
+    problems = check_feasibility(build_args)
+    assert any('副菜のレシピが5品しかなく' in p for p in problems), problems
+
+
+def test_negative_regist_amount():
+    assert check_feasibility(tiny_build_args(regist_item={'卵': -1})) == ["卵 の登録量が負の値です"]
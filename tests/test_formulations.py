@@ -0,0 +1,24 @@
+import pytest
+
+from source.main import formulations
+
+
+def test_registry_loads_quietly(capfd):
+    registry, errors = formulations.load_formulations()
+    out, err = capfd.readouterr()
+    assert 'ERROR' not in out + err
+    assert {'model1', 'model4', 'matrix', 'aggregate'} <= set(registry)
+    assert set(formulations.EXCLUDED) <= set(errors)
+    assert not set(formulations.EXCLUDED) & set(registry)
+
+
+def test_excluded_formulation_reports_reason():
+    with pytest.raises(KeyError, match='予約属性'):
+        formulations.get('model2')
+
+
+@pytest.mark.parametrize('name', ['model1', 'model4', 'matrix', 'aggregate'])
+def test_formulations_build_the_tiny_catalog(name, build_args):
+    formulation = formulations.get(name)
+    model = formulation.build(**build_args)
+    formulation.extract(model)
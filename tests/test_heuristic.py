@@ -0,0 +1,43 @@
+import pyomo.environ as pyo
+
+from source.main import formulations
+from source.main.heuristic import heuristic_menu
+from source.main.optimize import set_warm_start
+from conftest import tiny_build_args, assert_valid_menu, menu_recipes, solve_value
+
+
+#献立を固定したときの model4 の目的関数の値
+def fixed_value(build_args, day_menus):
+    model = formulations.get('model4').build(**build_args)
+    set_warm_start(model, day_menus)
+    for v in model.x.values():
+        v.fix()
+    return solve_value(model)
+
+
+def test_heuristic_menu_is_feasible(build_args):
+    result = heuristic_menu(build_args, time_limit=0.2)
+    assert result['ok'], result['message']
+    assert_valid_menu(build_args, result['day_menus'])
+    assert 203 not in menu_recipes(result['day_menus'])  # 卵を1gより多く使う（item_used は0/1）
+
+
+def test_heuristic_menu_is_feasible_for_model4(build_args):
+    # 献立を固定した model4 が解ける（制約を満たす）こと。値は最適値以上になる
+    result = heuristic_menu(build_args, time_limit=0.2)
+    optimum = solve_value(formulations.get('model4').build(**build_args))
+    assert fixed_value(build_args, result['day_menus']) >= optimum - 1e-6
+
+
+def test_heuristic_with_registered_items():
+    build_args = tiny_build_args(regist_item={'鶏肉': 200, 'キャベツ': 60})
+    result = heuristic_menu(build_args, time_limit=0.2)
+    assert result['ok'], result['message']
+    assert_valid_menu(build_args, result['day_menus'])
+    usage = sum(build_args['recipeitem_dict'][r].get('鶏肉', 0) for r in menu_recipes(result['day_menus']))
+    assert usage <= 200
+
+
+def test_heuristic_reports_unreachable_targets():
+    result = heuristic_menu(tiny_build_args(calorie=4000), time_limit=0.1)
+    assert not result['ok'] and result['status'] == 'heuristic'
@@ -0,0 +1,41 @@
+import threading
+
+from source.main import metrics
+
+THREADS = 8
+REPEAT = 5000
+
+
+def _run_threads(target):
+    threads = [threading.Thread(target=target) for _ in range(THREADS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def test_counter_does_not_lose_increments():
+    counter = metrics.Counter('test_threads_total', 'test', ['status'])
+    _run_threads(lambda: [counter.inc(status='optimal') for _ in range(REPEAT)])
+    assert f'test_threads_total{{status="optimal"}} {THREADS * REPEAT}' in counter.render()
+
+
+def test_histogram_counts_every_observation_while_rendering():
+    histogram = metrics.Histogram('test_threads_seconds', 'test', ['phase'])
+    stop = threading.Event()
+
+    def render_loop():
+        while not stop.is_set():
+            metrics.render()
+
+    renderer = threading.Thread(target=render_loop)
+    renderer.start()
+    try:
+        _run_threads(lambda: [histogram.observe(0.2, phase='solve') for _ in range(REPEAT)])
+    finally:
+        stop.set()
+        renderer.join()
+    lines = histogram.render()
+    assert f'test_threads_seconds_count{{phase="solve"}} {THREADS * REPEAT}' in lines
+    assert f'test_threads_seconds_bucket{{phase="solve",le="0.25"}} {THREADS * REPEAT}' in lines
+    assert f'test_threads_seconds_bucket{{phase="solve",le="0.1"}} 0' in lines
@@ -0,0 +1,113 @@
+from collections import OrderedDict
+import pyomo.environ as pyo
+import pytest
+
+from source.main import optimize, templates
+from conftest import assert_valid_menu, highs
+
+
+class NoWarmStartSolver:
+    """appsi_cbc のレガシーI/Fと同じく warm_start_capable を持たないソルバー"""
+
+    def __init__(self, solver):
+        self._solver = solver
+        self.calls = []
+
+    def solve(self, model, **options):
+        self.calls.append(options)
+        return self._solver.solve(model, **options)
+
+
+class WarmStartSolver(NoWarmStartSolver):
+    """初期解を受け取れるソルバー（受け取った x の初期値も記録する）"""
+
+    def __init__(self, solver):
+        super().__init__(solver)
+        self.starts = []
+
+    def warm_start_capable(self):
+        return True
+
+    def solve(self, model, **options):
+        self.starts.append({idx for idx, v in model.x.items() if v.value is not None and v.value > 0.5})
+        return super().solve(model, **options)
+
+
+@pytest.fixture
+def template_path(monkeypatch):
+    monkeypatch.setattr(optimize, 'MENU_FORMULATION', 'model4')
+    monkeypatch.setattr(optimize, 'USE_MODEL_TEMPLATES', True)
+    monkeypatch.setattr(optimize, 'SOLVER_BACKEND', 'pyomo')
+    monkeypatch.setattr(templates, 'TEMPLATE_SOLVER', 'appsi_highs')
+    monkeypatch.setattr(templates, '_templates', OrderedDict())
+    highs()
+
+
+PREVIOUS = {'menu1': {'staple': 101, 'main': 201, 'side': 301, 'soup': 401},
+            'menu2': {'staple': 102, 'main': 202, 'side': 302, 'soup': 402},
+            'menu3': {'staple': 104, 'side': 304, 'soup': 404}}
+
+
+def _run(build_args):
+    return optimize.run_menu_job(build_args, [('previous', PREVIOUS)], catalog_version='test', tee=False)
+
+
+def _previous_x():
+    return {(int(name[4:]), r) for name, menu in PREVIOUS.items() for r in menu.values()}
+
+
+def test_run_menu_job_through_template(template_path, build_args):
+    result = _run(build_args)
+    assert result['ok'], result['message']
+    assert result['warm_start'] == 'previous'
+    assert len(templates._templates) == 1
+    assert_valid_menu(build_args, result['day_menus'])
+
+    # 2回目は同じひな形を書き換えて解く
+    again = _run(build_args)
+    assert len(templates._templates) == 1
+    assert abs(again['objective'] - result['objective']) < 1e-6
+
+
+def test_template_solver_receives_warm_start(template_path, monkeypatch, build_args):
+    solver = WarmStartSolver(pyo.SolverFactory('appsi_highs'))
+    monkeypatch.setattr(optimize, 'make_template_solver', lambda *args: solver)
+    result = _run(build_args)
+    assert result['ok'], result['message']
+    assert result['warm_start'] == 'previous'
+    assert solver.calls[0]['warmstart'] is True
+    assert solver.starts[0] == _previous_x()
+
+
+def test_template_solver_without_warm_start_support(template_path, monkeypatch, build_args):
+    # 初期解がある時は、初期解を受け取れないひな形のソルバーではなく通常のソルバーで解く
+    template_solver = NoWarmStartSolver(pyo.SolverFactory('appsi_highs'))
+    shell_solver = WarmStartSolver(pyo.SolverFactory('appsi_highs'))
+    monkeypatch.setattr(optimize, 'make_template_solver', lambda *args: template_solver)
+    monkeypatch.setattr(optimize, 'make_solver', lambda config=None: shell_solver)
+    result = _run(build_args)
+    assert result['ok'], result['message']
+    assert result['warm_start'] == 'previous'
+    assert template_solver.calls == []
+    assert shell_solver.calls[0]['warmstart'] is True
+    assert shell_solver.starts[0] == _previous_x()
+    assert_valid_menu(build_args, result['day_menus'])
+
+
+def test_warm_start_label_cleared_when_not_passed(template_path, monkeypatch, build_args):
+    solver = NoWarmStartSolver(pyo.SolverFactory('appsi_highs'))
+    monkeypatch.setattr(optimize, 'make_template_solver', lambda *args: solver)
+    monkeypatch.setattr(optimize, 'make_solver', lambda config=None: solver)
+    result = _run(build_args)
+    assert result['ok'], result['message']
+    assert 'warmstart' not in solver.calls[0]
+    assert result['warm_start'] is None
+
+
+def test_appsi_cbc_template_solver(template_path, monkeypatch, build_args):
+    monkeypatch.setattr(templates, 'TEMPLATE_SOLVER', 'appsi_cbc')
+    if templates.make_template_solver(optimize.CBC_PATH, 10, 0.0) is None:
+        pytest.skip("CBC がありません")
+    result = _run(build_args)
+    assert result['ok'], result['message']
+    assert_valid_menu(build_args, result['day_menus'])
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from source.main import formulations
+from source.main.matrix_model import build_matrices
+from source.main.presolve import presolve, over_item_used, add_objective_offset
+from conftest import tiny_build_args, solve_value
+
+
+def _pruned(build_args):
+    return sorted(set(build_args['recipe_ids']) - set(presolve(build_args)[0]['recipe_ids']))
+
+
+def test_over_item_used(build_args):
+    matrices = build_matrices(build_args['recipe_ids'], build_args['recipeitem_dict'], build_args['filtered_recipe_nutritions'])
+    flagged = np.array(matrices.recipe_ids)[over_item_used(matrices, build_args['itemweight_dict'])]
+    assert flagged.tolist() == [203]
+
+
+def test_dominated_and_over_item_used_are_pruned(build_args):
+    _, report = presolve(build_args)
+    assert _pruned(build_args) == [203, 305]
+    assert (report['over_item_used'], report['dominated'], report['candidates']) == (1, 1, 16)
+
+
+def test_dominated_needs_as_many_dominators_as_days(build_args):
+    build_args['days'] = [1, 2, 3, 4]
+    build_args['nutritionaltarget_dict'][0]['nutritionals']['カロリー'] = 2400
+    assert 305 not in _pruned(build_args)
+
+
+@pytest.mark.parametrize('name', ['model4', 'matrix', 'aggregate'])
+@pytest.mark.parametrize('regist_item', [{}, {'鶏肉': 150, 'にんじん': 40}, {'しょうが': 10}])
+def test_pruning_keeps_the_optimum(name, regist_item):
+    build_args = tiny_build_args(regist_item=regist_item)
+    build = formulations.get(name).build
+    full = solve_value(build(**build_args))
+
+    pruned_args, report = presolve(build_args)
+    pruned = build(**pruned_args)
+    add_objective_offset(pruned, report['objective_offset'])
+    assert report['objective_offset'] != 0
+    assert abs(solve_value(pruned) - full) < 1e-6
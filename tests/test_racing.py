@@ -0,0 +1,24 @@
+from source.main.racing import fallback_rank
+
+
+def _best(results):
+    return min(results, key=fallback_rank)
+
+
+def test_solver_incumbent_preferred_over_heuristic():
+    heuristic = {'status': 'heuristic', 'objective': -100.0}
+    incumbent = {'status': 'maxTimeLimit', 'objective': 5.0}
+    assert _best([heuristic, incumbent]) is incumbent
+
+
+def test_missing_objective_ranked_last():
+    unknown = {'status': 'heuristic', 'objective': None}
+    known = {'status': 'heuristic', 'objective': 3.0}
+    assert _best([unknown, known]) is known
+    assert _best([{'status': 'maxTimeLimit', 'objective': None}, {'status': 'maxTimeLimit', 'objective': 1.0}])['objective'] == 1.0
+
+
+def test_two_heuristic_fallbacks_without_objective():
+    first = {'status': 'heuristic', 'objective': None}
+    second = {'status': 'heuristic', 'objective': None}
+    assert not fallback_rank(second) < fallback_rank(first)
@@ -0,0 +1,47 @@
+import pytest
+
+from source.main.swap import swap_dish
+from conftest import tiny_build_args, assert_valid_menu, weekly_total
+
+MENU = {
+    'menu1': {'staple': 101, 'main': 201, 'side': 301, 'soup': 401},
+    'menu2': {'staple': 102, 'main': 202, 'side': 302, 'soup': 402},
+    'menu3': {'staple': 104, 'side': 304, 'soup': 404},
+}
+
+
+@pytest.mark.parametrize('day, kind1', [(1, 'side'), (2, 'main'), (3, 'staple'), (3, 'soup')])
+def test_swap_keeps_the_rest_and_the_constraints(day, kind1, build_args):
+    result = swap_dish(build_args, MENU, day, kind1)
+    assert result['ok'], result['message']
+    swapped = result['day_menus']
+    assert swapped[f"menu{day}"][kind1] == result['recipeId'] != MENU[f"menu{day}"][kind1]
+    for name, menu in MENU.items():
+        for k, r in menu.items():
+            if (name, k) != (f"menu{day}", kind1):
+                assert swapped[name][k] == r
+    assert_valid_menu(build_args, swapped)
+
+
+def test_swap_does_not_pick_a_recipe_over_item_used(build_args):
+    # 残る主菜の候補は 203 だけで、重さを登録した食材（卵）を1gより多く使うので選べない
+    menu = {name: dict(m) for name, m in MENU.items()}
+    menu['menu3'] = {'staple': 103, 'main': 204, 'side': 303, 'soup': 403}
+    result = swap_dish(build_args, menu, 2, 'main')
+    assert not result['ok']
+
+
+def test_swap_respects_nutrition_bounds():
+    # 鉄の下限ぎりぎりにすると、鉄の少ない副菜には入れ替えられない
+    build_args = tiny_build_args(iron=weekly_total(tiny_build_args(), MENU, '鉄(mg)'))
+    assert swap_dish(build_args, MENU, 1, 'side')['recipeId'] == 303
+
+
+def test_swap_reports_when_nothing_fits():
+    build_args = tiny_build_args(iron=weekly_total(tiny_build_args(), MENU, '鉄(mg)') + 5)
+    result = swap_dish(build_args, MENU, 1, 'side')
+    assert not result['ok'] and '入れ替え先がありません' in result['message']
+
+
+def test_swap_missing_dish(build_args):
+    assert not swap_dish(build_args, MENU, 3, 'main')['ok']